@@ -0,0 +1,112 @@
+"""Fixtures for the benchmarks, and the report of their results."""
+
+from __future__ import annotations
+
+import json
+import shutil
+import subprocess
+from collections.abc import Callable, Iterator
+from pathlib import Path
+from typing import Any
+
+import pytest
+from mock_nrk import MockConfig, MockNRK
+
+from nrkdownload import nrk_tv
+from nrkdownload.metrics import metrics
+
+RESULTS: list[dict[str, Any]] = []
+
+
+def pytest_addoption(parser: pytest.Parser) -> None:  # noqa: D103
+    group = parser.getgroup("benchmark")
+    group.addoption(
+        "--mock-latency",
+        type=float,
+        default=0.02,
+        help="Seconds before each response from the mock server.",
+    )
+    group.addoption(
+        "--mock-bandwidth",
+        type=int,
+        default=None,
+        help="Bytes per second for each response from the mock server.",
+    )
+    group.addoption(
+        "--benchmark-json",
+        type=Path,
+        default=None,
+        help="Write the benchmark results to this JSON file.",
+    )
+
+
+def pytest_terminal_summary(  # noqa: D103
+    terminalreporter: pytest.TerminalReporter, config: pytest.Config
+) -> None:
+    if not RESULTS:
+        return
+    terminalreporter.section("benchmark results")
+    for result in RESULTS:
+        values = ", ".join(
+            f"{key}={value:.3g}" if isinstance(value, float) else f"{key}={value}"
+            for key, value in result.items()
+            if key != "name"
+        )
+        terminalreporter.write_line(f"{result['name']}: {values}")
+    if filename := config.getoption("--benchmark-json"):
+        filename.write_text(json.dumps(RESULTS, indent=2))
+
+
+@pytest.fixture
+def mock_config(request: pytest.FixtureRequest) -> MockConfig:
+    """Network conditions from the command line. Sizes are set by each benchmark."""
+    return MockConfig(
+        latency=request.config.getoption("--mock-latency"),
+        bandwidth=request.config.getoption("--mock-bandwidth"),
+    )
+
+
+@pytest.fixture
+def mock_nrk(
+    mock_config: MockConfig, monkeypatch: pytest.MonkeyPatch
+) -> Iterator[MockNRK]:
+    """Serve the mock API, and point the client at it."""
+    with MockNRK(mock_config) as server:
+        monkeypatch.setattr(nrk_tv.client, "base_url", server.url)
+        monkeypatch.setattr(nrk_tv.client, "cache", None)
+        metrics.reset()
+        yield server
+
+
+@pytest.fixture(scope="session")
+def media_dir(tmp_path_factory: pytest.TempPathFactory) -> Path:
+    """Generate a short fMP4 HLS stream with FFmpeg."""
+    ffmpeg = shutil.which("ffmpeg")
+    if ffmpeg is None:
+        pytest.skip("FFmpeg is needed to generate the HLS media")
+    directory = tmp_path_factory.mktemp("media")
+    subprocess.run(  # noqa: S603
+        [
+            ffmpeg,
+            *("-loglevel", "error", "-y"),
+            *("-f", "lavfi", "-i", "testsrc=duration=24:size=320x180:rate=25"),
+            *("-f", "lavfi", "-i", "sine=duration=24"),
+            *("-c:v", "mpeg4", "-b:v", "400k", "-c:a", "aac"),
+            *("-f", "hls", "-hls_time", "6", "-hls_playlist_type", "vod"),
+            *("-hls_segment_type", "fmp4"),
+            *("-hls_segment_filename", str(directory / "seg%03d.m4s")),
+            str(directory / "media.m3u8"),
+        ],
+        check=True,
+    )
+    return directory
+
+
+@pytest.fixture
+def record() -> Callable[..., None]:
+    """Record a benchmark result, reported at the end of the session."""
+
+    def record(name: str, **values: Any) -> None:  # noqa: ANN401
+        RESULTS.append({"name": name, **values})
+
+    return record
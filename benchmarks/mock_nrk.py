@@ -0,0 +1,251 @@
+"""A local mock of the NRK TV API and its HLS streams, for benchmarks.
+
+The mock serves a sequential series with a configurable number of seasons and
+episodes. The API responses have the same shape as recorded responses from
+psapi.nrk.no, limited to the fields that nrkdownload reads. Every program streams the
+same HLS media, from a directory of fMP4 segments. Each response can be delayed by a
+fixed latency, and sent at a limited bandwidth, to mimic a remote server.
+
+Example:
+>>> with MockNRK(MockConfig(seasons=2, episodes=10)) as server:
+...     nrk_tv.client.base_url = server.url
+"""
+
+from __future__ import annotations
+
+import http.server
+import json
+import re
+import threading
+import time
+import urllib.parse
+from pathlib import Path
+from typing import TYPE_CHECKING, Any
+
+from pydantic import BaseModel
+
+if TYPE_CHECKING:
+    from types import TracebackType
+
+    from typing_extensions import Self
+
+SERIES_ID = "benchmark"
+CHUNK_SIZE = 16 * 1024
+# A tiny JPEG header is enough, the images are never decoded
+IMAGE = b"\xff\xd8\xff\xe0" + bytes(1020)
+
+
+class MockConfig(BaseModel):
+    """The size of the mock series, and the network conditions of the server."""
+
+    seasons: int = 1
+    episodes: int = 10
+    # Seconds before each response is sent
+    latency: float = 0.0
+    # Bytes per second for each response, or None for unlimited
+    bandwidth: int | None = None
+    # Directory with media.m3u8, init.mp4 and the segments of the HLS media
+    media_dir: Path | None = None
+    # Duration of each program, in seconds
+    duration: int = 24
+    # Episodes in each page of a season, or None to list them all in the season
+    page_size: int | None = None
+
+
+def program_id(season: int, episode: int) -> str:
+    """Get the program ID of an episode in the mock series."""
+    return f"MOCK{season:02d}{episode:06d}"
+
+
+class MockNRK:
+    """HTTP server with the mock API and media, in a background thread."""
+
+    def __init__(self, config: MockConfig | None = None) -> None:
+        """Create a server with the given series and network conditions."""
+        self.config = config or MockConfig()
+        self.requests = 0
+        self._lock = threading.Lock()
+        self._server = http.server.ThreadingHTTPServer(
+            ("127.0.0.1", 0), self._handler_class()
+        )
+        self._server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self._server.server_address[1]}"
+        self.routes = [
+            (re.compile(rf"/tv/catalog/series/{SERIES_ID}$"), self.series),
+            (re.compile(r"/tv/catalog/series/\w+/seasons/(\d+)$"), self.season),
+            (
+                re.compile(r"/tv/catalog/series/\w+/seasons/(\d+)/episodes$"),
+                self.episodes,
+            ),
+            (re.compile(r"/tv/catalog/programs/(\w+)$"), self.program),
+            (re.compile(r"/playback/manifest/program/(\w+)$"), self.manifest),
+        ]
+
+    def __enter__(self) -> Self:
+        """Start the server."""
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(
+        self,
+        exc_type: type[BaseException] | None,
+        exc_value: BaseException | None,
+        traceback: TracebackType | None,
+    ) -> None:
+        """Stop the server."""
+        self._server.shutdown()
+        self._server.server_close()
+
+    def image(self, name: str) -> list[dict[str, Any]]:
+        """Get a list of image sizes, as in the API."""
+        return [{"url": f"{self.url}/images/{name}.jpg", "width": 960}]
+
+    def series(self) -> dict[str, Any]:
+        """Get the series, with links to its seasons."""
+        return {
+            "seriesType": "sequential",
+            "sequential": {
+                "titles": {"title": "Benchmark"},
+                "image": self.image("series"),
+                "posterImage": self.image("poster"),
+                "backdropImage": self.image("backdrop"),
+            },
+            "_links": {
+                "seasons": [
+                    {"name": str(season), "title": f"Sesong {season}"}
+                    for season in range(1, self.config.seasons + 1)
+                ]
+            },
+        }
+
+    def season(self, season: str) -> dict[str, Any]:
+        """Get a season, with its episodes or the first page of them."""
+        episodes: list[dict[str, Any]] | dict[str, Any]
+        if self.config.page_size is None:
+            episodes = [
+                {"prfId": program_id(int(season), episode)}
+                for episode in range(1, self.config.episodes + 1)
+            ]
+        else:
+            episodes = self.episodes(season)
+        return {
+            "seriesType": "sequential",
+            "titles": {"title": f"Sesong {season}"},
+            "posterImage": self.image(f"season{season}"),
+            "_embedded": {"episodes": episodes},
+        }
+
+    def episodes(self, season: str, page: str = "1") -> dict[str, Any]:
+        """Get a page of the episodes in a season, with a link to the next page."""
+        page_size = self.config.page_size or self.config.episodes
+        first = (int(page) - 1) * page_size + 1
+        last = min(first + page_size - 1, self.config.episodes)
+        links = {}
+        if last < self.config.episodes:
+            links["next"] = {
+                "href": f"/tv/catalog/series/{SERIES_ID}/seasons/{season}/episodes"
+                f"?page={int(page) + 1}&pageSize={page_size}"
+            }
+        return {
+            "_embedded": {
+                "episodes": [
+                    {"prfId": program_id(int(season), episode)}
+                    for episode in range(first, last + 1)
+                ]
+            },
+            "_links": links,
+        }
+
+    def program(self, program_id: str) -> dict[str, Any]:
+        """Get the metadata of a program."""
+        return {
+            "programInformation": {
+                "titles": {"title": f"Episode {program_id[-6:]}"},
+                "image": self.image(program_id),
+            },
+            "moreInformation": {
+                "productionYear": 2024,
+                "duration": {"seconds": self.config.duration},
+            },
+        }
+
+    def manifest(self, program_id: str) -> dict[str, Any]:
+        """Get the playback manifest of a program."""
+        return {
+            "playability": "playable",
+            "playable": {
+                "assets": [{"url": f"{self.url}/hls/{program_id}/master.m3u8"}],
+                "subtitles": [],
+            },
+        }
+
+    def respond(self, path: str) -> tuple[str, bytes] | None:
+        """Get the content type and body for a path, or None if it is not found."""
+        path, _, query = path.partition("?")
+        path = "/" + path.lstrip("/")
+        # Only the page of the episodes is read from the query
+        params = {
+            key: value for key, value in urllib.parse.parse_qsl(query) if key == "page"
+        }
+        for pattern, route in self.routes:
+            if match := pattern.match(path):
+                body = route(*match.groups(), **params)
+                return "application/json", json.dumps(body).encode()
+        if path.startswith("/images/"):
+            return "image/jpeg", IMAGE
+        if match := re.match(r"/hls/\w+/([\w.]+)$", path):
+            return self.media(match.group(1))
+        return None
+
+    def media(self, name: str) -> tuple[str, bytes] | None:
+        """Get a playlist or segment of the HLS media."""
+        if name == "master.m3u8":
+            return "application/vnd.apple.mpegurl", (
+                b"#EXTM3U\n"
+                b'#EXT-X-STREAM-INF:BANDWIDTH=500000,RESOLUTION=320x180,CODECS="mp4v"\n'
+                b"media.m3u8\n"
+            )
+        if self.config.media_dir is None:
+            return None
+        filename = self.config.media_dir / name
+        if not filename.is_file():
+            return None
+        return "application/octet-stream", filename.read_bytes()
+
+    def _handler_class(self) -> type[http.server.BaseHTTPRequestHandler]:
+        mock = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            # Keep connections open, like the real servers
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self) -> None:
+                with mock._lock:
+                    mock.requests += 1
+                if mock.config.latency:
+                    time.sleep(mock.config.latency)
+                response = mock.respond(self.path)
+                if response is None:
+                    self.send_error(404)
+                    return
+                content_type, body = response
+                self.send_response(200)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.send_body(body)
+
+            def send_body(self, body: bytes) -> None:
+                bandwidth = mock.config.bandwidth
+                if not bandwidth:
+                    self.wfile.write(body)
+                    return
+                for start in range(0, len(body), CHUNK_SIZE):
+                    chunk = body[start : start + CHUNK_SIZE]
+                    self.wfile.write(chunk)
+                    time.sleep(len(chunk) / bandwidth)
+
+            def log_message(self, format: str, *args: Any) -> None:  # noqa: A002, ANN401
+                pass
+
+        return Handler
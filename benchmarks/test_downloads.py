@@ -0,0 +1,79 @@
+"""End-to-end benchmarks for downloading series and programs from the mock server."""
+
+from __future__ import annotations
+
+import time
+from collections.abc import Callable
+from pathlib import Path
+
+import pytest
+from mock_nrk import SERIES_ID, MockConfig, MockNRK, program_id
+
+from nrkdownload.nrk_tv import DownloadOptions
+from nrkdownload.plan import ProgramRequest, SeriesRequest
+from nrkdownload.scheduler import download_requests
+from nrkdownload.settings import Engine
+
+pytestmark = pytest.mark.benchmark
+
+
+@pytest.mark.parametrize("engine", [Engine.native, Engine.ffmpeg])
+@pytest.mark.parametrize("jobs", [1, 4])
+def test_download_series(  # noqa: D103
+    engine: Engine,
+    jobs: int,
+    media_dir: Path,
+    mock_config: MockConfig,
+    mock_nrk: MockNRK,
+    tmp_path: Path,
+    record: Callable[..., None],
+) -> None:
+    mock_config.episodes = 8
+    mock_config.media_dir = media_dir
+    options = DownloadOptions(engine=engine)
+
+    start = time.perf_counter()
+    request = SeriesRequest(
+        url=f"https://tv.nrk.no/serie/{SERIES_ID}", series_id=SERIES_ID
+    )
+    assert download_requests([request], tmp_path, jobs=jobs, options=options) == 0
+    seconds = time.perf_counter() - start
+
+    media_files = list(tmp_path.glob("**/*.m4v"))
+    assert len(media_files) == 8
+    nbytes = sum(media_file.stat().st_size for media_file in media_files)
+    record(
+        f"download_series[{engine.value}, jobs={jobs}]",
+        seconds=seconds,
+        mb_per_second=nbytes / seconds / 1e6,
+        requests=mock_nrk.requests,
+    )
+
+
+@pytest.mark.parametrize("engine", [Engine.native, Engine.ffmpeg])
+def test_download_program(  # noqa: D103
+    engine: Engine,
+    media_dir: Path,
+    mock_config: MockConfig,
+    mock_nrk: MockNRK,
+    tmp_path: Path,
+    record: Callable[..., None],
+) -> None:
+    mock_config.media_dir = media_dir
+    options = DownloadOptions(engine=engine)
+
+    start = time.perf_counter()
+    request = ProgramRequest(
+        url=f"https://tv.nrk.no/program/{program_id(1, 1)}", program_id=program_id(1, 1)
+    )
+    assert download_requests([request], tmp_path, options=options) == 0
+    seconds = time.perf_counter() - start
+
+    media_files = list(tmp_path.glob("**/*.m4v"))
+    assert len(media_files) == 1
+    record(
+        f"download_program[{engine.value}]",
+        seconds=seconds,
+        mb_per_second=media_files[0].stat().st_size / seconds / 1e6,
+        requests=mock_nrk.requests,
+    )
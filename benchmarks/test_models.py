@@ -0,0 +1,54 @@
+"""Benchmarks for creating the program models when planning many programs."""
+
+from __future__ import annotations
+
+import time
+import tracemalloc
+from collections.abc import Callable
+from typing import Any
+
+import pytest
+from mock_nrk import MockNRK, program_id
+
+from nrkdownload.nrk_tv import ProgramRecord
+
+pytestmark = pytest.mark.benchmark
+
+PROGRAMS = 20_000
+
+
+def build(create: Callable[[str], Any]) -> tuple[float, float]:
+    """Create many programs, and get the objects per second and bytes per program."""
+    program_ids = [program_id(1, episode) for episode in range(PROGRAMS)]
+    tracemalloc.start()
+    try:
+        start = time.perf_counter()
+        programs = [create(program_id) for program_id in program_ids]
+        seconds = time.perf_counter() - start
+        size, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    assert len(programs) == PROGRAMS
+    return PROGRAMS / seconds, size / PROGRAMS
+
+
+def test_program_models(  # noqa: D103
+    mock_nrk: MockNRK, record: Callable[..., None]
+) -> None:
+    # The responses from the API are shared, so only the models are measured
+    data = mock_nrk.program(program_id(1, 1))
+    manifest = mock_nrk.manifest(program_id(1, 1))
+
+    def validated(program_id: str) -> Any:  # noqa: ANN401
+        return ProgramRecord.from_api(program_id, data, manifest).to_program()
+
+    def unvalidated(program_id: str) -> Any:  # noqa: ANN401
+        return ProgramRecord.from_api(program_id, data, manifest)
+
+    for name, create in [("TVProgram", validated), ("ProgramRecord", unvalidated)]:
+        objects_per_second, bytes_per_program = build(create)
+        record(
+            f"program_models[{name}]",
+            objects_per_second=objects_per_second,
+            bytes_per_program=bytes_per_program,
+        )
@@ -0,0 +1,109 @@
+"""Benchmarks for fetching the metadata of series before downloading."""
+
+from __future__ import annotations
+
+import time
+import tracemalloc
+from collections.abc import Callable
+from pathlib import Path
+from typing import Any
+
+import pytest
+from mock_nrk import SERIES_ID, MockConfig, MockNRK
+
+from nrkdownload import nrk_tv
+from nrkdownload.cache import ResponseCache
+from nrkdownload.plan import plan_series
+from nrkdownload.state import QueueItem, StateIndex
+
+pytestmark = pytest.mark.benchmark
+
+
+def measure(function: Callable[[], Any]) -> tuple[Any, float, int]:
+    """Run a function, and get its result, wall time and peak Python memory use."""
+    tracemalloc.start()
+    start = time.perf_counter()
+    try:
+        result = function()
+        seconds = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return result, seconds, peak
+
+
+@pytest.mark.parametrize(("seasons", "episodes"), [(1, 10), (4, 25), (10, 100)])
+def test_plan_series(  # noqa: D103
+    seasons: int,
+    episodes: int,
+    mock_config: MockConfig,
+    mock_nrk: MockNRK,
+    tmp_path: Path,
+    record: Callable[..., None],
+) -> None:
+    mock_config.seasons = seasons
+    mock_config.episodes = episodes
+    plan, seconds, peak = measure(lambda: plan_series(tmp_path, SERIES_ID, False))
+
+    assert len(plan.jobs) == seasons * episodes
+    record(
+        f"plan_series[{seasons}x{episodes}]",
+        seconds=seconds,
+        programs_per_second=len(plan.jobs) / seconds,
+        requests=mock_nrk.requests,
+        peak_memory_mb=peak / 1e6,
+    )
+
+
+def test_plan_series_cached(  # noqa: D103
+    mock_config: MockConfig,
+    mock_nrk: MockNRK,
+    tmp_path: Path,
+    monkeypatch: pytest.MonkeyPatch,
+    record: Callable[..., None],
+) -> None:
+    mock_config.seasons = 4
+    mock_config.episodes = 25
+    monkeypatch.setattr(nrk_tv.client, "cache", ResponseCache(tmp_path / "cache"))
+    plan_series(tmp_path, SERIES_ID, False)
+    cold_requests = mock_nrk.requests
+
+    plan, seconds, _ = measure(lambda: plan_series(tmp_path, SERIES_ID, False))
+    assert len(plan.jobs) == 100
+    record(
+        "plan_series_cached[4x25]",
+        seconds=seconds,
+        programs_per_second=len(plan.jobs) / seconds,
+        requests=mock_nrk.requests - cold_requests,
+    )
+
+
+def test_plan_paged_season(  # noqa: D103
+    mock_config: MockConfig,
+    mock_nrk: MockNRK,
+    tmp_path: Path,
+    record: Callable[..., None],
+) -> None:
+    mock_config.episodes = 2000
+    mock_config.page_size = 50
+    state = StateIndex.for_download_dir(tmp_path)
+    first_page: list[float] = []
+    start = time.perf_counter()
+
+    def on_queued(items: list[QueueItem]) -> None:
+        if items and not first_page:
+            first_page.append(time.perf_counter() - start)
+
+    plan, seconds, peak = measure(
+        lambda: plan_series(
+            tmp_path, SERIES_ID, False, state=state, on_queued=on_queued
+        )
+    )
+    assert len(plan.queued) == 2000
+    record(
+        "plan_series_paged[1x2000]",
+        seconds=seconds,
+        first_page_seconds=first_page[0],
+        requests=mock_nrk.requests,
+        peak_memory_mb=peak / 1e6,
+    )
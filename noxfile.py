@@ -21,6 +21,20 @@ def tests(session: nox.Session) -> None:
     session.run("pytest", *session.posargs)
 
 
+@nox.session(default=False)
+def benchmarks(session: nox.Session) -> None:
+    """Run benchmarks against a local mock of NRK TV."""
+    session.run_install(
+        "uv",
+        "sync",
+        env={
+            "UV_FROZEN": "true",
+            "UV_PROJECT_ENVIRONMENT": session.virtualenv.location,
+        },
+    )
+    session.run("pytest", "benchmarks", "-m", "benchmark", "--no-cov", *session.posargs)
+
+
 @nox.session
 def docs(session: nox.Session) -> None:
     """Build the documentation."""
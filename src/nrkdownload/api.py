@@ -0,0 +1,354 @@
+"""A Python API for downloading from NRK TV, without the command line interface.
+
+The programs of a plan are resolved lazily, so the downloads can start while the
+rest of the plan is fetched. Nothing is written to the terminal: progress and
+results are reported to the caller instead. The log messages can be turned off with
+``logger.disable("nrkdownload")`` from loguru.
+
+Example:
+>>> jobs = plan(["https://tv.nrk.no/serie/skam/sesong/1"], Path("Downloads"))
+>>> for result in download(jobs, concurrency=4):
+...     print(result.job.program.title, result.error)
+"""
+
+from __future__ import annotations
+
+import asyncio
+import concurrent.futures
+import dataclasses
+import threading
+from collections.abc import AsyncIterable, AsyncIterator, Callable, Iterable, Iterator
+from pathlib import Path
+from typing import Any, TypeVar
+
+import rich.progress
+from loguru import logger
+
+from nrkdownload.artwork import artwork
+from nrkdownload.download import DOWNLOAD_ERRORS, download_job
+from nrkdownload.locks import ProgramLockedError
+from nrkdownload.metrics import metrics
+from nrkdownload.nrk_tv import (
+    DownloadOptions,
+    NotPlayableError,
+    ProgramRecord,
+    TVSeries,
+)
+from nrkdownload.plan import (
+    METADATA_WORKERS,
+    ProgramJob,
+    ProgramRequest,
+    SeriesRequest,
+    Shard,
+    deduplicate,
+    episode_pages,
+    in_shard,
+)
+from nrkdownload.state import QueueItem, StateIndex
+from nrkdownload.urls import parse_url
+
+T = TypeVar("T")
+
+# Called with a job, the seconds of it that are downloaded, and its duration
+ProgressCallback = Callable[[ProgramJob, float, float], None]
+
+
+@dataclasses.dataclass(slots=True)
+class DownloadResult:
+    """The outcome of downloading a program."""
+
+    job: ProgramJob
+    # The media file, if the download succeeded
+    filename: Path | None = None
+    error: Exception | None = None
+
+    @property
+    def ok(self) -> bool:
+        """Whether the program was downloaded."""
+        return self.error is None
+
+
+class CallbackProgress(rich.progress.Progress):
+    """A progress display that reports the progress of a job to a callback.
+
+    The display is never shown in the terminal.
+    """
+
+    def __init__(self, job: ProgramJob, callback: ProgressCallback | None) -> None:
+        """Create a display for one job."""
+        super().__init__(disable=True)
+        self.job = job
+        self.callback = callback
+
+    def update(
+        self,
+        task_id: rich.progress.TaskID,
+        *args: Any,  # noqa: ANN401
+        **kwargs: Any,  # noqa: ANN401
+    ) -> None:
+        """Update a task, and report its progress."""
+        super().update(task_id, *args, **kwargs)
+        if self.callback is not None:
+            task = next(task for task in self.tasks if task.id == task_id)
+            self.callback(self.job, task.completed, task.total or 0.0)
+
+
+def parse_requests(
+    urls: Iterable[str | ProgramRequest | SeriesRequest],
+) -> list[ProgramRequest | SeriesRequest]:
+    """Parse URLs into download requests, without duplicates.
+
+    Raises:
+        ValueError: If a URL is not a program or series on NRK TV.
+    """
+    download_requests = []
+    for url in urls:
+        request = parse_url(url) if isinstance(url, str) else url
+        if request is None:
+            raise ValueError(f"Not a program or series URL: {url}")
+        download_requests.append(request)
+    return deduplicate(download_requests)
+
+
+def resolve_jobs(
+    items: list[QueueItem], executor: concurrent.futures.Executor
+) -> Iterator[ProgramJob]:
+    """Resolve a page of episodes concurrently, leaving out those not playable."""
+
+    def resolve(program_id: str) -> ProgramRecord | None:
+        try:
+            return ProgramRecord.from_program_id(program_id)
+        except NotPlayableError as e:
+            logger.info(f"Skipping: {e}")
+            metrics.inc("skipped_total", reason="not_playable")
+            return None
+
+    programs = executor.map(resolve, [item.program_id for item in items])
+    for item, program in zip(items, programs, strict=True):
+        if program is not None:
+            yield ProgramJob.from_item(item, program)
+
+
+def plan_jobs(
+    request: ProgramRequest | SeriesRequest,
+    download_dir: Path,
+    with_extras: bool,
+    images: bool,
+    executor: concurrent.futures.Executor,
+    shard: Shard | None = None,
+) -> Iterator[ProgramJob]:
+    """Resolve the programs of a request, one page of episodes at a time."""
+    if isinstance(request, ProgramRequest):
+        if not in_shard(shard, request.program_id):
+            return
+        for job in resolve_jobs(
+            [QueueItem(program_id=request.program_id, directory=download_dir)],
+            executor,
+        ):
+            job.directory = download_dir / job.program.title
+            yield job
+        return
+
+    extras = with_extras or request.season_id == "ekstramateriale"
+    series = TVSeries.from_series_id(request.series_id, extras)
+    season_ids = [
+        season_info.season_id
+        for season_info in series.season_infos
+        if request.season_id is None or season_info.season_id == request.season_id
+    ]
+    seasons = list(executor.map(series.get_season, season_ids))
+    if images and in_shard(shard, request.series_id):
+        series.download_images(download_dir)
+        for season in seasons:
+            season.download_images(download_dir / series.dirname)
+    for season in seasons:
+        for page in episode_pages(download_dir, series, season):
+            items = [
+                item
+                for item in page
+                if (request.episode_id is None or item.program_id == request.episode_id)
+                and in_shard(shard, item.program_id)
+            ]
+            yield from resolve_jobs(items, executor)
+
+
+def plan(
+    urls: Iterable[str | ProgramRequest | SeriesRequest],
+    download_dir: Path,
+    with_extras: bool = False,
+    images: bool = True,
+    shard: Shard | None = None,
+) -> Iterator[ProgramJob]:
+    """Plan the downloads of some URLs, resolving the programs as they are needed.
+
+    Args:
+        urls (Iterable[str | ProgramRequest | SeriesRequest]): URLs of programs,
+            series, seasons or episodes, or parsed requests.
+        download_dir (Path): Base directory for the downloads.
+        with_extras (bool, optional): Whether to include extra material for series.
+            Defaults to False.
+        images (bool, optional): Whether to download the series and season images,
+            in the background. Defaults to True.
+        shard (Shard, optional): Only include the programs, and the images,
+            assigned to this shard. Defaults to None.
+
+    Raises:
+        ValueError: If a URL is not a program or series on NRK TV.
+
+    Yields:
+        ProgramJob: The playable programs, in the order of the URLs.
+    """
+    download_requests = parse_requests(urls)
+
+    def jobs() -> Iterator[ProgramJob]:
+        with concurrent.futures.ThreadPoolExecutor(METADATA_WORKERS) as executor:
+            for request in download_requests:
+                yield from plan_jobs(
+                    request, download_dir, with_extras, images, executor, shard
+                )
+
+    # The URLs are checked when the plan is created, not when it is first iterated
+    return jobs()
+
+
+async def aplan(
+    urls: Iterable[str | ProgramRequest | SeriesRequest],
+    download_dir: Path,
+    with_extras: bool = False,
+    images: bool = True,
+    shard: Shard | None = None,
+) -> AsyncIterator[ProgramJob]:
+    """Plan the downloads of some URLs, like plan, as an async iterator."""
+    jobs = plan(urls, download_dir, with_extras, images, shard)
+    async for job in iterate_in_thread(jobs):
+        yield job
+
+
+async def iterate_in_thread(iterable: Iterable[T]) -> AsyncIterator[T]:
+    """Iterate over a blocking iterable in a worker thread."""
+    iterator = iter(iterable)
+    done = object()
+    while (item := await asyncio.to_thread(next, iterator, done)) is not done:
+        yield item  # type: ignore[misc]
+
+
+def download_one(
+    job: ProgramJob,
+    options: DownloadOptions | None = None,
+    state: StateIndex | None = None,
+    on_progress: ProgressCallback | None = None,
+) -> DownloadResult:
+    """Download a program, and report the outcome instead of raising errors.
+
+    A program that another process is downloading is skipped, with a
+    ProgramLockedError as the error. A program that is no longer playable is
+    skipped with a NotPlayableError.
+    """
+    try:
+        download_job(job, CallbackProgress(job, on_progress), state, options)
+    except ProgramLockedError as e:
+        logger.info(f"Skipping: {e}")
+        metrics.inc("skipped_total", reason="locked")
+        return DownloadResult(job=job, error=e)
+    except NotPlayableError as e:
+        logger.info(f"Skipping: {e}")
+        metrics.inc("skipped_total", reason="not_playable")
+        return DownloadResult(job=job, error=e)
+    except DOWNLOAD_ERRORS as e:
+        logger.warning(f"Failed to download {job.program.title}: {e}")
+        metrics.inc("failed_total")
+        return DownloadResult(job=job, error=e)
+    return DownloadResult(job=job, filename=job.media_filename)
+
+
+def download(
+    jobs: Iterable[ProgramJob],
+    concurrency: int = 1,
+    options: DownloadOptions | None = None,
+    on_progress: ProgressCallback | None = None,
+    cancel: threading.Event | None = None,
+    state: StateIndex | None = None,
+) -> Iterator[DownloadResult]:
+    """Download programs concurrently, and yield the results as they finish.
+
+    The jobs are taken from the iterable as workers become free, so a lazy plan is
+    downloaded while it is resolved. When the cancel event is set, or the iteration
+    is stopped, no more downloads are started, and the running ones are finished.
+
+    Args:
+        jobs (Iterable[ProgramJob]): The programs, e.g. a plan.
+        concurrency (int, optional): Number of programs to download concurrently.
+            Defaults to 1.
+        options (DownloadOptions, optional): Options for how the programs are
+            downloaded. Defaults to None.
+        on_progress (ProgressCallback, optional): Called from the workers with a
+            job, the seconds of it that are downloaded, and its duration. Defaults
+            to None.
+        cancel (threading.Event, optional): Set to stop starting downloads.
+            Defaults to None.
+        state (StateIndex, optional): If given, completed downloads are recorded in
+            the index. Defaults to None.
+
+    Yields:
+        DownloadResult: The outcome of each download, in the order they finish.
+    """
+    iterator = iter(jobs)
+    pending: set[concurrent.futures.Future[DownloadResult]] = set()
+    with concurrent.futures.ThreadPoolExecutor(concurrency) as executor:
+        while True:
+            while len(pending) < concurrency and not (cancel and cancel.is_set()):
+                if (job := next(iterator, None)) is None:
+                    break
+                pending.add(
+                    executor.submit(download_one, job, options, state, on_progress)
+                )
+            if not pending:
+                break
+            done, pending = concurrent.futures.wait(
+                pending, return_when=concurrent.futures.FIRST_COMPLETED
+            )
+            for future in done:
+                yield future.result()
+    artwork.wait()
+
+
+async def adownload(
+    jobs: Iterable[ProgramJob] | AsyncIterable[ProgramJob],
+    concurrency: int = 1,
+    options: DownloadOptions | None = None,
+    on_progress: ProgressCallback | None = None,
+    state: StateIndex | None = None,
+) -> AsyncIterator[DownloadResult]:
+    """Download programs concurrently, like download, as an async iterator.
+
+    The progress callback is called in the event loop. The downloads are stopped by
+    cancelling the task that iterates: no more downloads are started, and the
+    running ones are finished in the background.
+    """
+    loop = asyncio.get_running_loop()
+
+    def report(job: ProgramJob, seconds: float, total: float) -> None:
+        if on_progress is not None:
+            loop.call_soon_threadsafe(on_progress, job, seconds, total)
+
+    job_iterator = jobs if isinstance(jobs, AsyncIterable) else iterate_in_thread(jobs)
+    executor = concurrent.futures.ThreadPoolExecutor(concurrency)
+    pending: set[asyncio.Future[DownloadResult]] = set()
+    try:
+        async for job in job_iterator:
+            if len(pending) >= concurrency:
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+                for future in done:
+                    yield future.result()
+            pending.add(
+                loop.run_in_executor(
+                    executor, download_one, job, options, state, report
+                )
+            )
+        for result in asyncio.as_completed(pending):
+            yield await result
+        await asyncio.to_thread(artwork.wait)
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
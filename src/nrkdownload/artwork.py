@@ -0,0 +1,197 @@
+"""Background downloads of artwork, i.e. posters, backdrops and episode images.
+
+Images are streamed to disk through the shared session, in a few background threads,
+so they are fetched while the media is downloading. Each URL is fetched at most once
+per run, and existing files are revalidated with If-Modified-Since and ETag, so that
+only images that NRK has changed are downloaded again.
+"""
+
+from __future__ import annotations
+
+import concurrent.futures
+import email.utils
+import json
+import os
+import shutil
+import threading
+from pathlib import Path
+
+import requests
+from loguru import logger
+
+from nrkdownload.metrics import metrics
+from nrkdownload.ratelimit import CHUNK_SIZE, limiter
+
+ETAG_FILENAME = "artwork.json"
+
+
+class ArtworkDownloader:
+    """Download images in background threads.
+
+    Example:
+    >>> future = artwork.submit("https://gfx.nrk.no/...", Path("poster.jpg"))
+    >>> artwork.wait()
+    """
+
+    def __init__(self, max_workers: int = 4) -> None:
+        """Create a downloader that fetches at most max_workers images at a time."""
+        self.max_workers = max_workers
+        self.session: requests.Session | None = None
+        self._executor: concurrent.futures.ThreadPoolExecutor | None = None
+        self._lock = threading.Lock()
+        # The first download of each URL, and the future for each target file
+        self._sources: dict[str, concurrent.futures.Future[Path | None]] = {}
+        self._targets: dict[Path, concurrent.futures.Future[Path | None]] = {}
+        self._etag_file: Path | None = None
+        self._etags: dict[str, str] = {}
+
+    def use_session(self, session: requests.Session) -> None:
+        """Fetch images with the given session."""
+        self.session = session
+
+    def use_etag_file(self, etag_file: Path | None) -> None:
+        """Remember the ETags of downloaded images in a file, or not at all."""
+        self._etag_file = etag_file
+        self._etags = {}
+        if etag_file is not None and etag_file.exists():
+            try:
+                self._etags = json.loads(etag_file.read_text())
+            except ValueError:
+                logger.warning(f"Ignoring invalid ETag file {etag_file}")
+
+    def submit(
+        self, url: str, filename: Path
+    ) -> concurrent.futures.Future[Path | None]:
+        """Start downloading an image, unless it is already downloaded in this run.
+
+        Returns:
+            Future: Resolves to the filename, or None if the download failed.
+        """
+        with self._lock:
+            if filename in self._targets:
+                return self._targets[filename]
+            source = self._sources.get(url)
+            if source is None:
+                if self._executor is None:
+                    self._executor = concurrent.futures.ThreadPoolExecutor(
+                        self.max_workers, thread_name_prefix="artwork"
+                    )
+                future = self._executor.submit(self._download, url, filename)
+                self._sources[url] = future
+            else:
+                # The same image is used for another file, copy it when it is done
+                future = concurrent.futures.Future()
+                source.add_done_callback(
+                    lambda done: self._copy(done, filename, future)
+                )
+            self._targets[filename] = future
+            return future
+
+    def wait(self) -> None:
+        """Wait for all submitted downloads, and save the ETags."""
+        with self._lock:
+            futures = list(self._targets.values())
+        concurrent.futures.wait(futures)
+        if self._etag_file is not None:
+            with self._lock:
+                content = json.dumps(self._etags)
+            self._etag_file.parent.mkdir(parents=True, exist_ok=True)
+            self._etag_file.write_text(content)
+
+    def forget(self) -> None:
+        """Forget the downloads that are done.
+
+        The images are downloaded again, or revalidated, when they are submitted
+        again.
+        """
+        with self._lock:
+            self._sources = {
+                url: future
+                for url, future in self._sources.items()
+                if not future.done()
+            }
+            self._targets = {
+                filename: future
+                for filename, future in self._targets.items()
+                if not future.done()
+            }
+
+    def _download(self, url: str, filename: Path) -> Path | None:
+        headers = {}
+        if filename.exists():
+            headers["If-Modified-Since"] = email.utils.formatdate(
+                filename.stat().st_mtime, usegmt=True
+            )
+            with self._lock:
+                if etag := self._etags.get(url):
+                    headers["If-None-Match"] = etag
+
+        session = self.session or requests.Session()
+        try:
+            with session.get(url, headers=headers, stream=True) as r:
+                if r.status_code == requests.codes.not_modified:
+                    logger.trace(f"{filename.name} is up to date")
+                    metrics.inc("artwork_requests_total", result="not_modified")
+                    return filename
+                r.raise_for_status()
+                write_stream(r, filename)
+        except requests.RequestException as e:
+            logger.warning(f"Could not download image {url}: {e}")
+            metrics.inc("artwork_requests_total", result="failed")
+            return None
+
+        metrics.inc("artwork_requests_total", result="downloaded")
+        with self._lock:
+            if etag := r.headers.get("ETag"):
+                self._etags[url] = etag
+        return filename
+
+    def _copy(
+        self,
+        source: concurrent.futures.Future[Path | None],
+        filename: Path,
+        future: concurrent.futures.Future[Path | None],
+    ) -> None:
+        try:
+            source_filename = source.result()
+            if source_filename is not None and is_outdated(filename, source_filename):
+                filename.parent.mkdir(parents=True, exist_ok=True)
+                shutil.copy2(source_filename, filename)
+        except Exception as e:
+            future.set_exception(e)
+        else:
+            future.set_result(filename if source_filename is not None else None)
+
+
+def write_stream(r: requests.Response, filename: Path) -> None:
+    """Write a streamed response to a file, in chunks.
+
+    The file is replaced when the download is complete, and gets the modification
+    time of the image on the server.
+    """
+    filename.parent.mkdir(parents=True, exist_ok=True)
+    part_filename = filename.with_name(filename.name + ".part")
+    with part_filename.open("wb") as file:
+        for chunk in r.iter_content(CHUNK_SIZE):
+            limiter.consume(len(chunk))
+            file.write(chunk)
+            metrics.inc("downloaded_bytes_total", len(chunk), kind="artwork")
+    part_filename.replace(filename)
+
+    if last_modified := r.headers.get("Last-Modified"):
+        try:
+            mtime = email.utils.parsedate_to_datetime(last_modified).timestamp()
+        except ValueError:
+            return
+        os.utime(filename, (mtime, mtime))
+
+
+def is_outdated(filename: Path, source: Path) -> bool:
+    """Check whether a copy of source is missing or older than source."""
+    if not filename.exists():
+        return True
+    return filename.stat().st_mtime < source.stat().st_mtime
+
+
+# Shared by all downloads in the process
+artwork = ArtworkDownloader()
@@ -0,0 +1,57 @@
+"""Locating the FFmpeg binary, without starting it on every invocation."""
+
+from __future__ import annotations
+
+import json
+import shutil
+import subprocess
+from pathlib import Path
+
+from loguru import logger
+
+VERSION_CACHE_FILENAME = "ffmpeg.json"
+
+
+class FFmpegNotFoundError(Exception):
+    """Raised when the FFmpeg binary is not found."""
+
+    pass
+
+
+def ffmpeg_version(cache_dir: Path | None = None) -> str:
+    """Get the version of the FFmpeg binary on $PATH.
+
+    The version is cached in cache_dir, keyed by the path and modification time of
+    the binary. FFmpeg is therefore only started again when it is replaced.
+
+    Raises:
+        FFmpegNotFoundError: If FFmpeg is not found on $PATH.
+    """
+    executable = shutil.which("ffmpeg")
+    if executable is None:
+        raise FFmpegNotFoundError("FFmpeg not found")
+    path = Path(executable).resolve()
+    key = {"path": str(path), "mtime_ns": path.stat().st_mtime_ns}
+
+    cache_file = cache_dir / VERSION_CACHE_FILENAME if cache_dir else None
+    if cache_file is not None:
+        try:
+            cached = json.loads(cache_file.read_text())
+            if cached["key"] == key:
+                return cached["version"]
+        except (OSError, ValueError, KeyError, TypeError):
+            pass
+
+    result = subprocess.run(  # noqa: S603
+        [str(path), "-version"], capture_output=True, check=True, text=True
+    )
+    version = result.stdout.partition("\n")[0]
+    logger.debug(f"Probed {path}: {version}")
+
+    if cache_file is not None:
+        try:
+            cache_file.parent.mkdir(parents=True, exist_ok=True)
+            cache_file.write_text(json.dumps({"key": key, "version": version}))
+        except OSError as e:
+            logger.warning(f"Could not cache the FFmpeg version: {e}")
+    return version
@@ -0,0 +1,160 @@
+"""Persistent on-disk cache for responses from the NRK TV API."""
+
+from __future__ import annotations
+
+import datetime as dt
+import hashlib
+import tempfile
+import threading
+from pathlib import Path
+from typing import Any
+
+import requests
+from loguru import logger
+from pydantic import BaseModel, ValidationError
+
+from nrkdownload.metrics import metrics
+from nrkdownload.settings import DEFAULT_CACHE_DIR, endpoint
+
+DEFAULT_MAX_SIZE = 100 * 1024 * 1024
+
+# Program metadata rarely changes, but new episodes are added to seasons, and the
+# manifests contain links that expire.
+DEFAULT_TTLS = {
+    "manifest": dt.timedelta(minutes=5),
+    "program": dt.timedelta(days=7),
+    "season": dt.timedelta(minutes=15),
+    "series": dt.timedelta(days=1),
+}
+
+
+class CacheEntry(BaseModel):
+    """A cached response."""
+
+    url: str
+    stored: dt.datetime
+    etag: str | None = None
+    last_modified: str | None = None
+    data: Any
+
+
+class ResponseCache:
+    """Cache JSON responses on disk, with per-endpoint time-to-live.
+
+    Expired entries are revalidated with ETag/Last-Modified when the API provides
+    them. When the cache grows larger than max_size bytes, the least recently used
+    entries are evicted.
+    """
+
+    def __init__(
+        self,
+        directory: Path = DEFAULT_CACHE_DIR,
+        ttls: dict[str, dt.timedelta] | None = None,
+        max_size: int = DEFAULT_MAX_SIZE,
+    ) -> None:
+        """Create a cache in the given directory."""
+        self.directory = directory
+        self.ttls = DEFAULT_TTLS | (ttls or {})
+        self.max_size = max_size
+        self._size: int | None = None
+        self._lock = threading.Lock()
+
+    def filename(self, url: str) -> Path:
+        """Get the filename for a cached URL."""
+        return self.directory / f"{hashlib.sha256(url.encode()).hexdigest()}.json"
+
+    def load(self, url: str) -> CacheEntry | None:
+        """Load a cache entry, or None if it does not exist."""
+        filename = self.filename(url)
+        try:
+            entry = CacheEntry.model_validate_json(filename.read_bytes())
+            # Update the modification time, which is used for LRU eviction
+            filename.touch()
+        except (FileNotFoundError, ValidationError):
+            return None
+        return entry
+
+    def store(self, entry: CacheEntry) -> None:
+        """Store a cache entry, evicting old entries if the cache is too large."""
+        self.directory.mkdir(parents=True, exist_ok=True)
+        content = entry.model_dump_json().encode()
+        # Write to a temporary file first, so that readers never see partial entries
+        with tempfile.NamedTemporaryFile(
+            dir=self.directory, suffix=".tmp", delete=False
+        ) as file:
+            file.write(content)
+        Path(file.name).replace(self.filename(entry.url))
+
+        with self._lock:
+            if self._size is None:
+                self._size = self.size()
+            else:
+                self._size += len(content)
+            if self._size > self.max_size:
+                self._size = self.evict(self.max_size // 2)
+
+    def size(self) -> int:
+        """Get the total size of the cache in bytes."""
+        return sum(file.stat().st_size for file in self.directory.glob("*.json"))
+
+    def evict(self, target_size: int) -> int:
+        """Remove the least recently used entries until the cache is small enough.
+
+        Returns:
+            int: The size of the cache after eviction.
+        """
+        files = sorted(
+            ((file.stat(), file) for file in self.directory.glob("*.json")),
+            key=lambda item: item[0].st_mtime,
+        )
+        size = sum(stat.st_size for stat, _ in files)
+        for stat, file in files:
+            if size <= target_size:
+                break
+            file.unlink(missing_ok=True)
+            size -= stat.st_size
+        logger.debug(f"Evicted entries from response cache, size is now {size}")
+        return size
+
+    def get_json(self, session: requests.Session, url: str) -> Any:  # noqa: ANN401
+        """Get JSON data for a URL, from the cache if possible."""
+        name = endpoint(url)
+        ttl = self.ttls.get(name, dt.timedelta(0)) if name else dt.timedelta(0)
+        if name is None or not ttl:
+            r = session.get(url)
+            r.raise_for_status()
+            return r.json()
+
+        now = dt.datetime.now(dt.timezone.utc)
+        entry = self.load(url)
+        if entry is not None and now - entry.stored < ttl:
+            logger.trace(f"Cache hit for {url}")
+            metrics.inc("cache_requests_total", endpoint=name, result="hit")
+            return entry.data
+
+        headers = {}
+        if entry is not None:
+            if entry.etag:
+                headers["If-None-Match"] = entry.etag
+            if entry.last_modified:
+                headers["If-Modified-Since"] = entry.last_modified
+
+        r = session.get(url, headers=headers)
+        if entry is not None and r.status_code == requests.codes.not_modified:
+            logger.trace(f"Cache entry for {url} revalidated")
+            metrics.inc("cache_requests_total", endpoint=name, result="revalidated")
+            entry.stored = now
+            self.store(entry)
+            return entry.data
+
+        r.raise_for_status()
+        metrics.inc("cache_requests_total", endpoint=name, result="miss")
+        entry = CacheEntry(
+            url=url,
+            stored=now,
+            etag=r.headers.get("ETag"),
+            last_modified=r.headers.get("Last-Modified"),
+            data=r.json(),
+        )
+        self.store(entry)
+        return entry.data
@@ -2,20 +2,37 @@
 
 from __future__ import annotations
 
+import contextlib
+import datetime as dt
 import re
 import sys
+from collections.abc import Iterable, Iterator
 from pathlib import Path
-from typing import Annotated
+from typing import TYPE_CHECKING, Annotated
 
 import typer
-from ffmpeg import FFmpeg
 from loguru import logger
 
 from nrkdownload import __version__
-from nrkdownload.download import (
-    download_program,
-    download_series,
+from nrkdownload.settings import (
+    DEFAULT_CACHE_DIR,
+    DEFAULT_METRICS_HOST,
+    ENDPOINTS,
+    SERIES_TYPES,
+    Engine,
+    LockPolicy,
+    Quality,
+    SpacePolicy,
 )
+from nrkdownload.urls import match_program_url, match_series_url, parse_url  # noqa: F401
+
+# Modules that import requests, pydantic, rich or FFmpeg are imported when they are
+# needed, so that --help, --version and URL validation return quickly.
+if TYPE_CHECKING:
+    from nrkdownload.nrk_tv import DownloadOptions
+    from nrkdownload.plan import ProgramRequest, SeriesRequest, Shard
+    from nrkdownload.ratelimit import BandwidthWindow
+    from nrkdownload.state import StateIndex
 
 DEFAULT_DOWNLOAD_DIR = Path.home() / "Downloads" / "nrkdownload"
 
@@ -43,32 +60,308 @@ def version_callback(value: bool) -> None:
         raise typer.Exit()
 
 
-def match_program_url(url: str) -> str | None:
-    """Figure out if the URL is a program URL."""
-    if match := re.match(r"https://tv.nrk.no/program/(\w+)", url):
-        return match.group(1)
-    return None
+def parse_cache_ttls(values: list[str]) -> dict[str, dt.timedelta]:
+    """Parse cache TTLs given as ENDPOINT=SECONDS."""
+    ttls = {}
+    for value in values:
+        name, _, seconds = value.partition("=")
+        if name not in ENDPOINTS or not seconds.isdigit():
+            raise typer.BadParameter(
+                f"Expected ENDPOINT=SECONDS, where ENDPOINT is one of "
+                f"{', '.join(ENDPOINTS)}. Got '{value}'."
+            )
+        ttls[name] = dt.timedelta(seconds=int(seconds))
+    return ttls
+
+
+def parse_poll_intervals(values: list[str]) -> dict[str, dt.timedelta]:
+    """Parse poll intervals given as TYPE=SECONDS."""
+    intervals = {}
+    for value in values:
+        name, _, seconds = value.partition("=")
+        if name not in SERIES_TYPES or not seconds.isdigit():
+            raise typer.BadParameter(
+                f"Expected TYPE=SECONDS, where TYPE is one of "
+                f"{', '.join(SERIES_TYPES)}. Got '{value}'."
+            )
+        intervals[name] = dt.timedelta(seconds=int(seconds))
+    return intervals
+
+
+def parse_bitrate(value: str) -> int:
+    """Parse a bitrate like 3M or 800k to bits per second."""
+    multipliers = {"k": 1_000, "m": 1_000_000, "g": 1_000_000_000}
+    if match := re.fullmatch(r"(\d+(?:\.\d+)?)([kmg]?)", value.strip().lower()):
+        number, unit = match.groups()
+        return int(float(number) * multipliers.get(unit, 1))
+    raise typer.BadParameter(f"Expected a number like 3M or 800k, got '{value}'.")
+
+
+def parse_rate(value: str) -> int:
+    """Parse a transfer rate like 2M or 500k to bytes per second."""
+    multipliers = {"k": 1024, "m": 1024**2, "g": 1024**3}
+    if match := re.fullmatch(r"(\d+(?:\.\d+)?)([kmg]?)", value.strip().lower()):
+        number, unit = match.groups()
+        return int(float(number) * multipliers.get(unit, 1))
+    raise typer.BadParameter(f"Expected a rate like 2M or 500k, got '{value}'.")
+
+
+def parse_size(value: str) -> int:
+    """Parse a size like 10G or 500M to bytes."""
+    multipliers = {"k": 1024, "m": 1024**2, "g": 1024**3, "t": 1024**4}
+    if match := re.fullmatch(r"(\d+(?:\.\d+)?)([kmgt]?)", value.strip().lower()):
+        number, unit = match.groups()
+        return int(float(number) * multipliers.get(unit, 1))
+    raise typer.BadParameter(f"Expected a size like 10G or 500M, got '{value}'.")
+
+
+def parse_shard(value: str) -> Shard:
+    """Parse a shard given as K/N, where K is from 1 to N."""
+    match = re.fullmatch(r"(\d+)/(\d+)", value.strip())
+    if not match or not 1 <= int(match.group(1)) <= int(match.group(2)):
+        raise typer.BadParameter(
+            f"Expected K/N, where K is from 1 to N, e.g. 1/3. Got '{value}'."
+        )
+    from nrkdownload.plan import Shard
+
+    return Shard(index=int(match.group(1)), count=int(match.group(2)))
+
+
+def parse_bandwidth_windows(values: list[str]) -> list[BandwidthWindow]:
+    """Parse bandwidth windows given as HH:MM-HH:MM=RATE."""
+    from nrkdownload.ratelimit import BandwidthWindow
+
+    windows = []
+    for value in values:
+        match = re.fullmatch(r"(\d\d?:\d\d)-(\d\d?:\d\d)=(\S+)", value.strip())
+        if not match:
+            raise typer.BadParameter(
+                f"Expected HH:MM-HH:MM=RATE, e.g. 07:00-23:00=1M. Got '{value}'."
+            )
+        start, end, rate = match.groups()
+        windows.append(
+            BandwidthWindow(
+                start=dt.time.fromisoformat(start.zfill(5)),
+                end=dt.time.fromisoformat(end.zfill(5)),
+                rate=None if rate == "unlimited" else parse_rate(rate),
+            )
+        )
+    return windows
+
+
+def parse_urls(
+    urls: Iterable[str],
+) -> tuple[list[ProgramRequest | SeriesRequest], int]:
+    """Parse URLs into download requests, and count the URLs that are not valid."""
+    download_requests = []
+    failures = 0
+    for url in urls:
+        if (request := parse_url(url)) is None:
+            typer.echo(f"Not able to parse URL: {url}")
+            failures += 1
+        else:
+            download_requests.append(request)
+    return download_requests, failures
+
+
+def iter_urls(urls: list[str], input_file: Path | None) -> Iterator[str]:
+    """Iterate over the URLs given as arguments, and then those in the input file.
+
+    The input file has one URL per line, and is read lazily. Empty lines and lines
+    starting with # are ignored. If the input file is "-", URLs are read from stdin.
+    """
+    yield from urls
+    if input_file is None:
+        return
+    # Reading from stdin must not close it
+    with (
+        contextlib.nullcontext(sys.stdin)
+        if str(input_file) == "-"
+        else input_file.open(encoding="utf-8")
+    ) as file:
+        for line in file:
+            line = line.strip()
+            if line and not line.startswith("#"):
+                yield line
+
+
+def check_ffmpeg(cache_dir: Path | None) -> None:
+    """Check that FFmpeg is installed, or exit with a helpful message."""
+    from nrkdownload.binaries import FFmpegNotFoundError, ffmpeg_version
+
+    try:
+        logger.info(f"FFmpeg version: {ffmpeg_version(cache_dir)}")
+    except FFmpegNotFoundError:
+        typer.echo(
+            "\nFFmpeg not found, must be installed to use this package.\n"
+            "See documentation: https://nrkdownload.readthedocs.io/"
+        )
+        raise typer.Exit(1) from None
+
+
+def download_options(
+    resume: bool,
+    engine: Engine,
+    connections: int,
+    max_height: int | None,
+    max_bitrate: int | None,
+    quality: Quality | None,
+    subtitles: list[str],
+    all_audio: bool,
+) -> DownloadOptions:
+    """Create the options for how programs are downloaded."""
+    from nrkdownload.hls import VariantSelector
+    from nrkdownload.nrk_tv import DownloadOptions
+
+    variant = None
+    if max_height is not None or max_bitrate is not None or quality is not None:
+        variant = VariantSelector(
+            max_height=max_height,
+            max_bitrate=max_bitrate,
+            quality=quality or Quality.highest,
+        )
+    return DownloadOptions(
+        resume=resume,
+        engine=engine,
+        connections=connections,
+        variant=variant,
+        subtitles=subtitles,
+        all_audio=all_audio,
+    )
+
+
+def download_all(
+    download_requests: list[ProgramRequest | SeriesRequest],
+    download_dir: Path,
+    with_extras: bool,
+    jobs: int,
+    state: StateIndex | None,
+    options: DownloadOptions,
+    shard: Shard | None,
+) -> int:
+    """Download all requests, and return the number of requests that failed.
+
+    The requests share one pool of download workers.
+    """
+    from nrkdownload.scheduler import download_requests as download
+
+    return download(
+        download_requests, download_dir, with_extras, jobs, state, options, shard
+    )
+
+
+def export_plan(
+    download_requests: list[ProgramRequest | SeriesRequest],
+    download_dir: Path,
+    with_extras: bool,
+    state: StateIndex | None,
+    shard: Shard | None,
+    filename: Path,
+) -> int:
+    """Write the plan for all requests to a JSON file, and return the failures."""
+    from nrkdownload.scheduler import export_plans, plan_requests
+
+    plans, failed = plan_requests(
+        download_requests, download_dir, with_extras, None, shard=shard
+    )
+    programs = export_plans(plans, filename, shard, state)
+    typer.echo(f"Wrote a plan with {programs} programs to {filename}")
+    return len(failed)
+
+
+def watch_series(
+    download_requests: list[ProgramRequest | SeriesRequest],
+    download_dir: Path,
+    state: StateIndex,
+    jobs: int,
+    options: DownloadOptions,
+    intervals: dict[str, dt.timedelta],
+    shard: Shard | None,
+) -> None:
+    """Watch the series in the requests until interrupted."""
+    from nrkdownload.nrk_tv import TVSeriesType
+    from nrkdownload.plan import SeriesRequest
+    from nrkdownload.watch import Watcher
+
+    series_ids = []
+    for request in download_requests:
+        if isinstance(request, SeriesRequest):
+            series_ids.append(request.series_id)
+        else:
+            typer.echo(f"Only series can be watched, ignoring {request.url}")
+    if not series_ids:
+        raise typer.BadParameter("Give at least one series URL to watch.")
+
+    series_ids = list(dict.fromkeys(series_ids))
+    typer.echo(f"Watching {len(series_ids)} series, stop with Ctrl-C")
+    watcher = Watcher(
+        download_dir,
+        series_ids,
+        state,
+        jobs,
+        options,
+        {TVSeriesType(name): interval for name, interval in intervals.items()},
+        shard,
+    )
+    try:
+        watcher.run()
+    except KeyboardInterrupt:
+        typer.echo("Stopped watching")
 
 
-def match_series_url(url: str) -> tuple[str, str | None, str | None] | None:
-    """Figure out if the URL is a series URL."""
-    if match := re.match(
-        r"https://tv.nrk.no/serie/([\w-]+)(?:/sesong/(\w+)|/(\w+)|)(?:/episode/(\w+)|/(\w+)|)",
-        url,
-    ):
-        series_id = match.group(1)
-        season_id = match.group(2) or match.group(3)
-        episode_id = match.group(4) or match.group(5)
-        return series_id, season_id, episode_id
-    return None
+def verify_downloads(download_dir: Path, requeue: bool) -> int:
+    """Verify the media files in the download directory, and return the exit code."""
+    from nrkdownload.state import STATE_FILENAME, StateIndex
+    from nrkdownload.verify import verify_library
+
+    state = None
+    if (download_dir / STATE_FILENAME).exists():
+        state = StateIndex.for_download_dir(download_dir)
+    checked, problems = verify_library(download_dir, state, requeue)
+    for filename, error in problems.items():
+        typer.echo(f"Incomplete: {filename}: {error}")
+    typer.echo(f"Verified {checked} files, {len(problems)} incomplete")
+    if problems and requeue:
+        typer.echo("The incomplete files are renamed, and will be downloaded again")
+    return 1 if problems else 0
+
+
+@contextlib.contextmanager
+def collect_metrics(
+    report: Path | None, metrics_port: int | None, metrics_host: str
+) -> Iterator[None]:
+    """Serve the metrics while running, and write the run report when finished."""
+    from nrkdownload.metrics import metrics
+
+    server = None
+    if metrics_port is not None:
+        server = metrics.serve(metrics_port, metrics_host)
+    try:
+        yield
+    finally:
+        if server is not None:
+            server.shutdown()
+        if report is not None:
+            metrics.write_report(report)
 
 
 @app.command()
 def main(
     urls: Annotated[
-        list[str],
-        typer.Argument(..., help="One or more valid URLs from https://tv.nrk.no/"),
-    ],
+        list[str] | None,
+        typer.Argument(help="One or more valid URLs from https://tv.nrk.no/"),
+    ] = None,
+    input_file: Annotated[
+        Path | None,
+        typer.Option(
+            "-i",
+            "--input-file",
+            exists=True,
+            dir_okay=False,
+            allow_dash=True,
+            help="Read URLs from a file, one per line. Use - to read from stdin.",
+        ),
+    ] = None,
     download_dir: Annotated[
         Path,
         typer.Option(
@@ -90,6 +383,287 @@ def main(
             help="Download extra material for series.",
         ),
     ] = False,
+    jobs: Annotated[
+        int,
+        typer.Option(
+            "-j",
+            "--jobs",
+            min=1,
+            help="Number of episodes to download concurrently.",
+        ),
+    ] = 1,
+    sync: Annotated[
+        bool,
+        typer.Option(
+            "--sync",
+            help=(
+                "Keep an index of downloaded programs in the download directory, "
+                "and only process episodes that are not downloaded before."
+            ),
+        ),
+    ] = False,
+    watch: Annotated[
+        bool,
+        typer.Option(
+            "--watch",
+            help=(
+                "Keep running, and download new episodes of the given series as "
+                "they are published. Stop with Ctrl-C."
+            ),
+        ),
+    ] = False,
+    poll_interval: Annotated[
+        list[str] | None,
+        typer.Option(
+            "--poll-interval",
+            metavar="TYPE=SECONDS",
+            help=(
+                "How often series of a type are checked for new episodes in watch "
+                f"mode. TYPE is one of {', '.join(SERIES_TYPES)}. Can be repeated."
+            ),
+        ),
+    ] = None,
+    verify: Annotated[
+        bool,
+        typer.Option(
+            "--verify",
+            help=(
+                "Check that the media files in the download directory are complete, "
+                "without downloading anything."
+            ),
+        ),
+    ] = False,
+    requeue: Annotated[
+        bool,
+        typer.Option(
+            "--requeue",
+            help=(
+                "With --verify, rename incomplete files so that they are downloaded "
+                "again by the next run."
+            ),
+        ),
+    ] = False,
+    shard_value: Annotated[
+        str | None,
+        typer.Option(
+            "--shard",
+            metavar="K/N",
+            help=(
+                "Only download the programs assigned to shard K of N, so that N "
+                "machines can share the downloads of the same URLs. Series and "
+                "season images are downloaded by one of the shards."
+            ),
+        ),
+    ] = None,
+    export: Annotated[
+        Path | None,
+        typer.Option(
+            "--export-plan",
+            dir_okay=False,
+            help=(
+                "Write the programs that would be downloaded to this JSON file, "
+                "without downloading them."
+            ),
+        ),
+    ] = None,
+    resume: Annotated[
+        bool,
+        typer.Option(
+            "--resume",
+            help=(
+                "Download media in segments, so that interrupted downloads can "
+                "continue where they stopped."
+            ),
+        ),
+    ] = False,
+    engine: Annotated[
+        Engine,
+        typer.Option(
+            "--engine",
+            help=(
+                "Engine for downloading media. The native engine fetches several "
+                "segments of the stream concurrently."
+            ),
+        ),
+    ] = Engine.ffmpeg,
+    connections: Annotated[
+        int,
+        typer.Option(
+            "--connections",
+            min=1,
+            help="Number of concurrent connections per program, for the native engine.",
+        ),
+    ] = 4,
+    max_height: Annotated[
+        int | None,
+        typer.Option(
+            "--max-height",
+            min=1,
+            help="Select the best variant with at most this many lines, e.g. 720.",
+        ),
+    ] = None,
+    max_bitrate: Annotated[
+        int | None,
+        typer.Option(
+            "--max-bitrate",
+            parser=parse_bitrate,
+            metavar="BITRATE",
+            help="Select the best variant with at most this bitrate, e.g. 3M.",
+        ),
+    ] = None,
+    quality: Annotated[
+        Quality | None,
+        typer.Option(
+            "--quality",
+            help="Select the highest or lowest quality variant within the limits.",
+        ),
+    ] = None,
+    subtitles: Annotated[
+        list[str] | None,
+        typer.Option(
+            "--subtitles",
+            metavar="LANGUAGE|KIND",
+            help=(
+                "Download subtitles in a language or of a kind, e.g. nb or ttv, or "
+                "all subtitles. Can be repeated. By default, the subtitles that are "
+                "on by default at NRK are downloaded."
+            ),
+        ),
+    ] = None,
+    all_audio: Annotated[
+        bool,
+        typer.Option(
+            "--all-audio",
+            help="Include all alternative audio tracks in the media file.",
+        ),
+    ] = False,
+    retries: Annotated[
+        int,
+        typer.Option(
+            "--retries",
+            min=0,
+            help=(
+                "Number of times to retry requests that fail with connection errors, "
+                "rate limiting or server errors."
+            ),
+        ),
+    ] = 5,
+    limit_rate: Annotated[
+        int | None,
+        typer.Option(
+            "--limit-rate",
+            parser=parse_rate,
+            metavar="RATE",
+            help=(
+                "Limit the total download rate, in bytes per second, e.g. 2M. "
+                "Media is then downloaded by the native engine."
+            ),
+        ),
+    ] = None,
+    limit_rate_window: Annotated[
+        list[str] | None,
+        typer.Option(
+            "--limit-rate-window",
+            metavar="HH:MM-HH:MM=RATE",
+            help=(
+                "Use a different rate limit within a time of day, e.g. "
+                "07:00-23:00=1M or 23:00-07:00=unlimited. Can be repeated."
+            ),
+        ),
+    ] = None,
+    min_free_space: Annotated[
+        int | None,
+        typer.Option(
+            "--min-free-space",
+            parser=parse_size,
+            metavar="SIZE",
+            help=(
+                "Always leave this much free space in the download directory. "
+                "Defaults to 1G."
+            ),
+        ),
+    ] = None,
+    on_low_space: Annotated[
+        SpacePolicy,
+        typer.Option(
+            "--on-low-space",
+            help=(
+                "Whether to refuse to start downloads that need more space than is "
+                "free, or start them and wait for space to be freed."
+            ),
+        ),
+    ] = SpacePolicy.refuse,
+    on_locked: Annotated[
+        LockPolicy,
+        typer.Option(
+            "--on-locked",
+            help=(
+                "Whether to skip programs that another process is downloading to the "
+                "same directory, or wait for them to be finished."
+            ),
+        ),
+    ] = LockPolicy.skip,
+    cache: Annotated[
+        bool,
+        typer.Option(
+            "--cache/--no-cache",
+            help="Cache responses from the NRK TV API on disk.",
+        ),
+    ] = True,
+    cache_dir: Annotated[
+        Path,
+        typer.Option(
+            "--cache-dir",
+            file_okay=False,
+            dir_okay=True,
+            envvar="NRKDOWNLOAD_CACHE_DIR",
+            help=(
+                "Directory for the response cache. Can also be specified by setting "
+                "the environment variable NRKDOWNLOAD_CACHE_DIR."
+            ),
+        ),
+    ] = DEFAULT_CACHE_DIR,
+    cache_ttl: Annotated[
+        list[str] | None,
+        typer.Option(
+            "--cache-ttl",
+            metavar="ENDPOINT=SECONDS",
+            help=(
+                "Override how long responses from an endpoint are cached. "
+                f"ENDPOINT is one of {', '.join(ENDPOINTS)}. Can be repeated."
+            ),
+        ),
+    ] = None,
+    report: Annotated[
+        Path | None,
+        typer.Option(
+            "--report",
+            dir_okay=False,
+            help=(
+                "Write a JSON report with timings, sizes, cache hits, retries and "
+                "skipped programs to this file when the run is finished."
+            ),
+        ),
+    ] = None,
+    metrics_port: Annotated[
+        int | None,
+        typer.Option(
+            "--metrics-port",
+            min=0,
+            max=65535,
+            help="Serve metrics in the Prometheus text format on this port.",
+        ),
+    ] = None,
+    metrics_host: Annotated[
+        str,
+        typer.Option(
+            "--metrics-host",
+            help=(
+                "The address to serve the metrics on. Use 0.0.0.0 to serve them on "
+                "all interfaces."
+            ),
+        ),
+    ] = DEFAULT_METRICS_HOST,
     _version: Annotated[
         bool | None,
         typer.Option(
@@ -115,22 +689,90 @@ def main(
     ] = 0,
 ) -> None:
     """Download content from https://tv.nrk.no/."""
-    try:
-        ffmpeg_version = FFmpeg().option("version").execute().decode("utf-8")
-        logger.info(f"FFmpeg version: {ffmpeg_version.splitlines()[:2]}")
-    except FileNotFoundError:
-        typer.echo(
-            "\nFFmpeg not found, must be installed to use this package.\n"
-            "See documentation: https://nrkdownload.readthedocs.io/"
-        )
-        raise typer.Exit(1) from None
+    if verify:
+        raise typer.Exit(code=verify_downloads(download_dir, requeue))
+    shard = parse_shard(shard_value) if shard_value else None
 
-    for url in urls:
-        if program_id := match_program_url(url):
-            download_program(download_dir, program_id)
-        elif match := match_series_url(url):
-            series_id, season_id, episode_id = match
-            download_series(download_dir, series_id, with_extras, season_id, episode_id)
+    download_requests, failures = parse_urls(iter_urls(urls or [], input_file))
+    if not download_requests:
+        if not failures:
+            raise typer.BadParameter("Give at least one URL, or use --input-file.")
+        raise typer.Exit(code=1)
+
+    check_ffmpeg(cache_dir if cache else None)
+
+    from nrkdownload.artwork import ETAG_FILENAME, artwork
+    from nrkdownload.cache import ResponseCache
+    from nrkdownload.client import DEFAULT_CONNECTIONS_PER_HOST, configure_session
+    from nrkdownload.diskspace import DEFAULT_RESERVE, disk
+    from nrkdownload.locks import locks
+    from nrkdownload.nrk_tv import session, use_response_cache
+    from nrkdownload.plan import deduplicate
+    from nrkdownload.ratelimit import limiter
+    from nrkdownload.state import StateIndex
+
+    # Media segments are fetched concurrently by all jobs from the same host
+    configure_session(
+        session,
+        connections_per_host=max(DEFAULT_CONNECTIONS_PER_HOST, jobs * connections),
+        retries=retries,
+    )
+    limiter.configure(limit_rate, parse_bandwidth_windows(limit_rate_window or []))
+    disk.configure(
+        DEFAULT_RESERVE if min_free_space is None else min_free_space, on_low_space
+    )
+    locks.configure(on_locked)
+    if cache:
+        ttls = parse_cache_ttls(cache_ttl or [])
+        if watch:
+            # New episodes must be seen as soon as the seasons are polled
+            ttls = {"season": dt.timedelta(0)} | ttls
+        use_response_cache(ResponseCache(cache_dir, ttls))
+        artwork.use_etag_file(cache_dir / ETAG_FILENAME)
+    state = StateIndex.for_download_dir(download_dir) if sync or watch else None
+    options = download_options(
+        resume,
+        engine,
+        connections,
+        max_height,
+        max_bitrate,
+        quality,
+        subtitles or [],
+        all_audio,
+    )
+
+    with collect_metrics(report, metrics_port, metrics_host):
+        if watch and state is not None:
+            watch_series(
+                download_requests,
+                download_dir,
+                state,
+                jobs,
+                options,
+                parse_poll_intervals(poll_interval or []),
+                shard,
+            )
+            return
+
+        if export is not None:
+            failures += export_plan(
+                deduplicate(download_requests),
+                download_dir,
+                with_extras,
+                state,
+                shard,
+                export,
+            )
         else:
-            typer.echo("Not able to parse URL")
-            raise typer.Exit(code=1)
+            failures += download_all(
+                deduplicate(download_requests),
+                download_dir,
+                with_extras,
+                jobs,
+                state,
+                options,
+                shard,
+            )
+
+    if failures:
+        raise typer.Exit(code=1)
@@ -0,0 +1,211 @@
+"""Client for the NRK TV API, with connection pooling, timeouts and retries.
+
+The client is built on a requests session, so the same connection pools are used for
+API calls, playlists and media segments. Each host gets its own pool, which also caps
+the number of concurrent connections to that host.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import os
+from collections.abc import Mapping
+from typing import TYPE_CHECKING, Any
+
+import requests
+from loguru import logger
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from nrkdownload.metrics import metrics
+from nrkdownload.settings import endpoint
+
+if TYPE_CHECKING:
+    from types import TracebackType
+
+    from typing_extensions import Self
+    from urllib3.connectionpool import ConnectionPool
+    from urllib3.response import BaseHTTPResponse
+
+    from nrkdownload.cache import ResponseCache
+
+# Can be changed to run against a mock of the API, e.g. in the benchmarks
+PS_API = os.environ.get("NRKDOWNLOAD_PSAPI_URL", "https://psapi.nrk.no/")
+
+DEFAULT_CONNECTIONS_PER_HOST = 16
+DEFAULT_RETRIES = 5
+# Seconds before the first retry. The delay is doubled for each retry.
+DEFAULT_BACKOFF = 0.5
+MAX_BACKOFF = 60.0
+# Seconds to wait for a connection, and between bytes of the response
+DEFAULT_TIMEOUT = (10.0, 30.0)
+
+# Rate limiting and transient server errors
+RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+
+
+class LoggingRetry(Retry):
+    """Retry configuration that logs each retry."""
+
+    def increment(
+        self,
+        method: str | None = None,
+        url: str | None = None,
+        response: BaseHTTPResponse | None = None,
+        error: Exception | None = None,
+        _pool: ConnectionPool | None = None,
+        _stacktrace: TracebackType | None = None,
+    ) -> Self:
+        """Count a failed attempt, and log why it is retried."""
+        retry = super().increment(method, url, response, error, _pool, _stacktrace)
+        if retry.history:
+            attempt = retry.history[-1]
+            reason = attempt.status or attempt.error
+            logger.debug(f"Retrying {attempt.url} after {reason}")
+            metrics.inc(
+                "http_retries_total",
+                reason=str(attempt.status or type(attempt.error).__name__),
+            )
+        return retry
+
+
+class TimeoutHTTPAdapter(HTTPAdapter):
+    """HTTP adapter with a default timeout for requests that do not set one."""
+
+    def __init__(
+        self,
+        timeout: tuple[float, float] = DEFAULT_TIMEOUT,
+        pool_maxsize: int = DEFAULT_CONNECTIONS_PER_HOST,
+        pool_block: bool = False,
+        max_retries: Retry | int = 0,
+    ) -> None:
+        """Create an adapter with a default timeout in seconds."""
+        self.timeout = timeout
+        super().__init__(
+            pool_maxsize=pool_maxsize, pool_block=pool_block, max_retries=max_retries
+        )
+
+    def send(
+        self,
+        request: requests.PreparedRequest,
+        stream: bool = False,
+        timeout: float | tuple[float, float] | tuple[float, None] | None = None,
+        verify: bool | str = True,
+        cert: bytes | str | tuple[bytes | str, bytes | str] | None = None,
+        proxies: Mapping[str, str] | None = None,
+    ) -> requests.Response:
+        """Send a request, with the default timeout if none is given."""
+        if timeout is None:
+            timeout = self.timeout
+        return super().send(request, stream, timeout, verify, cert, proxies)
+
+
+def configure_session(
+    session: requests.Session,
+    connections_per_host: int = DEFAULT_CONNECTIONS_PER_HOST,
+    retries: int = DEFAULT_RETRIES,
+    backoff: float = DEFAULT_BACKOFF,
+    timeout: tuple[float, float] = DEFAULT_TIMEOUT,
+) -> None:
+    """Configure pooling, timeouts and retries for a session.
+
+    Args:
+        session (requests.Session): The session to configure.
+        connections_per_host (int, optional): Number of connections kept open to each
+            host. Requests wait for a free connection when all are in use.
+        retries (int, optional): Number of retries after connection errors, rate
+            limiting and server errors.
+        backoff (float, optional): Seconds to wait before the first retry. The delay
+            is doubled for each retry, with random jitter. A Retry-After header from
+            the server is honoured.
+        timeout (tuple, optional): Connect and read timeout, in seconds.
+    """
+    # backoff_max and backoff_jitter were added in urllib3 2.0
+    retry = LoggingRetry(
+        total=retries,
+        backoff_factor=backoff,
+        backoff_max=MAX_BACKOFF,
+        backoff_jitter=backoff,
+        status_forcelist=RETRY_STATUSES,
+        allowed_methods={"GET", "HEAD"},
+        respect_retry_after_header=True,
+        # Return the last response, so that raise_for_status() reports the error
+        raise_on_status=False,
+    )
+    adapter = TimeoutHTTPAdapter(
+        timeout=timeout,
+        pool_maxsize=connections_per_host,
+        pool_block=True,
+        max_retries=retry,
+    )
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+
+
+def create_session(
+    connections_per_host: int = DEFAULT_CONNECTIONS_PER_HOST,
+    retries: int = DEFAULT_RETRIES,
+) -> requests.Session:
+    """Create a session with pooling, timeouts and retries."""
+    session = requests.Session()
+    configure_session(session, connections_per_host, retries)
+    return session
+
+
+class PsapiClient:
+    """Synchronous client for the NRK TV API.
+
+    The client is thread safe, and is shared by all threads in the process.
+
+    Example:
+    >>> data = PsapiClient().get_json("/tv/catalog/series/lykkeland")
+    """
+
+    def __init__(
+        self,
+        base_url: str = PS_API,
+        session: requests.Session | None = None,
+        cache: ResponseCache | None = None,
+    ) -> None:
+        """Create a client. Responses are cached if a cache is given."""
+        self.base_url = base_url
+        self.session = session or create_session()
+        self.cache = cache
+
+    def get_json(self, path: str) -> Any:  # noqa: ANN401
+        """Get JSON data for a path in the API."""
+        url = self.base_url + path
+        with metrics.timer("api_request_seconds", endpoint=endpoint(url) or "other"):
+            if self.cache is not None:
+                return self.cache.get_json(self.session, url)
+            r = self.session.get(url)
+            r.raise_for_status()
+            return r.json()
+
+
+class AsyncPsapiClient:
+    """Asyncio client for the NRK TV API.
+
+    Requests are made by a synchronous client in worker threads, so the connection
+    pools, retries and cache are shared with it.
+
+    Example:
+    >>> async_client = AsyncPsapiClient(max_concurrency=8)
+    >>> data = await async_client.get_json("/tv/catalog/series/lykkeland")
+    """
+
+    def __init__(
+        self, client: PsapiClient | None = None, max_concurrency: int = 8
+    ) -> None:
+        """Create a client that makes at most max_concurrency requests at a time."""
+        self.client = client or PsapiClient()
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def get_json(self, path: str) -> Any:  # noqa: ANN401
+        """Get JSON data for a path in the API."""
+        async with self._semaphore:
+            return await asyncio.to_thread(self.client.get_json, path)
+
+    async def get_many(self, paths: list[str]) -> list[Any]:
+        """Get JSON data for several paths concurrently, in the order given."""
+        return await asyncio.gather(*(self.get_json(path) for path in paths))
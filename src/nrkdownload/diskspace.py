@@ -0,0 +1,154 @@
+"""Process-wide accounting of free disk space in the download directory.
+
+Before a plan is started, the estimated size of its programs is compared with the
+free space. While downloading, each program reserves its estimated size, and waits
+until there is room for it next to the other downloads. Downloads also pause when
+the free space drops below the reserve, e.g. because other jobs are writing to the
+same volume, rather than fail with a full disk.
+"""
+
+from __future__ import annotations
+
+import shutil
+import threading
+from collections.abc import Iterator
+from contextlib import contextmanager
+from pathlib import Path
+
+from loguru import logger
+
+from nrkdownload.settings import SpacePolicy
+
+# Space that is always left free on the volume, in bytes
+DEFAULT_RESERVE = 1024**3
+# How often to check the free space while waiting, in seconds
+POLL_SECONDS = 30.0
+
+
+class InsufficientSpaceError(Exception):
+    """Raised when there is not enough free space for a download."""
+
+    pass
+
+
+def free_space(directory: Path) -> int:
+    """Get the free space in bytes on the volume of a directory.
+
+    The directory does not have to exist, the nearest existing parent is used.
+    """
+    for path in (directory, *directory.parents):
+        if path.exists():
+            return shutil.disk_usage(path).free
+    return shutil.disk_usage(Path.cwd()).free
+
+
+def format_size(nbytes: float) -> str:
+    """Format a number of bytes, e.g. 1.5 GB."""
+    for unit in ("B", "kB", "MB", "GB"):
+        if abs(nbytes) < 1024:
+            return f"{nbytes:.1f} {unit}"
+        nbytes /= 1024
+    return f"{nbytes:.1f} TB"
+
+
+class DiskSpace:
+    """Reservations of disk space for the downloads in progress.
+
+    Example:
+    >>> disk.check(download_dir, estimated_size)
+    >>> with disk.claim(directory, program_size):
+    ...     download()
+    """
+
+    def __init__(
+        self,
+        reserve: int = DEFAULT_RESERVE,
+        policy: SpacePolicy = SpacePolicy.refuse,
+        poll_seconds: float = POLL_SECONDS,
+    ) -> None:
+        """Create an accounting that keeps reserve bytes free."""
+        self._condition = threading.Condition()
+        self._reserved = 0
+        self.poll_seconds = poll_seconds
+        self.configure(reserve, policy)
+
+    def configure(self, reserve: int, policy: SpacePolicy) -> None:
+        """Set the space to keep free, and what to do when a plan does not fit."""
+        self.reserve = reserve
+        self.policy = policy
+
+    def available(self, directory: Path) -> int:
+        """Get the free space that is not reserved by downloads in progress."""
+        with self._condition:
+            reserved = self._reserved
+        return free_space(directory) - reserved - self.reserve
+
+    def check(self, directory: Path, nbytes: int) -> None:
+        """Check that there is room for nbytes before a plan is started.
+
+        Raises:
+            InsufficientSpaceError: If there is not enough space, and the policy is
+                to refuse.
+        """
+        available = self.available(directory)
+        logger.info(
+            f"Estimated size is {format_size(nbytes)}, "
+            f"{format_size(max(available, 0))} is available"
+        )
+        if nbytes <= available:
+            return
+        message = (
+            f"The downloads need about {format_size(nbytes)}, but only "
+            f"{format_size(max(available, 0))} is available in {directory}"
+        )
+        if self.policy == SpacePolicy.refuse:
+            raise InsufficientSpaceError(message)
+        logger.warning(f"{message}. Downloads will wait for free space.")
+
+    @contextmanager
+    def claim(self, directory: Path, nbytes: int) -> Iterator[None]:
+        """Reserve space for a download, waiting until there is room for it.
+
+        Raises:
+            InsufficientSpaceError: If the download does not fit even when no other
+                downloads are running, and the policy is to refuse.
+        """
+        with self._condition:
+            waiting = False
+            while (available := free_space(directory) - self.reserve) < (
+                self._reserved + nbytes
+            ):
+                if self.policy == SpacePolicy.refuse and available < nbytes:
+                    raise InsufficientSpaceError(
+                        f"The download needs about {format_size(nbytes)}, but only "
+                        f"{format_size(max(available, 0))} is available in {directory}"
+                    )
+                if not waiting:
+                    logger.warning(
+                        f"Waiting for {format_size(nbytes)} of free space "
+                        f"in {directory}"
+                    )
+                    waiting = True
+                # Woken when another download finishes, or polled for other processes
+                self._condition.wait(self.poll_seconds)
+            self._reserved += nbytes
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._reserved -= nbytes
+                self._condition.notify_all()
+
+    def wait_for_space(self, directory: Path) -> None:
+        """Pause while the free space is below the reserve."""
+        if free_space(directory) >= self.reserve:
+            return
+        logger.warning(f"Low on disk space in {directory}, pausing the download")
+        with self._condition:
+            while free_space(directory) < self.reserve:
+                self._condition.wait(self.poll_seconds)
+        logger.info("Continuing the download")
+
+
+# Shared by all downloads in the process
+disk = DiskSpace()
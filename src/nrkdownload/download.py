@@ -1,89 +1,150 @@
-"""Functions for downloading TV programs and series from NRK TV."""
+"""Functions for downloading single programs, and programs from the download queue.
+
+The downloads of a run are scheduled by the scheduler module.
+"""
 
 from __future__ import annotations
 
-from pathlib import Path
+import threading
+import time
 
+import requests
+import rich.progress
 import typer
+from ffmpeg.errors import FFmpegError
 from loguru import logger
+from pydantic import ValidationError
+
+from nrkdownload.diskspace import InsufficientSpaceError, disk
+from nrkdownload.locks import ProgramLockedError
+from nrkdownload.metrics import metrics
+from nrkdownload.nrk_tv import DownloadOptions, NotPlayableError, TVProgram
+from nrkdownload.plan import ProgramJob
+from nrkdownload.state import (
+    QUEUE_POLL_SECONDS,
+    JobStatus,
+    ProgramStatus,
+    QueueItem,
+    StateIndex,
+)
+from nrkdownload.verify import IncompleteMediaError
 
-from nrkdownload.nrk_tv import (
-    NotPlayableError,
-    TVProgram,
-    TVSeries,
-    TVSeriesType,
-    valid_filename,
+# Errors that fail the download of one program, without stopping the others. The
+# metadata of a planned program is only validated when it is downloaded, and the
+# space for it is claimed when it starts.
+DOWNLOAD_ERRORS = (
+    requests.RequestException,
+    FFmpegError,
+    IncompleteMediaError,
+    ValidationError,
+    InsufficientSpaceError,
 )
 
 
-def download_series(
-    download_dir: Path,
-    series_id: str,
-    with_extras: bool,
-    only_season_id: str | None = None,
-    only_episode_id: str | None = None,
+def download_job(
+    job: ProgramJob,
+    progress: rich.progress.Progress | None = None,
+    state: StateIndex | None = None,
+    options: DownloadOptions | None = None,
 ) -> None:
-    """Download a series.
-
-    Args:
-        download_dir (_type_): _description_
-        series_id (_type_): _description_
-        with_extras (_type_): Whether to include extra material.
-        only_season_id (_type_, optional): _description_. Defaults to None.
-        only_episode_id (_type_, optional): _description_. Defaults to None.
+    """Download a single program, and record it in the index.
+
+    The download waits until there is free space for the estimated size.
     """
-    if only_season_id == "ekstramateriale":
-        with_extras = True
-    series = TVSeries.from_series_id(series_id, with_extras)
-    typer.echo(f"Downloading {series.title}")
-    series.download_images(download_dir)
-    for season_info in series.season_infos:
-        if (only_season_id is not None) and (season_info.season_id != only_season_id):
-            logger.debug(f"Skipping season number {season_info.season_id}...")
-            continue
+    size = job.estimate_size(options.variant if options else None)
+    with disk.claim(job.directory, size):
+        media_filename = job.download(progress, options)
+    if state is not None:
+        state.record_program(
+            job.program.program_id,
+            ProgramStatus.done,
+            media_filename,
+            job.series_id,
+            job.season_id,
+            job.program.duration,
+        )
 
-        season = series.get_season(season_info.season_id)
-        typer.echo(f"Downloading {season.title}")
-        season.download_images(download_dir / series.dirname)
-
-        directory = download_dir / series.dirname / season.dirname
-        for episode_number, program_id in enumerate(season.episodes, start=1):
-            # If we're asked to only download one episode, possibly skip this one.
-            if (only_episode_id is not None) and (only_episode_id != program_id):
-                logger.debug(f"Skipping episode ID {program_id}...")
-                continue
-
-            try:
-                program = TVProgram.from_program_id(program_id)
-            except NotPlayableError as e:
-                typer.echo(f"Skipping: {e}")
-                continue
-
-            if series.type == TVSeriesType.sequential:
-                if season_info.season_id == "ekstramateriale":
-                    sequence_string = ""
-                else:
-                    sequence_string = f"s{season.season_id:>02s}e{episode_number:>02d}"
-            else:
-                sequence_string = season.season_id
-
-            program.download_as_episode(
-                valid_filename(series.title), sequence_string, directory
-            )
-            # typer.echo(f"Downloading episode {program.title}")
-
-
-def download_program(download_dir: Path, program_id: str) -> None:
-    """Download a Program.
-
-    Args:
-        download_dir (_type_): _description_
-        program_id (_type_): _description_
+
+def download_item(
+    item: QueueItem,
+    progress: rich.progress.Progress | None,
+    state: StateIndex,
+    options: DownloadOptions | None = None,
+) -> tuple[JobStatus, str | None]:
+    """Download a program from the queue.
+
+    Returns:
+        tuple[JobStatus, str | None]: The new status of the program in the queue,
+            and the error if the download failed.
     """
     try:
-        program = TVProgram.from_program_id(program_id)
+        program = TVProgram.from_program_id(item.program_id)
+        download_job(ProgramJob.from_item(item, program), progress, state, options)
     except NotPlayableError as e:
         typer.echo(f"Skipping: {e}")
-        return
-    typer.echo(f"Downloading {program.title}")
-    program.download_as_program(download_dir / program.title)
+        metrics.inc("skipped_total", reason="not_playable")
+        state.record_program(
+            item.program_id,
+            ProgramStatus.not_playable,
+            series_id=item.series_id,
+            season_id=item.season_id,
+        )
+        return JobStatus.not_playable, str(e)
+    except ProgramLockedError as e:
+        typer.echo(f"Skipping: {e}")
+        metrics.inc("skipped_total", reason="locked")
+        # Tried again later, when the other process has usually downloaded it
+        return JobStatus.deferred, str(e)
+    except DOWNLOAD_ERRORS as e:
+        typer.echo(f"Failed to download {item.program_id}: {e}")
+        metrics.inc("failed_total")
+        return JobStatus.failed, str(e)
+    return JobStatus.done, None
+
+
+def process_item(
+    item: QueueItem,
+    progress: rich.progress.Progress | None,
+    state: StateIndex,
+    options: DownloadOptions | None = None,
+) -> None:
+    """Download a program claimed from the queue, and record the outcome.
+
+    Unexpected errors are logged and recorded as a failed attempt, so that one
+    program does not stop the worker.
+    """
+    try:
+        status, error = download_item(item, progress, state, options)
+    except Exception as e:
+        logger.opt(exception=e).error(
+            f"Unexpected error when downloading {item.program_id}"
+        )
+        metrics.inc("failed_total")
+        status, error = JobStatus.failed, repr(e)
+    state.finish(item.program_id, status, error)
+
+
+def work_queue(
+    state: StateIndex,
+    run: str | None,
+    progress: rich.progress.Progress | None,
+    options: DownloadOptions | None,
+    queued: threading.Event | None = None,
+) -> None:
+    """Download programs from the queue, one at a time, until nothing is left.
+
+    If the queue is still being filled, set the queued event when it is complete. The
+    worker then waits for more programs until it is set.
+    """
+    while True:
+        delay = state.seconds_until_next(run)
+        if delay is None:
+            if queued is None or queued.is_set():
+                return
+            delay = QUEUE_POLL_SECONDS
+        item = state.claim_next(run)
+        if item is None:
+            # Other workers are busy, or the next retry is not due yet
+            time.sleep(delay)
+            continue
+        process_item(item, progress, state, options)
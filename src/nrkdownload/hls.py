@@ -0,0 +1,449 @@
+"""Native downloader for HLS streams.
+
+The master and media playlists are parsed here, and the segments are fetched over
+several concurrent connections. The segments are passed in order to FFmpeg, which
+only has to remux them into an MP4 file.
+"""
+
+from __future__ import annotations
+
+import concurrent.futures
+import io
+import re
+import threading
+import time
+from collections import OrderedDict, deque
+from collections.abc import Callable
+from pathlib import Path
+from typing import TYPE_CHECKING
+from urllib.parse import urljoin
+
+import requests
+from ffmpeg import FFmpeg
+from loguru import logger
+from pydantic import BaseModel
+
+from nrkdownload.ratelimit import CHUNK_SIZE, limiter
+from nrkdownload.settings import Quality
+
+if TYPE_CHECKING:
+    from _typeshed import WriteableBuffer
+
+ATTRIBUTE = re.compile(r'([A-Z0-9-]+)=("[^"]*"|[^,]*)')
+# The kind of track in the MP4 file for each codec in a master playlist
+CODEC_TRACKS = {
+    "avc1": "video",
+    "avc3": "video",
+    "hvc1": "video",
+    "hev1": "video",
+    "mp4v": "video",
+    "mp4a": "audio",
+    "ac-3": "audio",
+    "ec-3": "audio",
+}
+# The number of parsed master playlists to keep, and for how long, in seconds
+MASTER_CACHE_SIZE = 2048
+MASTER_MAX_AGE = 600.0
+
+
+class UnsupportedStreamError(Exception):
+    """Raised when a stream can not be downloaded by the native downloader."""
+
+    pass
+
+
+class Variant(BaseModel):
+    """A variant stream in a master playlist."""
+
+    url: str
+    bandwidth: int
+    width: int | None = None
+    height: int | None = None
+    audio_group: str | None = None
+    # E.g. avc1.4d401f and mp4a.40.2, if the playlist lists them
+    codecs: list[str] = []
+
+
+class VariantSelector(BaseModel):
+    """Criteria for selecting a variant stream."""
+
+    max_height: int | None = None
+    # Bits per second
+    max_bitrate: int | None = None
+    quality: Quality = Quality.highest
+
+    def accepts(self, variant: Variant) -> bool:
+        """Check whether a variant satisfies the limits."""
+        if self.max_height is not None and (variant.height or 0) > self.max_height:
+            return False
+        return self.max_bitrate is None or variant.bandwidth <= self.max_bitrate
+
+    def select(self, variants: list[Variant]) -> Variant:
+        """Select the best variant within the limits.
+
+        If no variant is within the limits, the lowest bandwidth variant is selected.
+        """
+        accepted = [variant for variant in variants if self.accepts(variant)]
+        if not accepted:
+            return min(variants, key=lambda variant: variant.bandwidth)
+        if self.quality == Quality.lowest:
+            return min(accepted, key=lambda variant: variant.bandwidth)
+        return max(accepted, key=lambda variant: variant.bandwidth)
+
+
+class AudioRendition(BaseModel):
+    """An alternative audio rendition in a master playlist."""
+
+    url: str
+    group: str
+    language: str | None = None
+    name: str | None = None
+    default: bool = False
+
+
+class MasterPlaylist(BaseModel):
+    """An HLS master playlist."""
+
+    variants: list[Variant]
+    # Audio groups where the audio is in a separate playlist
+    separate_audio_groups: set[str] = set()
+    audio: list[AudioRendition] = []
+
+
+class StreamSelection(BaseModel):
+    """The playlists to download for a program: video, and separate audio if any."""
+
+    url: str
+    audio: list[AudioRendition] = []
+
+
+class MediaSegment(BaseModel):
+    """A segment in a media playlist."""
+
+    url: str
+    duration: float
+
+
+class MediaPlaylist(BaseModel):
+    """An HLS media playlist."""
+
+    segments: list[MediaSegment]
+    init_url: str | None = None
+    encrypted: bool = False
+
+
+def parse_attributes(line: str) -> dict[str, str]:
+    """Parse the attribute list of a tag, e.g. #EXT-X-STREAM-INF:BANDWIDTH=..."""
+    _, _, attributes = line.partition(":")
+    return {key: value.strip('"') for key, value in ATTRIBUTE.findall(attributes)}
+
+
+def is_master_playlist(text: str) -> bool:
+    """Check whether a playlist is a master playlist."""
+    return "#EXT-X-STREAM-INF" in text
+
+
+def parse_master_playlist(text: str, base_url: str) -> MasterPlaylist:
+    """Parse a master playlist. Relative URLs are resolved against base_url."""
+    variants = []
+    separate_audio_groups = set()
+    audio = []
+    attributes = None
+    for line in text.splitlines():
+        line = line.strip()
+        if line.startswith("#EXT-X-STREAM-INF"):
+            attributes = parse_attributes(line)
+        elif line.startswith("#EXT-X-MEDIA"):
+            media = parse_attributes(line)
+            if media.get("TYPE") == "AUDIO" and "URI" in media:
+                separate_audio_groups.add(media["GROUP-ID"])
+                audio.append(
+                    AudioRendition(
+                        url=urljoin(base_url, media["URI"]),
+                        group=media["GROUP-ID"],
+                        language=media.get("LANGUAGE"),
+                        name=media.get("NAME"),
+                        default=media.get("DEFAULT") == "YES",
+                    )
+                )
+        elif line and not line.startswith("#") and attributes is not None:
+            width, _, height = attributes.get("RESOLUTION", "").partition("x")
+            variants.append(
+                Variant(
+                    url=urljoin(base_url, line),
+                    bandwidth=int(attributes.get("BANDWIDTH", 0)),
+                    width=int(width) if width else None,
+                    height=int(height) if height else None,
+                    audio_group=attributes.get("AUDIO"),
+                    codecs=[
+                        codec.strip()
+                        for codec in attributes.get("CODECS", "").split(",")
+                        if codec.strip()
+                    ],
+                )
+            )
+            attributes = None
+    return MasterPlaylist(
+        variants=variants, separate_audio_groups=separate_audio_groups, audio=audio
+    )
+
+
+def parse_media_playlist(text: str, base_url: str) -> MediaPlaylist:
+    """Parse a media playlist. Relative URLs are resolved against base_url."""
+    segments = []
+    init_url = None
+    encrypted = False
+    duration = None
+    for line in text.splitlines():
+        line = line.strip()
+        if line.startswith("#EXTINF"):
+            duration = float(line.partition(":")[2].split(",")[0])
+        elif line.startswith("#EXT-X-MAP"):
+            init_url = urljoin(base_url, parse_attributes(line)["URI"])
+        elif line.startswith("#EXT-X-KEY"):
+            encrypted = encrypted or parse_attributes(line).get("METHOD") != "NONE"
+        elif line and not line.startswith("#") and duration is not None:
+            segments.append(
+                MediaSegment(url=urljoin(base_url, line), duration=duration)
+            )
+            duration = None
+    return MediaPlaylist(segments=segments, init_url=init_url, encrypted=encrypted)
+
+
+def fetch_text(session: requests.Session, url: str) -> str:
+    """Fetch a playlist."""
+    r = session.get(url, timeout=30)
+    r.raise_for_status()
+    return r.text
+
+
+def fetch_bytes(session: requests.Session, url: str) -> bytes:
+    """Fetch a segment, limited by the shared bandwidth limiter."""
+    with session.get(url, timeout=60, stream=True) as r:
+        r.raise_for_status()
+        content = bytearray()
+        for chunk in r.iter_content(CHUNK_SIZE):
+            limiter.consume(len(chunk))
+            content.extend(chunk)
+    return bytes(content)
+
+
+class SegmentStream(io.RawIOBase):
+    """A readable stream of the segments in a playlist, fetched concurrently.
+
+    At most 2 * connections segments are fetched ahead of the reader, so memory use
+    is bounded by the segment size, not the size of the stream.
+    """
+
+    def __init__(
+        self,
+        session: requests.Session,
+        playlist: MediaPlaylist,
+        connections: int,
+        on_progress: Callable[[float], None] | None = None,
+    ) -> None:
+        """Start fetching the segments in the playlist."""
+        super().__init__()
+        self._session = session
+        self._executor = concurrent.futures.ThreadPoolExecutor(connections)
+        self._on_progress = on_progress
+        self._window = 2 * connections
+
+        urls = [segment.url for segment in playlist.segments]
+        durations = [segment.duration for segment in playlist.segments]
+        if playlist.init_url is not None:
+            urls.insert(0, playlist.init_url)
+            durations.insert(0, 0.0)
+        self._urls = deque(urls)
+        self._durations = deque(durations)
+        self._pending: deque[concurrent.futures.Future[bytes]] = deque()
+        self._buffer = memoryview(b"")
+        self._seconds = 0.0
+        self._fill_window()
+
+    def _fill_window(self) -> None:
+        while self._urls and len(self._pending) < self._window:
+            url = self._urls.popleft()
+            self._pending.append(self._executor.submit(fetch_bytes, self._session, url))
+
+    def readable(self) -> bool:  # noqa: D102
+        return True
+
+    def readinto(self, buffer: WriteableBuffer) -> int:
+        """Read the next bytes of the stream into buffer."""
+        while not self._buffer:
+            if not self._pending:
+                return 0
+            self._buffer = memoryview(self._pending.popleft().result())
+            self._fill_window()
+            self._seconds += self._durations.popleft()
+            if self._on_progress is not None:
+                self._on_progress(self._seconds)
+
+        view = memoryview(buffer).cast("B")
+        size = min(len(view), len(self._buffer))
+        view[:size] = self._buffer[:size]
+        self._buffer = self._buffer[size:]
+        return size
+
+    def close(self) -> None:
+        """Stop fetching segments."""
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        super().close()
+
+
+class MasterPlaylists:
+    """The master playlists fetched recently, parsed and kept by URL.
+
+    The master playlist of a program is fetched when its size is estimated, and is
+    reused when its streams are selected for the download. The least recently used
+    playlists are dropped, and a playlist is fetched again after max_age seconds.
+    """
+
+    def __init__(
+        self, maxsize: int = MASTER_CACHE_SIZE, max_age: float = MASTER_MAX_AGE
+    ) -> None:
+        """Create an empty cache."""
+        self.maxsize = maxsize
+        self.max_age = max_age
+        # The time each playlist was fetched, and the playlist, or None if the URL
+        # is a media playlist
+        self._playlists: OrderedDict[str, tuple[float, MasterPlaylist | None]] = (
+            OrderedDict()
+        )
+        self._lock = threading.Lock()
+
+    def get(self, session: requests.Session, url: str) -> MasterPlaylist | None:
+        """Get the master playlist at a URL, or None if it is a media playlist."""
+        with self._lock:
+            entry = self._playlists.get(url)
+            if entry is not None and time.monotonic() - entry[0] < self.max_age:
+                self._playlists.move_to_end(url)
+                return entry[1]
+        text = fetch_text(session, url)
+        master = parse_master_playlist(text, url) if is_master_playlist(text) else None
+        with self._lock:
+            self._playlists[url] = (time.monotonic(), master)
+            self._playlists.move_to_end(url)
+            while len(self._playlists) > self.maxsize:
+                self._playlists.popitem(last=False)
+        return master
+
+
+# Shared by the size estimates and the downloads
+master_playlists = MasterPlaylists()
+
+
+def get_variants(session: requests.Session, url: str) -> list[Variant]:
+    """Get the variants of a stream, or an empty list if it has no master playlist."""
+    master = master_playlists.get(session, url)
+    return master.variants if master is not None else []
+
+
+def select_streams(
+    session: requests.Session,
+    url: str,
+    selector: VariantSelector | None = None,
+    all_audio: bool = False,
+) -> StreamSelection:
+    """Select the playlists to download from a stream, reusing a parsed master.
+
+    If neither a selector nor all audio renditions are asked for, the URL is returned
+    unchanged, and FFmpeg selects the variant. When the audio of the selected variant
+    is in separate playlists, the default rendition is included, or all of them if
+    all_audio is set.
+    """
+    if selector is None and not all_audio:
+        return StreamSelection(url=url)
+    master = master_playlists.get(session, url)
+    if master is None:
+        return StreamSelection(url=url)
+
+    variant = (selector or VariantSelector()).select(master.variants)
+    logger.debug(f"Selected variant with bandwidth {variant.bandwidth}")
+    renditions = [
+        rendition
+        for rendition in master.audio
+        if rendition.group == variant.audio_group
+    ]
+    if not renditions:
+        if all_audio:
+            logger.info("The stream has no alternative audio renditions")
+        return StreamSelection(url=variant.url)
+    if not all_audio:
+        default = [rendition for rendition in renditions if rendition.default]
+        renditions = default[:1] or renditions[:1]
+    return StreamSelection(url=variant.url, audio=renditions)
+
+
+def expected_tracks(
+    session: requests.Session, url: str, selector: VariantSelector | None = None
+) -> set[str] | None:
+    """Get the kinds of tracks that the download of a stream should have.
+
+    They are told by the codecs of the variant that is selected, and by its separate
+    audio renditions, e.g. {"audio"} for a program without video.
+
+    Returns:
+        set[str] | None: The kinds of tracks, or None if the playlist does not list
+            the codecs of the variant.
+    """
+    master = master_playlists.get(session, url)
+    if master is None:
+        return None
+    variant = (selector or VariantSelector()).select(master.variants)
+    if not variant.codecs:
+        return None
+    tracks = {
+        CODEC_TRACKS[codec.split(".")[0]]
+        for codec in variant.codecs
+        if codec.split(".")[0] in CODEC_TRACKS
+    }
+    if any(rendition.group == variant.audio_group for rendition in master.audio):
+        tracks.add("audio")
+    return tracks or None
+
+
+def download_hls(
+    session: requests.Session,
+    url: str,
+    output: Path,
+    connections: int = 4,
+    on_progress: Callable[[float], None] | None = None,
+    selector: VariantSelector | None = None,
+) -> None:
+    """Download an HLS stream to an MP4 file.
+
+    Args:
+        session (requests.Session): Session used for fetching playlists and segments.
+        url (str): URL of a master or media playlist.
+        output (Path): The MP4 file.
+        connections (int, optional): Number of segments to fetch concurrently.
+            Defaults to 4.
+        on_progress (Callable, optional): Called with the number of seconds
+            downloaded so far. Defaults to None.
+        selector (VariantSelector, optional): How to select the variant. Defaults to
+            None, which selects the highest bandwidth.
+
+    Raises:
+        UnsupportedStreamError: If the stream is encrypted, or the audio is in a
+            separate playlist.
+    """
+    master = master_playlists.get(session, url)
+    if master is not None:
+        variant = (selector or VariantSelector()).select(master.variants)
+        if variant.audio_group in master.separate_audio_groups:
+            raise UnsupportedStreamError("Audio is in a separate playlist")
+        logger.debug(f"Selected variant with bandwidth {variant.bandwidth}")
+        url = variant.url
+    text = fetch_text(session, url)
+
+    playlist = parse_media_playlist(text, url)
+    if playlist.encrypted:
+        raise UnsupportedStreamError("Stream is encrypted")
+
+    logger.info(f"Downloading {len(playlist.segments)} segments")
+    with SegmentStream(session, playlist, connections, on_progress) as stream:
+        FFmpeg().option("y").input("pipe:0").output(
+            str(output), c="copy", f="mp4"
+        ).execute(io.BufferedReader(stream))
@@ -0,0 +1,178 @@
+"""Advisory locks on the programs that are being downloaded.
+
+Several processes, possibly on different machines, may download to the same
+directory. Before a program is downloaded, a lock file is created next to its media
+file, so that the other processes skip the program or wait for it. The lock file is
+touched regularly while the download runs. A lock that has not been touched for a
+while is left by a process that has stopped, and is taken over.
+"""
+
+from __future__ import annotations
+
+import contextlib
+import os
+import socket
+import threading
+import time
+import uuid
+from collections.abc import Iterator
+from pathlib import Path
+
+from loguru import logger
+
+from nrkdownload.settings import LockPolicy
+
+LOCK_SUFFIX = ".lock"
+# How often the locks that are held are touched, in seconds
+HEARTBEAT_SECONDS = 15.0
+# A lock that has not been touched for this many seconds is stale
+STALE_SECONDS = 120.0
+# How often to check a lock that is held by another process, in seconds
+POLL_SECONDS = 5.0
+
+
+class ProgramLockedError(Exception):
+    """Raised when a program is being downloaded by another process."""
+
+    pass
+
+
+def lock_filename(media_filename: Path) -> Path:
+    """Get the filename of the lock for a media file."""
+    return Path(f"{media_filename}{LOCK_SUFFIX}")
+
+
+class ProgramLocks:
+    """The lock files held by this process, which are kept alive by a heartbeat.
+
+    Example:
+    >>> with locks.hold(media_filename):
+    ...     download()
+    """
+
+    def __init__(
+        self,
+        policy: LockPolicy = LockPolicy.skip,
+        heartbeat_seconds: float = HEARTBEAT_SECONDS,
+        stale_seconds: float = STALE_SECONDS,
+        poll_seconds: float = POLL_SECONDS,
+    ) -> None:
+        """Create locks that skip programs locked by other processes."""
+        self.heartbeat_seconds = heartbeat_seconds
+        self.stale_seconds = stale_seconds
+        self.poll_seconds = poll_seconds
+        # The lock files held, with the token written to each of them
+        self._held: dict[Path, str] = {}
+        self._lock = threading.Lock()
+        self._heartbeat: threading.Thread | None = None
+        self.configure(policy)
+
+    def configure(self, policy: LockPolicy) -> None:
+        """Set whether to skip or wait for programs locked by other processes."""
+        self.policy = policy
+
+    @contextlib.contextmanager
+    def hold(self, media_filename: Path) -> Iterator[None]:
+        """Lock a media file while it is downloaded.
+
+        Raises:
+            ProgramLockedError: If another process holds the lock, and the policy is
+                to skip.
+        """
+        path = lock_filename(media_filename)
+        token = f"{socket.gethostname()} {os.getpid()} {uuid.uuid4().hex}"
+        waiting = False
+        while not self.acquire(path, token):
+            message = f"{media_filename.name} is being downloaded by {owner(path)}"
+            if self.policy == LockPolicy.skip:
+                raise ProgramLockedError(message)
+            if not waiting:
+                logger.warning(f"{message}, waiting for it")
+                waiting = True
+            time.sleep(self.poll_seconds)
+        try:
+            yield
+        finally:
+            self.release(path, token)
+
+    def acquire(self, path: Path, token: str) -> bool:
+        """Try to create a lock file, taking it over if it is stale."""
+        path.parent.mkdir(parents=True, exist_ok=True)
+        for _ in range(2):
+            try:
+                fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+                break
+            except FileExistsError:
+                if not self.is_stale(path):
+                    return False
+                self.break_stale(path)
+        else:
+            return False
+        with os.fdopen(fd, "w") as file:
+            file.write(token)
+        with self._lock:
+            self._held[path] = token
+            if self._heartbeat is None:
+                self._heartbeat = threading.Thread(target=self.beat, daemon=True)
+                self._heartbeat.start()
+        return True
+
+    def release(self, path: Path, token: str) -> None:
+        """Remove a lock file, unless it has been taken over by another process."""
+        with self._lock:
+            self._held.pop(path, None)
+        with contextlib.suppress(FileNotFoundError):
+            if path.read_text() == token:
+                path.unlink()
+
+    def is_stale(self, path: Path) -> bool:
+        """Check if a lock file has not been touched for a while."""
+        try:
+            return time.time() - path.stat().st_mtime > self.stale_seconds
+        except FileNotFoundError:
+            # Released while it was checked, so it can be taken
+            return True
+
+    def break_stale(self, path: Path) -> None:
+        """Remove a stale lock file, so that it can be taken over.
+
+        The lock is renamed before it is removed, so that only one process breaks
+        it. If another process took the lock after it was found stale, it is put
+        back.
+        """
+        stale = path.with_name(f"{path.name}.{uuid.uuid4().hex}")
+        try:
+            path.rename(stale)
+        except FileNotFoundError:
+            return
+        if time.time() - stale.stat().st_mtime <= self.stale_seconds:
+            with contextlib.suppress(OSError):
+                os.link(stale, path)
+        else:
+            logger.warning(f"Taking over the stale lock held by {owner(stale)}")
+        stale.unlink()
+
+    def beat(self) -> None:
+        """Touch the lock files that are held, until none are left."""
+        while True:
+            time.sleep(self.heartbeat_seconds)
+            with self._lock:
+                paths = list(self._held)
+                if not paths:
+                    self._heartbeat = None
+                    return
+            for path in paths:
+                with contextlib.suppress(FileNotFoundError):
+                    os.utime(path)
+
+
+def owner(path: Path) -> str:
+    """Get the host and process ID that hold a lock file."""
+    with contextlib.suppress(OSError):
+        host, pid, _ = path.read_text().split(" ", 2)
+        return f"process {pid} on {host}"
+    return "another process"
+
+
+# Shared by all downloads in the process
+locks = ProgramLocks()
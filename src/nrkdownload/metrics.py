@@ -0,0 +1,285 @@
+"""Counters and histograms that show where the time goes in a run.
+
+Metrics are collected in a module-level registry, shared by all threads. They can be
+written as a JSON report when the run is finished, or served in the Prometheus text
+format while a long-running process, e.g. in watch mode, is running.
+
+Example:
+>>> with metrics.timer("api_request_seconds", endpoint="program"):
+...     data = client.get_json(path)
+>>> metrics.inc("skipped_total", reason="exists")
+>>> metrics.write_report(Path("report.json"))
+"""
+
+from __future__ import annotations
+
+import bisect
+import datetime as dt
+import http.server
+import json
+import threading
+import time
+from collections.abc import Iterator, Sequence
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any
+
+from loguru import logger
+from pydantic import BaseModel
+
+from nrkdownload.settings import DEFAULT_METRICS_HOST
+
+PROMETHEUS_PREFIX = "nrkdownload_"
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Upper bounds of the histogram buckets, in seconds
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0, 1800.0)
+# Upper bounds of the buckets for throughput, in bytes per second
+THROUGHPUT_BUCKETS = (1e5, 2.5e5, 5e5, 1e6, 2.5e6, 5e6, 1e7, 2.5e7, 5e7, 1e8)
+
+Labels = tuple[tuple[str, str], ...]
+
+
+class Histogram(BaseModel):
+    """Distribution of observed values, counted in buckets."""
+
+    buckets: list[float]
+    # The number of values in each bucket, and above the last bucket
+    counts: list[int]
+    count: int = 0
+    sum: float = 0.0
+
+    @classmethod
+    def with_buckets(cls, buckets: Sequence[float]) -> Histogram:
+        """Create an empty histogram with the given bucket bounds."""
+        return cls(buckets=list(buckets), counts=[0] * (len(buckets) + 1))
+
+    def observe(self, value: float) -> None:
+        """Add a value to the histogram."""
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def cumulative(self) -> list[tuple[str, int]]:
+        """Get the number of values less than or equal to each bucket bound."""
+        bounds = [format_number(bound) for bound in self.buckets] + ["+Inf"]
+        total = 0
+        cumulative = []
+        for bound, count in zip(bounds, self.counts, strict=True):
+            total += count
+            cumulative.append((bound, total))
+        return cumulative
+
+
+class ProgramMetrics(BaseModel):
+    """Size and download time of a program."""
+
+    program_id: str
+    bytes: int
+    seconds: float
+
+    @property
+    def throughput(self) -> float:
+        """Get the throughput in bytes per second."""
+        return self.bytes / self.seconds if self.seconds > 0 else 0.0
+
+
+class Metrics:
+    """Registry of counters and histograms, with labels.
+
+    All methods are thread safe.
+    """
+
+    def __init__(self) -> None:
+        """Create an empty registry."""
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        """Remove all metrics, and start a new run."""
+        with self._lock:
+            self.started = dt.datetime.now(dt.timezone.utc)
+            self._counters: dict[str, dict[Labels, float]] = {}
+            self._histograms: dict[str, dict[Labels, Histogram]] = {}
+            self._programs: list[ProgramMetrics] = []
+
+    def inc(self, name: str, value: float = 1.0, **labels: str) -> None:
+        """Increase a counter."""
+        key = label_key(labels)
+        with self._lock:
+            counter = self._counters.setdefault(name, {})
+            counter[key] = counter.get(key, 0.0) + value
+
+    def observe(
+        self,
+        name: str,
+        value: float,
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+        **labels: str,
+    ) -> None:
+        """Add a value to a histogram."""
+        self._observe(name, value, buckets, labels)
+
+    def _observe(
+        self, name: str, value: float, buckets: Sequence[float], labels: dict[str, str]
+    ) -> None:
+        key = label_key(labels)
+        with self._lock:
+            histograms = self._histograms.setdefault(name, {})
+            if key not in histograms:
+                histograms[key] = Histogram.with_buckets(buckets)
+            histograms[key].observe(value)
+
+    @contextmanager
+    def timer(self, name: str, **labels: str) -> Iterator[None]:
+        """Observe the wall time of a block of code, in seconds."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._observe(name, time.perf_counter() - start, DEFAULT_BUCKETS, labels)
+
+    def record_program(self, program_id: str, nbytes: int, seconds: float) -> None:
+        """Record the size and download time of a program."""
+        program = ProgramMetrics(program_id=program_id, bytes=nbytes, seconds=seconds)
+        with self._lock:
+            self._programs.append(program)
+        self.inc("downloaded_bytes_total", nbytes, kind="media")
+        self.observe("program_download_seconds", seconds)
+        self.observe(
+            "program_throughput_bytes_per_second",
+            program.throughput,
+            THROUGHPUT_BUCKETS,
+        )
+
+    def counter(self, name: str, **labels: str) -> float:
+        """Get the value of a counter."""
+        with self._lock:
+            return self._counters.get(name, {}).get(label_key(labels), 0.0)
+
+    def histogram(self, name: str, **labels: str) -> Histogram | None:
+        """Get a copy of a histogram, or None if nothing is observed."""
+        with self._lock:
+            histogram = self._histograms.get(name, {}).get(label_key(labels))
+            return histogram.model_copy(deep=True) if histogram else None
+
+    def report(self) -> dict[str, Any]:
+        """Get all metrics as a JSON serializable run report."""
+        finished = dt.datetime.now(dt.timezone.utc)
+        with self._lock:
+            return {
+                "started": self.started.isoformat(),
+                "finished": finished.isoformat(),
+                "duration_seconds": (finished - self.started).total_seconds(),
+                "counters": {
+                    name: [
+                        {"labels": dict(key), "value": value}
+                        for key, value in sorted(counter.items())
+                    ]
+                    for name, counter in sorted(self._counters.items())
+                },
+                "histograms": {
+                    name: [
+                        {
+                            "labels": dict(key),
+                            "count": histogram.count,
+                            "sum": histogram.sum,
+                            "buckets": dict(histogram.cumulative()),
+                        }
+                        for key, histogram in sorted(histograms.items())
+                    ]
+                    for name, histograms in sorted(self._histograms.items())
+                },
+                "programs": [
+                    program.model_dump() | {"throughput": program.throughput}
+                    for program in self._programs
+                ],
+            }
+
+    def write_report(self, filename: Path) -> None:
+        """Write the run report to a JSON file."""
+        filename.parent.mkdir(parents=True, exist_ok=True)
+        filename.write_text(json.dumps(self.report(), indent=2))
+        logger.info(f"Wrote run report to {filename}")
+
+    def prometheus(self) -> str:
+        """Get all metrics in the Prometheus text format."""
+        lines = []
+        with self._lock:
+            for name, counter in sorted(self._counters.items()):
+                metric = PROMETHEUS_PREFIX + name
+                lines.append(f"# TYPE {metric} counter")
+                for key, value in sorted(counter.items()):
+                    lines.append(f"{metric}{format_labels(key)} {format_number(value)}")
+            for name, histograms in sorted(self._histograms.items()):
+                metric = PROMETHEUS_PREFIX + name
+                lines.append(f"# TYPE {metric} histogram")
+                for key, histogram in sorted(histograms.items()):
+                    for bound, count in histogram.cumulative():
+                        labels = format_labels((*key, ("le", bound)))
+                        lines.append(f"{metric}_bucket{labels} {count}")
+                    labels = format_labels(key)
+                    lines.append(f"{metric}_sum{labels} {format_number(histogram.sum)}")
+                    lines.append(f"{metric}_count{labels} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+    def serve(
+        self, port: int, host: str = DEFAULT_METRICS_HOST
+    ) -> http.server.ThreadingHTTPServer:
+        """Serve the metrics in the Prometheus text format, in a background thread.
+
+        By default they are only served on the loopback interface. Use "" or
+        "0.0.0.0" as the host to serve them on all interfaces.
+
+        Returns:
+            ThreadingHTTPServer: The server. Call shutdown() to stop it.
+        """
+        registry = self
+
+        class MetricsHandler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self) -> None:
+                if self.path.partition("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                content = registry.prometheus().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", PROMETHEUS_CONTENT_TYPE)
+                self.send_header("Content-Length", str(len(content)))
+                self.end_headers()
+                self.wfile.write(content)
+
+            def log_message(self, format: str, *args: Any) -> None:  # noqa: A002, ANN401
+                logger.trace(format % args)
+
+        server = http.server.ThreadingHTTPServer((host, port), MetricsHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        logger.info(
+            f"Serving metrics on {host or 'all interfaces'}, "
+            f"port {server.server_address[1]}"
+        )
+        return server
+
+
+def label_key(labels: dict[str, str]) -> Labels:
+    """Get a hashable key for a set of labels."""
+    return tuple(sorted(labels.items()))
+
+
+def format_labels(labels: Labels) -> str:
+    """Format labels for the Prometheus text format, e.g. {endpoint="program"}."""
+    if not labels:
+        return ""
+    escaped = (
+        (name, value.replace("\\", r"\\").replace('"', r"\"").replace("\n", r"\n"))
+        for name, value in labels
+    )
+    return "{" + ",".join(f'{name}="{value}"' for name, value in escaped) + "}"
+
+
+def format_number(value: float) -> str:
+    """Format a number without a trailing .0 for whole numbers."""
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+# Shared by all threads in the process
+metrics = Metrics()
@@ -2,8 +2,14 @@
 
 from __future__ import annotations
 
+import concurrent.futures
+import dataclasses
 import datetime
+import functools
 import re
+import time
+import urllib.parse
+from collections.abc import Callable, Iterator
 from enum import Enum
 from pathlib import Path
 from typing import Any
@@ -14,8 +20,39 @@ from ffmpeg import FFmpeg, Progress
 from loguru import logger
 from pydantic import BaseModel, Field, HttpUrl
 
-PS_API = "https://psapi.nrk.no/"
-session = requests.Session()
+from nrkdownload.artwork import artwork
+from nrkdownload.cache import DEFAULT_TTLS, ResponseCache
+from nrkdownload.client import PsapiClient
+from nrkdownload.diskspace import disk
+from nrkdownload.hls import (
+    StreamSelection,
+    UnsupportedStreamError,
+    Variant,
+    VariantSelector,
+    download_hls,
+    expected_tracks,
+    get_variants,
+    select_streams,
+)
+from nrkdownload.locks import locks
+from nrkdownload.metrics import metrics
+from nrkdownload.ratelimit import limiter
+from nrkdownload.resume import download_resumable
+from nrkdownload.settings import Engine
+from nrkdownload.subtitles import SubtitleTrack, select_subtitles, subtitle_filenames
+from nrkdownload.verify import verify_media
+
+# Bits per second, used when the size of a stream can not be estimated from its variants
+FALLBACK_BANDWIDTH = 8_000_000
+
+# The links in a playback manifest expire, so a program that was resolved longer ago
+# is resolved again before it is downloaded
+MANIFEST_MAX_AGE = DEFAULT_TTLS["manifest"]
+
+# Shared by all threads. The session is also used for playlists and media segments.
+client = PsapiClient()
+session = client.session
+artwork.use_session(session)
 
 
 class NotPlayableError(Exception):
@@ -24,24 +61,68 @@ class NotPlayableError(Exception):
     pass
 
 
+def use_response_cache(cache: ResponseCache | None) -> None:
+    """Cache responses from the API in the given cache, or disable caching."""
+    client.cache = cache
+
+
+def psapi_get(path: str) -> Any:  # noqa: ANN401
+    """Get JSON data from the NRK TV API."""
+    return client.get_json(path)
+
+
 def valid_filename(string: str) -> str:
     """Convert a string to a valid filename."""
     return re.sub(r'[/\\?<>:*|!"\']', "", string)
 
 
-def get_image_url(data: dict[str, Any], key: str) -> HttpUrl | None:
-    """Get the URL of an image from a dictionary."""
+def get_image_href(data: dict[str, Any], key: str) -> str | None:
+    """Get the URL of an image from a dictionary, without validating it."""
     if data.get(key):
         return data[key][-1]["url"]
     return None
 
 
-def download_image_url(url: HttpUrl | None, filename: Path) -> None:
-    """Download an image from a URL."""
-    if url is not None:
-        filename.parent.mkdir(parents=True, exist_ok=True)
-        if not filename.exists():
-            filename.write_bytes(requests.get(url.unicode_string(), timeout=5).content)
+def get_image_url(data: dict[str, Any], key: str) -> HttpUrl | None:
+    """Get the URL of an image from a dictionary."""
+    href = get_image_href(data, key)
+    return HttpUrl(href) if href is not None else None
+
+
+def download_image_url(
+    url: HttpUrl | None, filename: Path
+) -> concurrent.futures.Future[Path | None] | None:
+    """Start downloading an image from a URL in the background.
+
+    Returns:
+        Future: The download, or None if there is no URL.
+    """
+    if url is None:
+        return None
+    return artwork.submit(url.unicode_string(), filename)
+
+
+def wait_for_images(
+    futures: list[concurrent.futures.Future[Path | None] | None],
+) -> None:
+    """Wait for image downloads to finish."""
+    concurrent.futures.wait([future for future in futures if future is not None])
+
+
+class DownloadOptions(BaseModel):
+    """Options for how programs are downloaded."""
+
+    # Continue interrupted downloads instead of starting from the beginning
+    resume: bool = False
+    engine: Engine = Engine.ffmpeg
+    # Number of segments fetched concurrently by the native engine
+    connections: int = 4
+    # If not given, FFmpeg selects the variant, and the native engine the highest
+    variant: VariantSelector | None = None
+    # Languages or kinds of subtitles, or "all". If empty, the default subtitles.
+    subtitles: list[str] = []
+    # Include all alternative audio renditions in the media file
+    all_audio: bool = False
 
 
 class TVProgram(BaseModel):
@@ -59,58 +140,206 @@ class TVProgram(BaseModel):
     poster_url: HttpUrl | None
     backdrop_url: HttpUrl | None
     media_urls: list[HttpUrl]
-    subtitle_urls: list[HttpUrl]
+    subtitles: list[SubtitleTrack] = []
 
     @classmethod
     def from_program_id(cls, program_id: str) -> TVProgram:
         """Create a TVProgram object from a program ID."""
-        r = session.get(PS_API + f"/tv/catalog/programs/{program_id}")
-        r.raise_for_status()
-        data = r.json()
-        r = session.get(PS_API + f"/playback/manifest/program/{program_id}")
-        r.raise_for_status()
-        manifest = r.json()
+        return ProgramRecord.from_program_id(program_id).to_program()
+
+    def get_variants(self) -> list[Variant]:
+        """Get the variant streams (resolutions and bitrates) of the program."""
+        return get_variants(session, self.media_urls[0].unicode_string())
+
+    def estimate_size(self, selector: VariantSelector | None = None) -> int:
+        """Estimate the size of the media file in bytes."""
+        return estimate_media_size(
+            self.program_id,
+            self.media_urls[0].unicode_string() if self.media_urls else None,
+            self.duration,
+            selector,
+        )
+
+    def program_filename(self, basedir: Path) -> Path:
+        """Get the filename, without suffix, as a standalone program."""
+        return program_filename(self.title, self.prod_year, basedir)
+
+    def episode_filename(
+        self, series_title: str, sequence_string: str, basedir: Path
+    ) -> Path:
+        """Get the filename, without suffix, as an episode in a series."""
+        return episode_filename(self.title, series_title, sequence_string, basedir)
+
+    def download_as_program(
+        self,
+        basedir: Path,
+        progress: rich.progress.Progress | None = None,
+        options: DownloadOptions | None = None,
+    ) -> Path:
+        """Download as a standalone program (not part of a series)."""
+        filename = self.program_filename(basedir)
+        images = [
+            download_image_url(self.poster_url, basedir / "poster.jpg"),
+            download_image_url(self.backdrop_url, basedir / f"{filename}-backdrop.jpg"),
+            download_image_url(self.image_url, basedir / f"{filename}.jpg"),
+        ]
+        media_filename = download_video(self, filename, progress, options)
+        wait_for_images(images)
+        return media_filename
+
+    def download_as_episode(
+        self,
+        series_title: str,
+        sequence_string: str,
+        basedir: Path,
+        progress: rich.progress.Progress | None = None,
+        options: DownloadOptions | None = None,
+    ) -> Path:
+        """Download as an episode in a series."""
+        filename = self.episode_filename(series_title, sequence_string, basedir)
+        image = download_image_url(self.image_url, Path(f"{filename}.jpg"))
+        media_filename = download_video(self, filename, progress, options)
+        wait_for_images([image])
+        return media_filename
+
+
+@dataclasses.dataclass(slots=True, frozen=True)
+class ProgramRecord:
+    """The metadata of a program, without validation.
+
+    Records are cheap to create, and are used when planning many programs. The URLs
+    are only validated when the record is turned into a TVProgram, just before the
+    program is downloaded.
+
+    Example:
+    >>> record = ProgramRecord.from_program_id("NNFA19010122")
+    >>> program = record.to_program()
+    """
+
+    program_id: str
+    title: str
+    prod_year: int
+    duration: datetime.timedelta
+    image_url: str | None
+    poster_url: str | None
+    backdrop_url: str | None
+    media_urls: tuple[str, ...]
+    # The subtitles in the manifest, as given by the API
+    subtitles: tuple[dict[str, Any], ...] = ()
+    # When the manifest was fetched, from time.monotonic()
+    resolved_at: float = dataclasses.field(default_factory=time.monotonic)
 
+    @classmethod
+    def from_program_id(cls, program_id: str) -> ProgramRecord:
+        """Create a record from a program ID.
+
+        Raises:
+            NotPlayableError: If the program is not playable.
+        """
+        data = psapi_get(f"/tv/catalog/programs/{program_id}")
+        manifest = psapi_get(f"/playback/manifest/program/{program_id}")
+        return cls.from_api(program_id, data, manifest)
+
+    @classmethod
+    def from_api(
+        cls, program_id: str, data: dict[str, Any], manifest: dict[str, Any]
+    ) -> ProgramRecord:
+        """Create a record from the program and its playback manifest in the API.
+
+        Raises:
+            NotPlayableError: If the program is not playable.
+        """
         title = valid_filename(data["programInformation"]["titles"]["title"])
         if manifest["playability"] != "playable":
             raise NotPlayableError(f'Program "{title}" ({program_id}) is not playable')
-        prod_year = data["moreInformation"]["productionYear"]
+        playable = manifest["playable"]
         return cls(
             program_id=program_id,
             title=title,
-            prod_year=prod_year,
+            prod_year=data["moreInformation"]["productionYear"],
             duration=datetime.timedelta(
                 seconds=data["moreInformation"]["duration"]["seconds"]
             ),
-            image_url=get_image_url(data["programInformation"], "image"),
-            poster_url=get_image_url(data, "posterImage"),
-            backdrop_url=get_image_url(data, "backdropImage"),
-            media_urls=[asset["url"] for asset in manifest["playable"]["assets"]],
-            subtitle_urls=[
-                title["webVtt"]
-                for title in manifest["playable"]["subtitles"]
-                if title["defaultOn"]
-            ],
+            image_url=get_image_href(data["programInformation"], "image"),
+            poster_url=get_image_href(data, "posterImage"),
+            backdrop_url=get_image_href(data, "backdropImage"),
+            media_urls=tuple(asset["url"] for asset in playable["assets"]),
+            subtitles=tuple(playable["subtitles"]),
         )
 
-    def download_as_program(self, basedir: Path) -> None:
-        """Download as a standalone program (not part of a series)."""
-        filename = basedir / f"{self.title} ({self.prod_year})"
-        download_image_url(self.poster_url, basedir / "poster.jpg")
-        download_image_url(self.backdrop_url, basedir / f"{filename}-backdrop.jpg")
-        download_image_url(self.image_url, basedir / f"{filename}.jpg")
-        download_video(self, filename)
+    def refresh(self, max_age: datetime.timedelta = MANIFEST_MAX_AGE) -> ProgramRecord:
+        """Resolve the program again if its manifest may have expired.
+
+        Raises:
+            NotPlayableError: If the program is no longer playable.
+        """
+        if time.monotonic() - self.resolved_at < max_age.total_seconds():
+            return self
+        logger.debug(f"Resolving {self.program_id} again, its manifest may expire")
+        return ProgramRecord.from_program_id(self.program_id)
+
+    def to_program(self) -> TVProgram:
+        """Validate the record, and create a TVProgram."""
+        subtitles = [SubtitleTrack.from_manifest(track) for track in self.subtitles]
+        return TVProgram.model_validate(
+            dataclasses.asdict(self) | {"subtitles": subtitles}
+        )
 
-    def download_as_episode(
+    def estimate_size(self, selector: VariantSelector | None = None) -> int:
+        """Estimate the size of the media file in bytes."""
+        return estimate_media_size(
+            self.program_id,
+            self.media_urls[0] if self.media_urls else None,
+            self.duration,
+            selector,
+        )
+
+    def program_filename(self, basedir: Path) -> Path:
+        """Get the filename, without suffix, as a standalone program."""
+        return program_filename(self.title, self.prod_year, basedir)
+
+    def episode_filename(
         self, series_title: str, sequence_string: str, basedir: Path
-    ) -> None:
-        """Download as an episode in a series."""
-        if not sequence_string:
-            filename = basedir / f"{series_title} - {self.title}"
-        else:
-            filename = basedir / f"{series_title} - {sequence_string} - {self.title}"
-        download_image_url(self.image_url, Path(f"{filename}.jpg"))
-        download_video(self, filename)
+    ) -> Path:
+        """Get the filename, without suffix, as an episode in a series."""
+        return episode_filename(self.title, series_title, sequence_string, basedir)
+
+
+def estimate_media_size(
+    program_id: str,
+    media_url: str | None,
+    duration: datetime.timedelta,
+    selector: VariantSelector | None = None,
+) -> int:
+    """Estimate the size of the media file of a program in bytes.
+
+    The estimate is the bandwidth of the variant that would be selected, times the
+    duration of the program.
+    """
+    variants = []
+    if media_url is not None:
+        try:
+            variants = get_variants(session, media_url)
+        except requests.RequestException as e:
+            logger.debug(f"Could not get the variants of {program_id}: {e}")
+    bandwidth = FALLBACK_BANDWIDTH
+    if variants:
+        bandwidth = (selector or VariantSelector()).select(variants).bandwidth
+    return int(bandwidth * duration.total_seconds() / 8)
+
+
+def program_filename(title: str, prod_year: int, basedir: Path) -> Path:
+    """Get the filename, without suffix, of a standalone program."""
+    return basedir / f"{title} ({prod_year})"
+
+
+def episode_filename(
+    title: str, series_title: str, sequence_string: str, basedir: Path
+) -> Path:
+    """Get the filename, without suffix, of an episode in a series."""
+    if not sequence_string:
+        return basedir / f"{series_title} - {title}"
+    return basedir / f"{series_title} - {sequence_string} - {title}"
 
 
 class TVSeriesType(str, Enum):
@@ -129,13 +358,19 @@ class SeasonInfo(BaseModel):
 
 
 class Season(BaseModel):
-    """Class for TV series seasons."""
+    """Class for TV series seasons.
+
+    Large seasons, e.g. of news series, list their episodes in pages. Only the first
+    page is fetched with the season, and the rest are fetched by iter_episodes().
+    """
 
     season_id: str
     title: str
     series_type: TVSeriesType
     poster_url: HttpUrl | None
-    episodes: list[str]
+    # Program IDs in the first page of episodes, and the path to the next page
+    first_page: list[str]
+    next_page: str | None = None
 
     @property
     def dirname(self) -> Path:
@@ -146,38 +381,89 @@ class Season(BaseModel):
             return Path(f"Season {int(self.season_id):02d}")
         return Path(f"Season {self.season_id}")
 
+    @functools.cached_property
+    def episodes(self) -> list[str]:
+        """Get the program IDs of all episodes, fetching all pages at once."""
+        return list(self.iter_episodes())
+
     @classmethod
     def from_ids(cls, series_id: str, season_id: str) -> Season:
         """Create a Season object from a series ID and season ID."""
         if season_id == "ekstramateriale":
-            r = session.get(PS_API + f"/tv/catalog/series/{series_id}/extramaterial")
+            data = psapi_get(f"/tv/catalog/series/{series_id}/extramaterial")
         else:
-            r = session.get(
-                PS_API + f"/tv/catalog/series/{series_id}/seasons/{season_id}"
-            )
-        r.raise_for_status()
-        data = r.json()
-
-        episodes_name = "episodes"
-        if data["seriesType"] in ("news", "standard"):
-            episodes_name = "instalments"
+            data = psapi_get(f"/tv/catalog/series/{series_id}/seasons/{season_id}")
 
+        series_type = TVSeriesType(data["seriesType"])
+        # The links of the season itself do not page through the episodes
+        first_page, next_page = episode_page(
+            {"_embedded": data["_embedded"]}, episodes_name(series_type)
+        )
         return cls(
             season_id=season_id,
             title=data["titles"]["title"],
-            series_type=data["seriesType"],
+            series_type=series_type,
             poster_url=get_image_url(data, "posterImage"),
-            episodes=[episode["prfId"] for episode in data["_embedded"][episodes_name]],
+            first_page=first_page,
+            next_page=next_page,
         )
 
+    def iter_pages(self) -> Iterator[list[str]]:
+        """Iterate over the pages of episodes, as lists of program IDs.
+
+        The next page is fetched in the background while a page is being used.
+        """
+        yield self.first_page
+        if self.next_page is None:
+            return
+        name = episodes_name(self.series_type)
+        with concurrent.futures.ThreadPoolExecutor(1) as executor:
+            future: concurrent.futures.Future[Any] | None = executor.submit(
+                psapi_get, self.next_page
+            )
+            while future is not None:
+                episodes, next_page = episode_page(future.result(), name)
+                future = executor.submit(psapi_get, next_page) if next_page else None
+                yield episodes
+
+    def iter_episodes(self) -> Iterator[str]:
+        """Iterate over the program IDs of the episodes, fetching pages as needed."""
+        for page in self.iter_pages():
+            yield from page
+
     def download_images(self, basedir: Path) -> None:
-        """Download images for the season."""
+        """Start downloading images for the season in the background."""
         directory = basedir / self.dirname
         download_image_url(
             self.poster_url, directory / f"Season{self.season_id:>02s}.jpg"
         )
 
 
+def episodes_name(series_type: TVSeriesType) -> str:
+    """Get the name of the list of episodes in the API, for a type of series."""
+    if series_type in (TVSeriesType.news, TVSeriesType.standard):
+        return "instalments"
+    return "episodes"
+
+
+def episode_page(page: dict[str, Any], name: str) -> tuple[list[str], str | None]:
+    """Get the program IDs in a page of episodes, and the path to the next page."""
+    episodes = page.get("_embedded", {}).get(name, [])
+    if isinstance(episodes, dict):
+        # An embedded page, with its own links
+        return episode_page(episodes, name)
+    href = page.get("_links", {}).get("next", {}).get("href")
+    return [episode["prfId"] for episode in episodes], api_path(href)
+
+
+def api_path(href: str | None) -> str | None:
+    """Get the path in the API of a link, which may be a full URL."""
+    if not href:
+        return None
+    url = urllib.parse.urlsplit(href)
+    return url.path + (f"?{url.query}" if url.query else "")
+
+
 class TVSeries(BaseModel):
     """Class for TV series."""
 
@@ -207,9 +493,7 @@ class TVSeries(BaseModel):
     @classmethod
     def from_series_id(cls, series_id: str, with_extras: bool = False) -> TVSeries:
         """Create a TVSeries object from a series ID."""
-        r = session.get(PS_API + f"/tv/catalog/series/{series_id}")
-        r.raise_for_status()
-        data = r.json()
+        data = psapi_get(f"/tv/catalog/series/{series_id}")
 
         # Possibly add an "Ekstramateriale" season
         extramaterial = None
@@ -233,55 +517,222 @@ class TVSeries(BaseModel):
         )
 
     def download_images(self, basedir: Path) -> None:
-        """Download images for the series."""
+        """Start downloading images for the series in the background."""
         directory = basedir / self.dirname
         download_image_url(self.poster_url, directory / "poster.jpg")
         download_image_url(self.backdrop_url, directory / "backdrop.jpg")
         download_image_url(self.image_url, directory / "banner.jpg")
 
 
-def download_video(program: TVProgram, filename: Path) -> None:
-    """Download subtitles and video files for a program."""
-    filename.parent.mkdir(parents=True, exist_ok=True)
+def download_video(
+    program: TVProgram,
+    filename: Path,
+    progress: rich.progress.Progress | None = None,
+    options: DownloadOptions | None = None,
+) -> Path:
+    """Download subtitles and video files for a program.
 
-    # TODO: Handle programs with multiple subtitle URLs
-    subtitle_filename = Path(f"{filename}.no.srt")
-    if program.subtitle_urls and not subtitle_filename.exists():
-        logger.info("Downloading subtitles")
+    The files are first written to temporary part-files, which are renamed when the
+    download is complete. If a shared progress display is given, the progress bar
+    for this program is removed from it when the download is finished. The program
+    is locked while it is downloaded, so that other processes do not download it at
+    the same time.
 
-        ffmpeg = (
-            FFmpeg()
-            .input(program.subtitle_urls[0].unicode_string())
-            .output(str(subtitle_filename))
-        )
+    Raises:
+        ProgramLockedError: If another process is downloading the program, and the
+            policy is to skip it.
 
-        ffmpeg.execute()
-        logger.success("Downloaded subtitles")
+    Returns:
+        Path: The filename of the downloaded media file.
+    """
+    options = options or DownloadOptions()
+    filename.parent.mkdir(parents=True, exist_ok=True)
 
     # TODO: Handle programs with multiple media URLs
-    media_filename = Path(f"{filename}.m4v")
-    if media_filename.exists():
-        logger.info(f"Media file {media_filename} already downloaded")
+    media_filename = media_filename_for(filename)
+    with locks.hold(media_filename):
+        tracks = select_subtitles(program.subtitles, options.subtitles)
+        subtitles = [
+            (track, subtitle_filename)
+            for track, subtitle_filename in zip(
+                tracks, subtitle_filenames(filename, tracks), strict=True
+            )
+            if not subtitle_filename.exists()
+        ]
+
+        if media_filename.exists():
+            logger.info(f"Media file {media_filename} already downloaded")
+            metrics.inc("skipped_total", reason="exists")
+            download_subtitles(subtitles)
+            return media_filename
+
+        if progress is None:
+            with rich.progress.Progress() as rich_progress:
+                download_media(
+                    program, media_filename, rich_progress, options, subtitles
+                )
+        else:
+            task = download_media(program, media_filename, progress, options, subtitles)
+            progress.remove_task(task)
+    return media_filename
+
+
+def media_filename_for(filename: Path) -> Path:
+    """Get the media filename for a program filename without suffix."""
+    return Path(f"{filename}.m4v")
+
+
+def download_media(
+    program: TVProgram,
+    media_filename: Path,
+    rich_progress: rich.progress.Progress,
+    options: DownloadOptions,
+    subtitles: list[tuple[SubtitleTrack, Path]] | None = None,
+) -> rich.progress.TaskID:
+    """Download the media files for a program, showing a progress bar."""
+    logger.info("Downloading media files")
+    task = rich_progress.add_task(
+        f"[red]{program.title[:15]}", total=program.duration.total_seconds()
+    )
+
+    def on_progress(seconds: float) -> None:
+        rich_progress.update(task, completed=seconds)
+
+    part_filename = Path(f"{media_filename}.part")
+    url = program.media_urls[0].unicode_string()
+    # The tracks of the selected variant, or video and audio if the playlist does not
+    # list its codecs
+    tracks = expected_tracks(session, url, options.variant) or ("video", "audio")
+    start = time.perf_counter()
+    fetch_media(url, part_filename, options, on_progress, subtitles)
+
+    # The file is only given its final name when it is complete
+    verify_media(part_filename, program.duration, tracks)
+    part_filename.replace(media_filename)
+    metrics.record_program(
+        program.program_id,
+        media_filename.stat().st_size,
+        time.perf_counter() - start,
+    )
+    # Make sure the progress bar is at 100%
+    rich_progress.update(task, completed=program.duration.total_seconds())
+
+    logger.success("Downloaded media files")
+    return task
+
+
+def fetch_media(
+    url: str,
+    filename: Path,
+    options: DownloadOptions,
+    on_progress: Callable[[float], None],
+    subtitles: list[tuple[SubtitleTrack, Path]] | None = None,
+) -> None:
+    """Fetch a media stream to an MP4 file, with the engine given in the options.
+
+    FFmpeg can not be bandwidth limited, so the native engine is used when a
+    bandwidth limit is set. When FFmpeg downloads the media, the subtitle files are
+    written by the same FFmpeg process. The download pauses while the disk is low
+    on space.
+    """
+    subtitles = subtitles or []
+
+    def on_segment(seconds: float) -> None:
+        # Pause rather than fill the volume, until other jobs have freed up space
+        disk.wait_for_space(filename.parent)
+        on_progress(seconds)
+
+    native = options.engine == Engine.native or limiter.enabled
+    if native and not options.resume:
+        download_subtitles(subtitles)
+        subtitles = []
+        try:
+            download_hls(
+                session,
+                url,
+                filename,
+                options.connections,
+                on_segment,
+                options.variant,
+            )
+        except UnsupportedStreamError as e:
+            logger.warning(f"{e}, using FFmpeg to download the media instead")
+        else:
+            return
+
+    if limiter.enabled:
+        logger.warning("Media downloaded by FFmpeg is not bandwidth limited")
+    streams = select_streams(session, url, options.variant, options.all_audio)
+
+    if options.resume:
+        download_subtitles(subtitles)
+        if streams.audio:
+            logger.warning("Can not resume with separate audio, FFmpeg selects variant")
+            streams = StreamSelection(url=url)
+        part_dir = filename.with_suffix(".parts")
+        download_resumable(streams.url, part_dir, filename, on_segment)
         return
 
-    with rich.progress.Progress() as rich_progress:
-        logger.info("Downloading media files")
-        task1 = rich_progress.add_task(
-            f"[red]{program.title[:15]}", total=program.duration.total_seconds()
-        )
+    ffmpeg = media_command(streams, filename)
+    add_subtitle_outputs(ffmpeg, subtitles, first_input=1 + len(streams.audio))
+
+    @ffmpeg.on("progress")
+    def progress(ffmpeg_progress: Progress) -> None:
+        on_segment(ffmpeg_progress.time.total_seconds())
 
-        ffmpeg = (
-            FFmpeg()
-            .input(program.media_urls[0].unicode_string())
-            .output(str(media_filename), vcodec="copy", acodec="copy")
+    with metrics.timer("ffmpeg_seconds", kind="media"):
+        ffmpeg.execute()
+    finish_subtitles(subtitles)
+
+
+def media_command(streams: StreamSelection, filename: Path) -> FFmpeg:
+    """Create an FFmpeg command that copies the selected streams to an MP4 file."""
+    ffmpeg = FFmpeg().option("y").input(streams.url)
+    output_options: dict[str, Any] = {}
+    if streams.audio:
+        maps = ["0:v:0"]
+        for number, rendition in enumerate(streams.audio):
+            ffmpeg.input(rendition.url)
+            maps.append(f"{number + 1}:a:0")
+            if rendition.language:
+                output_options[f"metadata:s:a:{number}"] = (
+                    f"language={rendition.language}"
+                )
+        output_options["map"] = maps
+    else:
+        # Otherwise FFmpeg also adds any subtitle inputs to the MP4 file
+        output_options["sn"] = None
+    return ffmpeg.output(
+        str(filename), output_options, vcodec="copy", acodec="copy", f="mp4"
+    )
+
+
+def add_subtitle_outputs(
+    ffmpeg: FFmpeg, subtitles: list[tuple[SubtitleTrack, Path]], first_input: int
+) -> None:
+    """Add the subtitle tracks as inputs, each written to a part-file as SRT."""
+    for number, (track, subtitle_filename) in enumerate(subtitles, first_input):
+        ffmpeg.input(track.url.unicode_string())
+        ffmpeg.output(
+            str(Path(f"{subtitle_filename}.part")), map=f"{number}:0", f="srt"
         )
 
-        @ffmpeg.on("progress")
-        def on_progress(ffmpeg_progress: Progress) -> None:
-            rich_progress.update(task1, completed=ffmpeg_progress.time.total_seconds())
 
-        ffmpeg.execute()
-        # Make sure the progress bar is at 100%
-        rich_progress.update(task1, completed=program.duration.total_seconds())
+def finish_subtitles(subtitles: list[tuple[SubtitleTrack, Path]]) -> None:
+    """Give the subtitle files their final names."""
+    for _, subtitle_filename in subtitles:
+        Path(f"{subtitle_filename}.part").replace(subtitle_filename)
+    if subtitles:
+        logger.success(f"Downloaded {len(subtitles)} subtitle tracks")
 
-    logger.success("Downloaded media files")
+
+def download_subtitles(subtitles: list[tuple[SubtitleTrack, Path]]) -> None:
+    """Download subtitle tracks to SRT files, all in one FFmpeg process."""
+    if not subtitles:
+        return
+    logger.info("Downloading subtitles")
+    ffmpeg = FFmpeg().option("y")
+    add_subtitle_outputs(ffmpeg, subtitles, first_input=0)
+    with metrics.timer("ffmpeg_seconds", kind="subtitles"):
+        ffmpeg.execute()
+    finish_subtitles(subtitles)
@@ -0,0 +1,403 @@
+"""Functions for planning downloads before they are started.
+
+All the metadata for a series (seasons and programs) is fetched concurrently, and
+collected in a DownloadPlan. The downloads are started when the plan is complete.
+
+When syncing with a state index, the episodes of a series are instead added to the
+persistent download queue in the index, and resolved as they are downloaded. An
+interrupted run then continues where it left off when it is started again. Large
+seasons are queued one page of episodes at a time, so the downloads can start before
+all pages are fetched.
+"""
+
+from __future__ import annotations
+
+import concurrent.futures
+import dataclasses
+import hashlib
+from collections.abc import Callable, Iterable, Iterator
+from pathlib import Path
+
+import rich.progress
+import typer
+from loguru import logger
+from pydantic import BaseModel
+
+from nrkdownload.hls import VariantSelector
+from nrkdownload.metrics import metrics
+from nrkdownload.nrk_tv import (
+    DownloadOptions,
+    NotPlayableError,
+    ProgramRecord,
+    Season,
+    TVProgram,
+    TVSeries,
+    TVSeriesType,
+    media_filename_for,
+    valid_filename,
+)
+from nrkdownload.state import QueueItem, StateIndex
+
+# Number of concurrent requests to the API while planning
+METADATA_WORKERS = 8
+
+
+class Shard(BaseModel):
+    """One of several machines that share the downloads of the same requests.
+
+    Programs are assigned to shards by a hash of their ID, so every machine that is
+    given the same requests agrees on the assignment without coordination. The
+    artwork of a series and its seasons is assigned by the series ID.
+
+    Example:
+    >>> shard = Shard(index=1, count=3)
+    >>> shard.contains("NNFA19010122")
+    """
+
+    # Numbered from 1
+    index: int
+    count: int
+
+    def __str__(self) -> str:
+        """Get the shard as K/N."""
+        return f"{self.index}/{self.count}"
+
+    def assign(self, key: str) -> int:
+        """Get the number of the shard that a program or series ID is assigned to."""
+        digest = hashlib.sha256(key.encode()).digest()
+        return int.from_bytes(digest[:8], "big") % self.count + 1
+
+    def contains(self, key: str) -> bool:
+        """Check if a program or series ID is assigned to this shard."""
+        return self.assign(key) == self.index
+
+
+def in_shard(shard: Shard | None, key: str) -> bool:
+    """Check if an ID is assigned to a shard, which is always true without shards."""
+    return shard is None or shard.contains(key)
+
+
+class ProgramRequest(BaseModel):
+    """A request to download a standalone program."""
+
+    url: str
+    program_id: str
+
+
+class SeriesRequest(BaseModel):
+    """A request to download a series, or a season or episode of it."""
+
+    url: str
+    series_id: str
+    season_id: str | None = None
+    episode_id: str | None = None
+
+
+def deduplicate(
+    requests: Iterable[ProgramRequest | SeriesRequest],
+) -> list[ProgramRequest | SeriesRequest]:
+    """Remove requests that are already covered by other requests.
+
+    A request for a whole series covers all requests for seasons and episodes of the
+    series (except extra material), and a request for a season covers requests for
+    episodes in that season. The order of the remaining requests is preserved.
+    """
+    requests = list(requests)
+    whole_series = set()
+    whole_seasons = set()
+    for request in requests:
+        if isinstance(request, SeriesRequest) and request.episode_id is None:
+            if request.season_id is None:
+                whole_series.add(request.series_id)
+            else:
+                whole_seasons.add((request.series_id, request.season_id))
+
+    unique = []
+    seen = set()
+    for request in requests:
+        if isinstance(request, ProgramRequest):
+            key: tuple[str | None, ...] = (request.program_id,)
+        else:
+            key = (request.series_id, request.season_id, request.episode_id)
+            if (
+                request.series_id in whole_series
+                and request.season_id not in (None, "ekstramateriale")
+            ) or (
+                request.episode_id is not None
+                and (request.series_id, request.season_id) in whole_seasons
+            ):
+                logger.debug(f"Skipping {request.url}, covered by another URL")
+                continue
+        if key not in seen:
+            seen.add(key)
+            unique.append(request)
+    return unique
+
+
+@dataclasses.dataclass(slots=True)
+class ProgramJob:
+    """A program that is resolved and ready to be downloaded.
+
+    Jobs are plain records, since a plan may hold tens of thousands of them. The
+    program is validated when it is downloaded.
+    """
+
+    program: TVProgram | ProgramRecord
+    directory: Path
+    series_id: str | None = None
+    season_id: str | None = None
+    series_title: str | None = None
+    sequence_string: str = ""
+    # Bytes, set when the plan is checked for free space
+    estimated_size: int | None = None
+
+    @classmethod
+    def from_item(
+        cls, item: QueueItem, program: TVProgram | ProgramRecord
+    ) -> ProgramJob:
+        """Create a job for a program in the download queue."""
+        return cls(
+            program=program,
+            directory=item.directory,
+            series_id=item.series_id,
+            season_id=item.season_id,
+            series_title=item.series_title,
+            sequence_string=item.sequence_string,
+        )
+
+    @property
+    def media_filename(self) -> Path:
+        """Get the filename of the media file."""
+        if self.series_title is None:
+            filename = self.program.program_filename(self.directory)
+        else:
+            filename = self.program.episode_filename(
+                self.series_title, self.sequence_string, self.directory
+            )
+        return media_filename_for(filename)
+
+    def estimate_size(self, selector: VariantSelector | None = None) -> int:
+        """Estimate the bytes still to download, which is 0 if the media exists."""
+        if self.estimated_size is None:
+            if self.media_filename.exists():
+                self.estimated_size = 0
+            else:
+                self.estimated_size = self.program.estimate_size(selector)
+        return self.estimated_size
+
+    def download(
+        self,
+        progress: rich.progress.Progress | None = None,
+        options: DownloadOptions | None = None,
+    ) -> Path:
+        """Download the program, either as an episode or as a standalone program.
+
+        A program that was resolved when the plan was made is resolved again if its
+        manifest may have expired while it waited for its turn.
+
+        Returns:
+            Path: The filename of the downloaded media file.
+
+        Raises:
+            NotPlayableError: If the program is no longer playable.
+        """
+        program = self.program
+        if isinstance(program, ProgramRecord):
+            program = program.refresh().to_program()
+        if self.series_title is None:
+            return program.download_as_program(self.directory, progress, options)
+        return program.download_as_episode(
+            self.series_title, self.sequence_string, self.directory, progress, options
+        )
+
+
+@dataclasses.dataclass(slots=True)
+class DownloadPlan:
+    """Everything that is needed to download a series or a program."""
+
+    download_dir: Path
+    series: TVSeries | None = None
+    seasons: list[Season] = dataclasses.field(default_factory=list)
+    jobs: list[ProgramJob] = dataclasses.field(default_factory=list)
+    # IDs of programs in the download queue of the state index, resolved when
+    # downloaded
+    queued: list[str] = dataclasses.field(default_factory=list)
+    # Whether to download the series and season images, which only one shard does
+    images: bool = True
+
+
+def estimate_size(jobs: list[ProgramJob], selector: VariantSelector | None) -> int:
+    """Estimate the total bytes to download for some jobs, concurrently."""
+    with concurrent.futures.ThreadPoolExecutor(METADATA_WORKERS) as executor:
+        return sum(executor.map(lambda job: job.estimate_size(selector), jobs))
+
+
+def resolve_program(program_id: str) -> ProgramRecord | None:
+    """Get the metadata of a program, or None if the program is not playable."""
+    try:
+        return ProgramRecord.from_program_id(program_id)
+    except NotPlayableError as e:
+        typer.echo(f"Skipping: {e}")
+        metrics.inc("skipped_total", reason="not_playable")
+        return None
+
+
+def plan_series(
+    download_dir: Path,
+    series_id: str,
+    with_extras: bool,
+    only_season_id: str | None = None,
+    only_episode_id: str | None = None,
+    state: StateIndex | None = None,
+    on_queued: Callable[[list[QueueItem]], None] | None = None,
+    shard: Shard | None = None,
+) -> DownloadPlan:
+    """Fetch the metadata for all seasons and episodes of a series.
+
+    Args:
+        download_dir (Path): Base directory for the downloads.
+        series_id (str): The series ID.
+        with_extras (bool): Whether to include extra material.
+        only_season_id (str, optional): Only include this season. Defaults to None.
+        only_episode_id (str, optional): Only include this episode. Defaults to None.
+        state (StateIndex, optional): If given, episodes that are already
+            downloaded are left out of the plan, and the rest are added to the
+            download queue in the index instead of being resolved. Defaults to None.
+        on_queued (Callable, optional): Called with each page of episodes that is
+            added to the download queue, while the rest are fetched. Defaults to
+            None.
+        shard (Shard, optional): Only include the episodes assigned to this shard.
+            Defaults to None.
+
+    Returns:
+        DownloadPlan: The plan, with all playable episodes resolved or queued.
+    """
+    if only_season_id == "ekstramateriale":
+        with_extras = True
+    series = TVSeries.from_series_id(series_id, with_extras)
+
+    season_ids = [
+        season_info.season_id
+        for season_info in series.season_infos
+        if (only_season_id is None) or (season_info.season_id == only_season_id)
+    ]
+
+    with concurrent.futures.ThreadPoolExecutor(METADATA_WORKERS) as executor:
+        seasons = list(executor.map(series.get_season, season_ids))
+        # If we're asked to only download one episode, skip the others
+        pages = (
+            [
+                item
+                for item in page
+                if (only_episode_id is None or item.program_id == only_episode_id)
+                and in_shard(shard, item.program_id)
+            ]
+            for season in seasons
+            for page in episode_pages(download_dir, series, season)
+        )
+
+        if state is not None:
+            state.record_series(series, seasons)
+            queued: list[str] = []
+            for page in pages:
+                items = queue_new_episodes(state, page)
+                queued.extend(item.program_id for item in items)
+                if on_queued is not None and items:
+                    on_queued(items)
+            logger.info(f"Queued {len(queued)} episodes of {series.title}")
+            return DownloadPlan(
+                download_dir=download_dir,
+                series=series,
+                seasons=seasons,
+                queued=queued,
+                images=in_shard(shard, series_id),
+            )
+
+        # Collect the episodes first, so that all programs can be resolved at once
+        items = [item for page in pages for item in page]
+        logger.info(f"Found {len(items)} episodes of {series.title}")
+        programs = executor.map(resolve_program, [item.program_id for item in items])
+        jobs = [
+            ProgramJob.from_item(item, program)
+            for program, item in zip(programs, items, strict=True)
+            if program is not None
+        ]
+
+    return DownloadPlan(
+        download_dir=download_dir,
+        series=series,
+        seasons=seasons,
+        jobs=jobs,
+        images=in_shard(shard, series_id),
+    )
+
+
+def queue_new_episodes(state: StateIndex, items: list[QueueItem]) -> list[QueueItem]:
+    """Add the episodes that are not downloaded to the download queue.
+
+    Returns:
+        list[QueueItem]: The episodes that were queued.
+    """
+    completed = state.completed_programs([item.program_id for item in items])
+    if completed:
+        logger.debug(f"Skipping {len(completed)} episodes already downloaded")
+        metrics.inc("skipped_total", len(completed), reason="downloaded")
+    items = [item for item in items if item.program_id not in completed]
+    # Programs that failed or were deleted in an earlier run get a new chance
+    state.enqueue(items, reset=True)
+    return items
+
+
+def episode_pages(
+    download_dir: Path, series: TVSeries, season: Season
+) -> Iterator[list[QueueItem]]:
+    """Iterate over the pages of episodes of a season, with where to download them."""
+    directory = download_dir / series.dirname / season.dirname
+    series_title = valid_filename(series.title)
+    episode_number = 0
+    for page in season.iter_pages():
+        items = []
+        for program_id in page:
+            episode_number += 1
+            items.append(
+                QueueItem(
+                    program_id=program_id,
+                    directory=directory,
+                    series_id=series.series_id,
+                    season_id=season.season_id,
+                    series_title=series_title,
+                    sequence_string=sequence_string(series, season, episode_number),
+                )
+            )
+        yield items
+
+
+def plan_program(
+    download_dir: Path,
+    program_id: str,
+    state: StateIndex | None = None,
+    shard: Shard | None = None,
+) -> DownloadPlan:
+    """Fetch the metadata for a standalone program, if it is assigned to the shard."""
+    jobs: list[ProgramJob] = []
+    if not in_shard(shard, program_id):
+        logger.debug(f"Program {program_id} is assigned to another shard")
+        return DownloadPlan(download_dir=download_dir, jobs=jobs)
+    if state is not None and state.completed_programs([program_id]):
+        logger.info(f"Program {program_id} is already downloaded")
+        metrics.inc("skipped_total", reason="downloaded")
+        return DownloadPlan(download_dir=download_dir, jobs=jobs)
+
+    program = resolve_program(program_id)
+    if program is not None:
+        jobs.append(ProgramJob(program=program, directory=download_dir / program.title))
+    return DownloadPlan(download_dir=download_dir, jobs=jobs)
+
+
+def sequence_string(series: TVSeries, season: Season, episode_number: int) -> str:
+    """Get the string identifying an episode within a series, e.g. "s01e02"."""
+    if series.type == TVSeriesType.sequential:
+        if season.season_id == "ekstramateriale":
+            return ""
+        return f"s{season.season_id:>02s}e{episode_number:>02d}"
+    return season.season_id
@@ -0,0 +1,93 @@
+"""Process-wide bandwidth limiting, shared by all concurrent transfers."""
+
+from __future__ import annotations
+
+import datetime as dt
+import threading
+import time
+
+from pydantic import BaseModel
+
+# Transfers should consume bandwidth in chunks of about this size
+CHUNK_SIZE = 64 * 1024
+
+
+class BandwidthWindow(BaseModel):
+    """A time-of-day window with its own bandwidth limit.
+
+    The window may wrap around midnight, e.g. 23:00-07:00. A window that starts and
+    ends at the same time covers the whole day.
+    """
+
+    start: dt.time
+    end: dt.time
+    # Bytes per second, or None for unlimited
+    rate: int | None
+
+    def contains(self, time_of_day: dt.time) -> bool:
+        """Check whether a time of day is within the window."""
+        if self.start == self.end:
+            return True
+        if self.start < self.end:
+            return self.start <= time_of_day < self.end
+        return time_of_day >= self.start or time_of_day < self.end
+
+
+class RateLimiter:
+    """Token bucket rate limiter, with time-of-day bandwidth windows.
+
+    Bandwidth is handed out in the order it is requested, so concurrent transfers
+    that consume small chunks get a fair share each.
+    """
+
+    def __init__(
+        self,
+        rate: int | None = None,
+        windows: list[BandwidthWindow] | None = None,
+        burst_seconds: float = 1.0,
+    ) -> None:
+        """Create a limiter. Without any rate or windows, nothing is limited."""
+        self._lock = threading.Lock()
+        self._next_free = 0.0
+        self.burst_seconds = burst_seconds
+        self.configure(rate, windows)
+
+    def configure(
+        self, rate: int | None, windows: list[BandwidthWindow] | None = None
+    ) -> None:
+        """Set the default rate in bytes per second, and the time-of-day windows."""
+        self.rate = rate
+        self.windows = windows or []
+
+    @property
+    def enabled(self) -> bool:
+        """Whether any limit is configured."""
+        return self.rate is not None or any(
+            window.rate is not None for window in self.windows
+        )
+
+    def current_rate(self) -> int | None:
+        """Get the rate that applies now, in bytes per second."""
+        time_of_day = dt.datetime.now().time()  # noqa: DTZ005
+        for window in self.windows:
+            if window.contains(time_of_day):
+                return window.rate
+        return self.rate
+
+    def consume(self, nbytes: int) -> None:
+        """Wait until nbytes may be transferred."""
+        rate = self.current_rate()
+        if not rate:
+            return
+        with self._lock:
+            now = time.monotonic()
+            # An idle limiter allows a burst of up to burst_seconds of data
+            start = max(self._next_free, now - self.burst_seconds)
+            self._next_free = start + nbytes / rate
+            delay = self._next_free - now
+        if delay > 0:
+            time.sleep(delay)
+
+
+# Shared by all transfers in the process
+limiter = RateLimiter()
@@ -0,0 +1,115 @@
+"""Resumable downloads of HLS streams.
+
+The stream is downloaded by FFmpeg into a directory of short MPEG-TS segments. The
+segment muxer lists each segment in a CSV file when it is complete, so an interrupted
+download can continue after the last completed segment. When the whole stream is
+downloaded, the segments are concatenated into the final file.
+"""
+
+from __future__ import annotations
+
+import csv
+import shutil
+from collections.abc import Callable
+from pathlib import Path
+
+from ffmpeg import FFmpeg, Progress
+from loguru import logger
+from pydantic import BaseModel
+
+SEGMENT_SECONDS = 60
+
+
+class Segment(BaseModel):
+    """A completed segment, with start and end time in the original stream."""
+
+    filename: Path
+    start: float
+    end: float
+
+
+def segment_list_name(offset: float) -> str:
+    """Get the name of the segment list for a download started at offset seconds."""
+    return f"segments@{offset:.3f}.csv"
+
+
+def completed_segments(part_dir: Path) -> list[Segment]:
+    """Get the completed segments in a directory, and remove incomplete ones."""
+    segments = []
+    for segment_list in part_dir.glob("segments@*.csv"):
+        offset = float(segment_list.stem.removeprefix("segments@"))
+        with segment_list.open(newline="") as file:
+            for name, start, end in csv.reader(file):
+                segments.append(
+                    Segment(
+                        filename=part_dir / name,
+                        start=offset + float(start),
+                        end=offset + float(end),
+                    )
+                )
+    segments.sort(key=lambda segment: segment.start)
+
+    completed = {segment.filename for segment in segments}
+    for filename in part_dir.glob("*.ts"):
+        if filename not in completed:
+            logger.debug(f"Removing incomplete segment {filename}")
+            filename.unlink()
+    return segments
+
+
+def download_resumable(
+    url: str,
+    part_dir: Path,
+    output: Path,
+    on_progress: Callable[[float], None] | None = None,
+) -> None:
+    """Download a stream to output, continuing a previous download if possible.
+
+    Args:
+        url (str): URL of the stream.
+        part_dir (Path): Directory for the segments. Removed when done.
+        output (Path): The finished MP4 file.
+        on_progress (Callable, optional): Called with the number of seconds
+            downloaded so far. Defaults to None.
+    """
+    part_dir.mkdir(parents=True, exist_ok=True)
+    segments = completed_segments(part_dir)
+    offset = segments[-1].end if segments else 0.0
+    if offset:
+        logger.info(f"Resuming download of {output.name} at {offset:.0f} seconds")
+
+    ffmpeg = FFmpeg().option("y")
+    if offset:
+        # Seek to the end of the last completed segment
+        ffmpeg.input(url, ss=offset)
+    else:
+        ffmpeg.input(url)
+    ffmpeg.output(
+        str(part_dir / "%05d.ts"),
+        c="copy",
+        f="segment",
+        segment_time=SEGMENT_SECONDS,
+        segment_list=str(part_dir / segment_list_name(offset)),
+        segment_list_type="csv",
+        segment_start_number=len(segments),
+    )
+
+    @ffmpeg.on("progress")
+    def progress(ffmpeg_progress: Progress) -> None:
+        if on_progress is not None:
+            on_progress(offset + ffmpeg_progress.time.total_seconds())
+
+    ffmpeg.execute()
+
+    # Join the segments into one file
+    concat_list = part_dir / "concat.txt"
+    concat_list.write_text(
+        "".join(
+            f"file '{segment.filename.name}'\n"
+            for segment in completed_segments(part_dir)
+        )
+    )
+    FFmpeg().option("y").input(str(concat_list), f="concat", safe=0).output(
+        str(output), c="copy", f="mp4"
+    ).execute()
+    shutil.rmtree(part_dir)
@@ -0,0 +1,371 @@
+"""Scheduling of several series and programs in one run.
+
+The downloads of all requests are drained by one pool of workers that is shared by
+all series. The episodes of different series are taken in turn, so that a large
+series does not hold back the smaller ones, and the pool is kept busy until the last
+download is finished. When syncing, episodes are downloaded from the queue in the
+index as soon as they are queued, while the rest of the requests are planned.
+"""
+
+from __future__ import annotations
+
+import concurrent.futures
+import json
+import threading
+import uuid
+from collections.abc import Callable, Iterable
+from pathlib import Path
+from typing import TypeVar
+
+import rich.progress
+import typer
+
+from nrkdownload.artwork import artwork
+from nrkdownload.diskspace import InsufficientSpaceError, disk
+from nrkdownload.download import DOWNLOAD_ERRORS, download_job, work_queue
+from nrkdownload.locks import ProgramLockedError
+from nrkdownload.metrics import metrics
+from nrkdownload.nrk_tv import DownloadOptions, NotPlayableError
+from nrkdownload.plan import (
+    DownloadPlan,
+    ProgramJob,
+    ProgramRequest,
+    SeriesRequest,
+    Shard,
+    estimate_size,
+    plan_program,
+    plan_series,
+)
+from nrkdownload.state import QueueItem, StateIndex
+
+T = TypeVar("T")
+
+# Number of requests that are planned concurrently
+PLAN_WORKERS = 4
+# Errors that fail the planning of one URL, without stopping the others. A KeyError
+# is raised when the API leaves out something that is expected.
+PLAN_ERRORS = (*DOWNLOAD_ERRORS, KeyError)
+
+
+def interleave(groups: Iterable[list[T]]) -> list[T]:
+    """Take one item from each group in turn, until all groups are empty.
+
+    Example:
+    >>> interleave([[1, 2, 3], [4], [5, 6]])
+    [1, 4, 5, 2, 6, 3]
+    """
+    iterators = [iter(group) for group in groups]
+    items = []
+    while iterators:
+        remaining = []
+        for iterator in iterators:
+            for item in iterator:
+                items.append(item)
+                remaining.append(iterator)
+                break
+        iterators = remaining
+    return items
+
+
+class QueueOrder:
+    """The order of the programs in the download queue, where the series take turns.
+
+    Programs are ranked by their position in their series, and then by the order in
+    which the series were queued. Programs can be added while the queue is worked on.
+    """
+
+    def __init__(self) -> None:
+        """Create an empty order."""
+        # The number of programs added for each series, in the order of the series
+        self._counts: dict[str, int] = {}
+        self._series_ranks: dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def add(self, items: list[QueueItem]) -> dict[str, tuple[int, int]]:
+        """Add queued programs, after the programs already added for their series.
+
+        Returns:
+            dict[str, tuple[int, int]]: The ranks of the added programs, which are
+                sorted in the order they should be downloaded.
+        """
+        ranks = {}
+        with self._lock:
+            for item in items:
+                key = item.series_id or item.program_id
+                series_rank = self._series_ranks.setdefault(
+                    key, len(self._series_ranks)
+                )
+                position = self._counts.get(key, 0)
+                ranks[item.program_id] = (position, series_rank)
+                self._counts[key] = position + 1
+        return ranks
+
+
+def plan_request(
+    request: ProgramRequest | SeriesRequest,
+    download_dir: Path,
+    with_extras: bool,
+    state: StateIndex | None,
+    on_queued: Callable[[list[QueueItem]], None] | None = None,
+    shard: Shard | None = None,
+) -> DownloadPlan:
+    """Plan the downloads of a request."""
+    if isinstance(request, ProgramRequest):
+        return plan_program(download_dir, request.program_id, state, shard)
+    return plan_series(
+        download_dir,
+        request.series_id,
+        with_extras,
+        request.season_id,
+        request.episode_id,
+        state,
+        on_queued,
+        shard,
+    )
+
+
+def plan_requests(
+    download_requests: list[ProgramRequest | SeriesRequest],
+    download_dir: Path,
+    with_extras: bool,
+    state: StateIndex | None,
+    on_queued: Callable[[list[QueueItem]], None] | None = None,
+    shard: Shard | None = None,
+) -> tuple[dict[str, DownloadPlan], set[str]]:
+    """Plan several requests concurrently.
+
+    A URL that can not be planned is reported, without stopping the others.
+
+    Returns:
+        tuple[dict[str, DownloadPlan], set[str]]: The plan for each URL that could
+            be planned, in the order of the requests, and the URLs that failed.
+    """
+    plans = {}
+    failed = set()
+    with concurrent.futures.ThreadPoolExecutor(PLAN_WORKERS) as executor:
+        futures = [
+            (
+                request.url,
+                executor.submit(
+                    plan_request,
+                    request,
+                    download_dir,
+                    with_extras,
+                    state,
+                    on_queued,
+                    shard,
+                ),
+            )
+            for request in download_requests
+        ]
+        for url, future in futures:
+            try:
+                plans[url] = future.result()
+            except PLAN_ERRORS as e:
+                typer.echo(f"Failed to download {url}: {e!r}")
+                failed.add(url)
+    return plans, failed
+
+
+def download_images(plans: Iterable[DownloadPlan]) -> None:
+    """Start the downloads of the series and season images, in the background."""
+    for plan in plans:
+        if plan.series is not None:
+            typer.echo(f"Downloading {plan.series.title}")
+            if not plan.images:
+                continue
+            plan.series.download_images(plan.download_dir)
+            for season in plan.seasons:
+                season.download_images(plan.download_dir / plan.series.dirname)
+
+
+def interleave_jobs(plans: dict[str, DownloadPlan]) -> list[tuple[str, ProgramJob]]:
+    """Order the resolved programs of all plans, so that the series take turns.
+
+    Returns:
+        list[tuple[str, ProgramJob]]: The programs, with the URL they were requested
+            by.
+    """
+    groups: dict[str, list[tuple[str, ProgramJob]]] = {}
+    for url, plan in plans.items():
+        for job in plan.jobs:
+            key = job.series_id or job.program.program_id
+            groups.setdefault(key, []).append((url, job))
+    return interleave(groups.values())
+
+
+def export_plans(
+    plans: dict[str, DownloadPlan],
+    filename: Path,
+    shard: Shard | None = None,
+    state: StateIndex | None = None,
+) -> int:
+    """Write the programs and artwork of all plans to a JSON file.
+
+    Programs that are already downloaded according to the index are left out.
+
+    Returns:
+        int: The number of programs in the file.
+    """
+    jobs = interleave_jobs(plans)
+    if state is not None:
+        completed = state.completed_programs(
+            [job.program.program_id for _, job in jobs]
+        )
+        jobs = [
+            (url, job) for url, job in jobs if job.program.program_id not in completed
+        ]
+    exported = {
+        "shard": None if shard is None else str(shard),
+        "programs": [
+            {
+                "url": url,
+                "program_id": job.program.program_id,
+                "title": job.program.title,
+                "series_id": job.series_id,
+                "season_id": job.season_id,
+                "duration": job.program.duration.total_seconds(),
+                "filename": str(job.media_filename),
+            }
+            for url, job in jobs
+        ],
+        "artwork": [
+            {
+                "series_id": plan.series.series_id,
+                "directory": str(plan.download_dir / plan.series.dirname),
+            }
+            for plan in plans.values()
+            if plan.series is not None and plan.images
+        ],
+    }
+    filename.write_text(json.dumps(exported, indent=2))
+    return len(jobs)
+
+
+def try_download_job(
+    job: ProgramJob,
+    progress: rich.progress.Progress,
+    state: StateIndex | None,
+    options: DownloadOptions | None,
+) -> bool:
+    """Download a program, and report whether it succeeded.
+
+    A failed download is reported without stopping the downloads of other programs.
+    A program that another process is downloading, or that is no longer playable, is
+    skipped, which is not a failure.
+    """
+    try:
+        download_job(job, progress, state, options)
+    except ProgramLockedError as e:
+        typer.echo(f"Skipping: {e}")
+        metrics.inc("skipped_total", reason="locked")
+    except NotPlayableError as e:
+        typer.echo(f"Skipping: {e}")
+        metrics.inc("skipped_total", reason="not_playable")
+    except DOWNLOAD_ERRORS as e:
+        typer.echo(f"Failed to download {job.program.title}: {e}")
+        metrics.inc("failed_total")
+        return False
+    return True
+
+
+def download_jobs(
+    plans: dict[str, DownloadPlan],
+    download_dir: Path,
+    executor: concurrent.futures.Executor,
+    progress: rich.progress.Progress,
+    state: StateIndex | None,
+    options: DownloadOptions | None,
+) -> set[str]:
+    """Download the resolved programs of all plans, and return the URLs that failed.
+
+    Raises:
+        InsufficientSpaceError: If the programs do not fit in the free space, and
+            the policy is to refuse.
+    """
+    selector = options.variant if options else None
+    all_jobs = [job for plan in plans.values() for job in plan.jobs]
+    disk.check(download_dir, estimate_size(all_jobs, selector))
+    futures = [
+        (url, executor.submit(try_download_job, job, progress, state, options))
+        for url, job in interleave_jobs(plans)
+    ]
+    return {url for url, future in futures if not future.result()}
+
+
+def download_requests(
+    download_requests: list[ProgramRequest | SeriesRequest],
+    download_dir: Path,
+    with_extras: bool = False,
+    jobs: int = 1,
+    state: StateIndex | None = None,
+    options: DownloadOptions | None = None,
+    shard: Shard | None = None,
+) -> int:
+    """Download several series and programs with one shared pool of workers.
+
+    Args:
+        download_requests (list[ProgramRequest | SeriesRequest]): The requests,
+            without duplicates.
+        download_dir (Path): Base directory for the downloads.
+        with_extras (bool, optional): Whether to include extra material for series.
+            Defaults to False.
+        jobs (int, optional): Number of programs to download concurrently, across
+            all requests. Defaults to 1.
+        state (StateIndex, optional): If given, only new episodes are downloaded,
+            through the download queue in the index. Defaults to None.
+        options (DownloadOptions, optional): Options for how the programs are
+            downloaded. Defaults to None.
+        shard (Shard, optional): Only download the programs, and the artwork,
+            assigned to this shard. Defaults to None.
+
+    Returns:
+        int: The number of requests, and of programs from the download queue, that
+            failed.
+    """
+    order = QueueOrder()
+    # The programs queued by this run are claimed by its workers, in order
+    run = uuid.uuid4().hex
+    queued = threading.Event()
+
+    def on_queued(items: list[QueueItem]) -> None:
+        if state is not None:
+            state.add_to_run(run, order.add(items))
+
+    with (
+        rich.progress.Progress() as progress,
+        concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as executor,
+    ):
+        workers = []
+        if state is not None:
+            state.requeue_in_progress()
+            workers = [
+                executor.submit(work_queue, state, run, progress, options, queued)
+                for _ in range(jobs)
+            ]
+        try:
+            plans, failed = plan_requests(
+                download_requests, download_dir, with_extras, state, on_queued, shard
+            )
+        except BaseException:
+            # Let the workers stop after their current downloads
+            if state is not None:
+                state.end_run(run)
+            raise
+        finally:
+            queued.set()
+
+        download_images(plans.values())
+        try:
+            failed |= download_jobs(
+                plans, download_dir, executor, progress, state, options
+            )
+        except InsufficientSpaceError as e:
+            typer.echo(f"Not downloading the programs: {e}")
+            failed |= {url for url, plan in plans.items() if plan.jobs}
+        for worker in workers:
+            worker.result()
+    artwork.wait()
+    if state is not None:
+        failed |= set(state.failed_programs(run))
+    return len(failed)
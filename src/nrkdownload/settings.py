@@ -0,0 +1,68 @@
+"""Settings and choices that the CLI needs before any download starts.
+
+This module only uses the standard library, so that the CLI can parse its options,
+print help and validate URLs without importing requests, pydantic or FFmpeg.
+"""
+
+from __future__ import annotations
+
+import os
+import re
+from enum import Enum
+from pathlib import Path
+
+DEFAULT_CACHE_DIR = (
+    Path(os.environ.get("XDG_CACHE_HOME", Path.home() / ".cache")) / "nrkdownload"
+)
+
+# The API endpoints that are cached, identified by a regex matching the URL path
+ENDPOINTS = {
+    "manifest": r"/playback/manifest/",
+    "program": r"/tv/catalog/programs/",
+    "season": r"/tv/catalog/series/[^/]+/(seasons|extramaterial)",
+    "series": r"/tv/catalog/series/[^/]+$",
+}
+
+
+def endpoint(url: str) -> str | None:
+    """Get the name of the API endpoint for a URL, or None if it is not cached."""
+    path = url.partition("?")[0]
+    for name, pattern in ENDPOINTS.items():
+        if re.search(pattern, path):
+            return name
+    return None
+
+
+# The metrics are only served to the local machine, unless another host is given
+DEFAULT_METRICS_HOST = "127.0.0.1"
+
+# The types of series at NRK
+SERIES_TYPES = ["news", "standard", "sequential"]
+
+
+class Engine(str, Enum):
+    """Enum for the engines that can download media streams."""
+
+    ffmpeg = "ffmpeg"
+    native = "native"
+
+
+class Quality(str, Enum):
+    """Enum for preferring the highest or lowest quality variant."""
+
+    highest = "highest"
+    lowest = "lowest"
+
+
+class SpacePolicy(str, Enum):
+    """Enum for what to do when a download needs more space than is free."""
+
+    refuse = "refuse"
+    wait = "wait"
+
+
+class LockPolicy(str, Enum):
+    """Enum for what to do with programs that another process is downloading."""
+
+    skip = "skip"
+    wait = "wait"
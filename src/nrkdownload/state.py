@@ -0,0 +1,573 @@
+"""Local index of downloaded series and programs, used for incremental syncing."""
+
+from __future__ import annotations
+
+import datetime as dt
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from collections.abc import Mapping
+from enum import Enum
+from pathlib import Path
+
+from pydantic import BaseModel
+
+from nrkdownload.locks import HEARTBEAT_SECONDS, STALE_SECONDS
+from nrkdownload.nrk_tv import Season, TVSeries
+
+STATE_FILENAME = ".nrkdownload.sqlite"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS series (
+    series_id TEXT PRIMARY KEY,
+    title TEXT NOT NULL,
+    type TEXT NOT NULL,
+    updated_at TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS seasons (
+    series_id TEXT NOT NULL,
+    season_id TEXT NOT NULL,
+    title TEXT NOT NULL,
+    updated_at TEXT NOT NULL,
+    PRIMARY KEY (series_id, season_id)
+);
+CREATE TABLE IF NOT EXISTS programs (
+    program_id TEXT PRIMARY KEY,
+    series_id TEXT,
+    season_id TEXT,
+    path TEXT,
+    size INTEGER,
+    status TEXT NOT NULL,
+    updated_at TEXT NOT NULL,
+    duration REAL
+);
+CREATE TABLE IF NOT EXISTS queue (
+    program_id TEXT PRIMARY KEY,
+    series_id TEXT,
+    season_id TEXT,
+    directory TEXT NOT NULL,
+    series_title TEXT,
+    sequence_string TEXT NOT NULL,
+    status TEXT NOT NULL,
+    added_at TEXT NOT NULL,
+    updated_at TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at TEXT,
+    error TEXT
+);
+"""
+
+# Columns added to the tables after they were first released
+MIGRATIONS = {
+    "queue": {
+        "attempts": "INTEGER NOT NULL DEFAULT 0",
+        "next_attempt_at": "TEXT",
+        "error": "TEXT",
+        "run": "TEXT",
+        "rank": "INTEGER",
+        "series_rank": "INTEGER",
+        "owner": "TEXT",
+        "heartbeat_at": "TEXT",
+    },
+    "programs": {"duration": "REAL"},
+}
+
+# Created after the migrations, since they index the added columns
+INDEXES = """
+CREATE INDEX IF NOT EXISTS queue_status ON queue (status, added_at);
+CREATE INDEX IF NOT EXISTS queue_run ON queue (
+    run, status, rank, series_rank, added_at
+);
+"""
+
+# A failed download is retried after RETRY_BACKOFF, doubled for each attempt
+MAX_ATTEMPTS = 4
+RETRY_BACKOFF = dt.timedelta(minutes=1)
+# How often to check the queue while other downloads are in progress, in seconds
+QUEUE_POLL_SECONDS = 1.0
+
+
+class ProgramStatus(str, Enum):
+    """Enum for the status of a program in the index."""
+
+    done = "done"
+    not_playable = "not_playable"
+
+
+class JobStatus(str, Enum):
+    """Enum for the status of a program in the download queue."""
+
+    pending = "pending"
+    in_progress = "in_progress"
+    done = "done"
+    failed = "failed"
+    not_playable = "not_playable"
+    # Put off without using up an attempt, e.g. while another process downloads it
+    deferred = "deferred"
+
+
+# The statuses of programs that are tried again when they are due
+RETRIED = (JobStatus.failed.value, JobStatus.deferred.value)
+
+
+class QueueItem(BaseModel):
+    """A program in the download queue, with where it should be downloaded."""
+
+    program_id: str
+    directory: Path
+    series_id: str | None = None
+    season_id: str | None = None
+    series_title: str | None = None
+    sequence_string: str = ""
+
+
+def now(delay: dt.timedelta = dt.timedelta(0)) -> str:
+    """Get the current time, plus an optional delay, as an ISO formatted string."""
+    return (dt.datetime.now(dt.timezone.utc) + delay).isoformat()
+
+
+class StateIndex:
+    """SQLite index of the series, seasons and programs in a download directory.
+
+    Example:
+    >>> state = StateIndex.for_download_dir(Path("~/Downloads/nrkdownload"))
+    """
+
+    def __init__(
+        self,
+        path: Path,
+        heartbeat_seconds: float = HEARTBEAT_SECONDS,
+        stale_seconds: float = STALE_SECONDS,
+    ) -> None:
+        """Open the index, creating it if it does not exist.
+
+        The programs claimed from the queue are kept alive by a heartbeat, like the
+        locks on the programs, so that other processes can tell whether they have
+        been left by a process that has stopped.
+        """
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.heartbeat_seconds = heartbeat_seconds
+        self.stale_seconds = stale_seconds
+        # Identifies the programs claimed through this index
+        self.owner = f"{socket.gethostname()} {os.getpid()} {uuid.uuid4().hex}"
+        # The index is shared between the download threads
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        self._heartbeat: threading.Thread | None = None
+        self._closed = False
+        with self._lock, self._connection:
+            # Processes that open the index at the same time migrate it one by one
+            self._connection.executescript(f"BEGIN IMMEDIATE;\n{SCHEMA}")
+            for table, migrations in MIGRATIONS.items():
+                columns = {
+                    row[1]
+                    for row in self._connection.execute(f"PRAGMA table_info({table})")
+                }
+                for name, definition in migrations.items():
+                    if name not in columns:
+                        self._connection.execute(
+                            f"ALTER TABLE {table} ADD COLUMN {name} {definition}"
+                        )
+            self._connection.executescript(INDEXES)
+
+    @classmethod
+    def for_download_dir(cls, download_dir: Path) -> StateIndex:
+        """Open the index stored in a download directory."""
+        return cls(download_dir / STATE_FILENAME)
+
+    def close(self) -> None:
+        """Close the index."""
+        with self._lock:
+            self._closed = True
+            self._connection.close()
+
+    def record_series(self, series: TVSeries, seasons: list[Season]) -> None:
+        """Record a series and its seasons."""
+        with self._lock, self._connection:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO series VALUES (?, ?, ?, ?)",
+                (series.series_id, series.title, series.type.value, now()),
+            )
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO seasons VALUES (?, ?, ?, ?)",
+                [
+                    (series.series_id, season.season_id, season.title, now())
+                    for season in seasons
+                ],
+            )
+
+    def record_program(
+        self,
+        program_id: str,
+        status: ProgramStatus,
+        path: Path | None = None,
+        series_id: str | None = None,
+        season_id: str | None = None,
+        duration: dt.timedelta | None = None,
+    ) -> None:
+        """Record the status of a program, and the file it was downloaded to."""
+        size = path.stat().st_size if path is not None and path.exists() else None
+        with self._lock, self._connection:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO programs (program_id, series_id, season_id, "
+                "path, size, status, updated_at, duration) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    program_id,
+                    series_id,
+                    season_id,
+                    str(path) if path is not None else None,
+                    size,
+                    status.value,
+                    now(),
+                    duration.total_seconds() if duration is not None else None,
+                ),
+            )
+
+    def downloaded_programs(self) -> list[tuple[str, Path, dt.timedelta | None]]:
+        """Get the ID, file and duration of each downloaded program."""
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT program_id, path, duration FROM programs "
+                "WHERE status = ? AND path IS NOT NULL ORDER BY path",
+                (ProgramStatus.done.value,),
+            ).fetchall()
+        return [
+            (
+                program_id,
+                Path(path),
+                dt.timedelta(seconds=duration) if duration is not None else None,
+            )
+            for program_id, path, duration in rows
+        ]
+
+    def requeue_program(self, program_id: str) -> None:
+        """Forget that a program is downloaded, and put it back in the queue."""
+        with self._lock, self._connection:
+            self._connection.execute(
+                "DELETE FROM programs WHERE program_id = ?", (program_id,)
+            )
+            self._connection.execute(
+                "UPDATE queue SET status = ?, attempts = 0, error = NULL, "
+                "next_attempt_at = NULL, updated_at = ? WHERE program_id = ? "
+                "AND status != ?",
+                (
+                    JobStatus.pending.value,
+                    now(),
+                    program_id,
+                    JobStatus.in_progress.value,
+                ),
+            )
+
+    def completed_programs(self, program_ids: list[str]) -> set[str]:
+        """Get the programs that are downloaded, and whose files are still intact."""
+        completed = set()
+        # Limit the number of parameters in each query
+        chunk_size = 500
+        with self._lock:
+            for start in range(0, len(program_ids), chunk_size):
+                chunk = program_ids[start : start + chunk_size]
+                placeholders = ", ".join("?" * len(chunk))
+                query = (
+                    "SELECT program_id, path, size FROM programs "  # noqa: S608
+                    f"WHERE status = ? AND program_id IN ({placeholders})"
+                )
+                for program_id, path, size in self._connection.execute(
+                    query, (ProgramStatus.done.value, *chunk)
+                ):
+                    if is_intact(path, size):
+                        completed.add(program_id)
+        return completed
+
+    def enqueue(self, items: list[QueueItem], reset: bool = False) -> int:
+        """Add programs to the download queue, unless they are already in it.
+
+        Args:
+            items (list[QueueItem]): The programs to add.
+            reset (bool, optional): Whether programs that are already finished or
+                failed should be queued again, with no attempts. Programs that are
+                pending or in progress are left as they are. Defaults to False.
+
+        Returns:
+            int: The number of programs that were added or queued again.
+        """
+        with self._lock, self._connection:
+            before = self._connection.total_changes
+            self._connection.executemany(
+                "INSERT OR IGNORE INTO queue (program_id, series_id, season_id, "
+                "directory, series_title, sequence_string, status, added_at, "
+                "updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [
+                    (
+                        item.program_id,
+                        item.series_id,
+                        item.season_id,
+                        str(item.directory),
+                        item.series_title,
+                        item.sequence_string,
+                        JobStatus.pending.value,
+                        now(),
+                        now(),
+                    )
+                    for item in items
+                ],
+            )
+            if reset:
+                self._connection.executemany(
+                    "UPDATE queue SET status = ?, attempts = 0, error = NULL, "
+                    "next_attempt_at = NULL, updated_at = ? WHERE program_id = ? "
+                    "AND status NOT IN (?, ?)",
+                    [
+                        (
+                            JobStatus.pending.value,
+                            now(),
+                            item.program_id,
+                            JobStatus.pending.value,
+                            JobStatus.in_progress.value,
+                        )
+                        for item in items
+                    ],
+                )
+            return self._connection.total_changes - before
+
+    def add_to_run(self, run: str, ranks: Mapping[str, tuple[int, int]]) -> None:
+        """Add programs in the queue to a run, which claims them in a given order.
+
+        Args:
+            run (str): Identifies the run.
+            ranks (Mapping[str, tuple[int, int]]): The programs, with the order they
+                are taken in. The lowest rank is taken first.
+        """
+        with self._lock, self._connection:
+            self._connection.executemany(
+                "UPDATE queue SET run = ?, rank = ?, series_rank = ? "
+                "WHERE program_id = ?",
+                [
+                    (run, rank, series_rank, program_id)
+                    for program_id, (rank, series_rank) in ranks.items()
+                ],
+            )
+
+    def end_run(self, run: str) -> None:
+        """Take the programs out of a run, so that no more of them are claimed.
+
+        The programs are left in the queue, for the next run.
+        """
+        with self._lock, self._connection:
+            self._connection.execute(
+                "UPDATE queue SET run = NULL, rank = NULL, series_rank = NULL "
+                "WHERE run = ?",
+                (run,),
+            )
+
+    def failed_programs(self, run: str) -> list[str]:
+        """Get the programs of a run that failed, and are not retried any more."""
+        with self._lock:
+            return [
+                row[0]
+                for row in self._connection.execute(
+                    "SELECT program_id FROM queue WHERE run = ? AND status = ? "
+                    "AND attempts >= ?",
+                    (run, JobStatus.failed.value, MAX_ATTEMPTS),
+                )
+            ]
+
+    def claim_next(self, run: str | None = None) -> QueueItem | None:
+        """Take the next program to download from the queue, and mark it in progress.
+
+        Pending programs are taken first, and then failed programs that are due for
+        another attempt.
+
+        Args:
+            run (str, optional): Only take programs added to this run, in the order
+                of their ranks. Defaults to None, which means any program in the
+                queue, in the order they were added.
+        """
+        scope, params = ("run = ? AND ", (run,)) if run is not None else ("", ())
+        order = (
+            "added_at, rowid" if run is None else "rank, series_rank, added_at, rowid"
+        )
+        select = (
+            "SELECT program_id, series_id, season_id, directory, series_title, "  # noqa: S608
+            f"sequence_string, status, updated_at FROM queue WHERE {scope}"
+        )
+        with self._lock, self._connection:
+            while True:
+                row = self._connection.execute(
+                    f"{select}status = ? ORDER BY {order} LIMIT 1",
+                    (*params, JobStatus.pending.value),
+                ).fetchone()
+                if row is None:
+                    row = self._connection.execute(
+                        f"{select}status IN (?, ?) AND attempts < ? "
+                        f"AND next_attempt_at <= ? ORDER BY {order} LIMIT 1",
+                        (*params, *RETRIED, MAX_ATTEMPTS, now()),
+                    ).fetchone()
+                if row is None:
+                    return None
+                # Another process may have claimed the program since it was selected,
+                # and then the next program is tried
+                claimed = self._connection.execute(
+                    "UPDATE queue SET status = ?, attempts = attempts + 1, owner = ?, "
+                    "heartbeat_at = ?, updated_at = ? "
+                    "WHERE program_id = ? AND status = ? AND updated_at = ?",
+                    (
+                        JobStatus.in_progress.value,
+                        self.owner,
+                        now(),
+                        now(),
+                        row[0],
+                        row[6],
+                        row[7],
+                    ),
+                ).rowcount
+                if claimed:
+                    break
+            if self._heartbeat is None:
+                self._heartbeat = threading.Thread(target=self.beat, daemon=True)
+                self._heartbeat.start()
+        program_id, series_id, season_id, directory, series_title, sequence = row[:6]
+        return QueueItem(
+            program_id=program_id,
+            directory=Path(directory),
+            series_id=series_id,
+            season_id=season_id,
+            series_title=series_title,
+            sequence_string=sequence,
+        )
+
+    def finish(
+        self, program_id: str, status: JobStatus, error: str | None = None
+    ) -> None:
+        """Set the status of a program in the queue.
+
+        A failed program is retried later, with a delay that doubles for each
+        attempt, until it has been attempted MAX_ATTEMPTS times. A deferred program
+        is tried again after RETRY_BACKOFF, and the attempt is not counted.
+
+        Only a program claimed through this index is changed. If it was taken over
+        by another process, after its heartbeat went stale, it is left to that
+        process.
+        """
+        with self._lock, self._connection:
+            row = self._connection.execute(
+                "SELECT attempts FROM queue WHERE program_id = ? AND status = ? "
+                "AND owner = ?",
+                (program_id, JobStatus.in_progress.value, self.owner),
+            ).fetchone()
+            if row is None:
+                return
+            (attempts,) = row
+            next_attempt_at = None
+            if status == JobStatus.failed:
+                next_attempt_at = now(RETRY_BACKOFF * 2 ** max(attempts - 1, 0))
+            elif status == JobStatus.deferred:
+                next_attempt_at = now(RETRY_BACKOFF)
+                attempts -= 1
+            self._connection.execute(
+                "UPDATE queue SET status = ?, attempts = ?, error = ?, "
+                "next_attempt_at = ?, updated_at = ? "
+                "WHERE program_id = ? AND owner = ?",
+                (
+                    status.value,
+                    attempts,
+                    error,
+                    next_attempt_at,
+                    now(),
+                    program_id,
+                    self.owner,
+                ),
+            )
+
+    def seconds_until_next(self, run: str | None = None) -> float | None:
+        """Get the number of seconds until a program in the queue may be claimed.
+
+        Args:
+            run (str, optional): Only consider programs added to this run. Defaults
+                to None, which means any program in the queue.
+
+        Returns:
+            float | None: 0 if a program is pending, a short while if programs are
+                in progress (they may fail and be retried), the time until the next
+                retry of a failed program, or None if there is nothing left to do.
+        """
+        scope, params = ("run = ? AND ", (run,)) if run is not None else ("", ())
+        exists = f"SELECT 1 FROM queue WHERE {scope}status = ? LIMIT 1"  # noqa: S608
+        with self._lock:
+            if self._connection.execute(
+                exists, (*params, JobStatus.pending.value)
+            ).fetchone():
+                return 0.0
+            in_progress = self._connection.execute(
+                exists, (*params, JobStatus.in_progress.value)
+            ).fetchone()
+            (next_attempt_at,) = self._connection.execute(
+                "SELECT MIN(next_attempt_at) FROM queue "  # noqa: S608
+                f"WHERE {scope}status IN (?, ?) AND attempts < ?",
+                (*params, *RETRIED, MAX_ATTEMPTS),
+            ).fetchone()
+        waits = [QUEUE_POLL_SECONDS] if in_progress else []
+        if next_attempt_at is not None:
+            next_attempt = dt.datetime.fromisoformat(next_attempt_at)
+            delay = next_attempt - dt.datetime.now(dt.timezone.utc)
+            waits.append(max(delay.total_seconds(), 0.0))
+        return min(waits, default=None)
+
+    def beat(self) -> None:
+        """Touch the programs claimed through this index, until none are left."""
+        while True:
+            time.sleep(self.heartbeat_seconds)
+            with self._lock:
+                if self._closed:
+                    self._heartbeat = None
+                    return
+                with self._connection:
+                    touched = self._connection.execute(
+                        "UPDATE queue SET heartbeat_at = ? "
+                        "WHERE status = ? AND owner = ?",
+                        (now(), JobStatus.in_progress.value, self.owner),
+                    ).rowcount
+                if not touched:
+                    self._heartbeat = None
+                    return
+
+    def requeue_in_progress(self) -> int:
+        """Put programs left in progress by stopped processes back in the queue.
+
+        A program has been left when its heartbeat has not been touched for a
+        while. The programs that other running processes are downloading are left
+        as they are.
+        """
+        stale = now(-dt.timedelta(seconds=self.stale_seconds))
+        with self._lock, self._connection:
+            return self._connection.execute(
+                "UPDATE queue SET status = ?, owner = NULL, updated_at = ? "
+                "WHERE status = ? AND (heartbeat_at IS NULL OR heartbeat_at < ?)",
+                (JobStatus.pending.value, now(), JobStatus.in_progress.value, stale),
+            ).rowcount
+
+    def queued_programs(self, program_ids: list[str]) -> set[str]:
+        """Get the programs that are in the queue, whatever their status."""
+        queued: set[str] = set()
+        chunk_size = 500
+        with self._lock:
+            for start in range(0, len(program_ids), chunk_size):
+                chunk = program_ids[start : start + chunk_size]
+                placeholders = ", ".join("?" * len(chunk))
+                query = (
+                    "SELECT program_id FROM queue "  # noqa: S608
+                    f"WHERE program_id IN ({placeholders})"
+                )
+                queued.update(row[0] for row in self._connection.execute(query, chunk))
+        return queued
+
+
+def is_intact(path: str | None, size: int | None) -> bool:
+    """Check that a downloaded file still exists, with the recorded size."""
+    if path is None:
+        return False
+    filename = Path(path)
+    return filename.exists() and filename.stat().st_size == size
@@ -0,0 +1,78 @@
+"""Selecting subtitle tracks, and naming the subtitle files."""
+
+from __future__ import annotations
+
+from pathlib import Path
+from typing import Any
+
+from pydantic import BaseModel, HttpUrl
+
+# Norwegian subtitles are written to .no.srt files, whatever the written standard
+NORWEGIAN = {"nb", "nn", "no", "nob", "nno", "nor"}
+
+
+class SubtitleTrack(BaseModel):
+    """A subtitle track of a program."""
+
+    url: HttpUrl
+    language: str = "no"
+    # The type of subtitles given by NRK, e.g. ttv or nor
+    kind: str = ""
+    label: str = ""
+    default: bool = False
+
+    @classmethod
+    def from_manifest(cls, data: dict[str, Any]) -> SubtitleTrack:
+        """Create a SubtitleTrack from a subtitle in a playback manifest."""
+        return cls(
+            url=data["webVtt"],
+            language=data.get("language") or "no",
+            kind=data.get("type") or "",
+            label=data.get("label") or "",
+            default=data.get("defaultOn", False),
+        )
+
+    @property
+    def language_code(self) -> str:
+        """Get the language code used in the filename."""
+        return "no" if self.language in NORWEGIAN else self.language
+
+
+def select_subtitles(
+    tracks: list[SubtitleTrack], wanted: list[str]
+) -> list[SubtitleTrack]:
+    """Select the subtitle tracks to download.
+
+    Args:
+        tracks (list[SubtitleTrack]): The subtitle tracks of a program.
+        wanted (list[str]): Languages or kinds of subtitles, e.g. nb or ttv, or "all"
+            for all tracks. If empty, the tracks that are on by default are selected.
+    """
+    if not wanted:
+        return [track for track in tracks if track.default]
+    if "all" in wanted:
+        return tracks
+    return [
+        track
+        for track in tracks
+        if track.language in wanted
+        or track.language_code in wanted
+        or track.kind in wanted
+    ]
+
+
+def subtitle_filenames(filename: Path, tracks: list[SubtitleTrack]) -> list[Path]:
+    """Get the filenames for the subtitle tracks of a program.
+
+    The first track in each language is named e.g. "Title.no.srt", and the following
+    ones get the kind of subtitles as well, e.g. "Title.no.ttv.srt".
+    """
+    filenames: list[Path] = []
+    for number, track in enumerate(tracks):
+        code = track.language_code
+        for suffix in (code, f"{code}.{track.kind or number}", f"{code}.{number}"):
+            candidate = Path(f"{filename}.{suffix}.srt")
+            if candidate not in filenames:
+                break
+        filenames.append(candidate)
+    return filenames
@@ -0,0 +1,52 @@
+"""Parsing of NRK TV URLs into download requests.
+
+Like the settings, this module only uses the standard library until a URL is turned
+into a request, so that the CLI can validate URLs quickly.
+"""
+
+from __future__ import annotations
+
+import re
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from nrkdownload.plan import ProgramRequest, SeriesRequest
+
+
+def match_program_url(url: str) -> str | None:
+    """Figure out if the URL is a program URL."""
+    if match := re.match(r"https://tv.nrk.no/program/(\w+)", url):
+        return match.group(1)
+    return None
+
+
+def match_series_url(url: str) -> tuple[str, str | None, str | None] | None:
+    """Figure out if the URL is a series URL."""
+    if match := re.match(
+        r"https://tv.nrk.no/serie/([\w-]+)(?:/sesong/(\w+)|/(\w+)|)(?:/episode/(\w+)|/(\w+)|)",
+        url,
+    ):
+        series_id = match.group(1)
+        season_id = match.group(2) or match.group(3)
+        episode_id = match.group(4) or match.group(5)
+        return series_id, season_id, episode_id
+    return None
+
+
+def parse_url(url: str) -> ProgramRequest | SeriesRequest | None:
+    """Parse a URL into a download request, or None if it is not valid."""
+    program_id = match_program_url(url)
+    match = match_series_url(url)
+    if program_id is None and match is None:
+        return None
+
+    from nrkdownload.plan import ProgramRequest, SeriesRequest
+
+    if program_id is not None:
+        return ProgramRequest(url=url, program_id=program_id)
+    if match is not None:
+        series_id, season_id, episode_id = match
+        return SeriesRequest(
+            url=url, series_id=series_id, season_id=season_id, episode_id=episode_id
+        )
+    return None
@@ -0,0 +1,222 @@
+"""Fast integrity checks of downloaded MP4 files.
+
+Only the box headers and the movie header of a file are read, not the media data, so
+a large library is checked in minutes. A file is complete when all its top-level boxes
+fit in the file, it has a movie header with the expected tracks, usually video and
+audio, and its duration is close to the duration of the program at NRK.
+"""
+
+from __future__ import annotations
+
+import concurrent.futures
+import datetime as dt
+import struct
+from collections.abc import Collection, Iterator
+from pathlib import Path
+from typing import TYPE_CHECKING, BinaryIO
+
+from loguru import logger
+from pydantic import BaseModel
+
+if TYPE_CHECKING:
+    from nrkdownload.state import StateIndex
+
+# Boxes that contain other boxes, on the way to the track headers
+CONTAINER_BOXES = {b"moov", b"trak", b"mdia"}
+HANDLERS = {
+    b"vide": "video",
+    b"soun": "audio",
+    b"text": "subtitle",
+    b"sbtl": "subtitle",
+}
+# The duration may differ from NRK's by this fraction, or by MIN_TOLERANCE
+DURATION_TOLERANCE = 0.05
+MIN_TOLERANCE = dt.timedelta(seconds=10)
+# Files are checked concurrently, since most of the time is spent waiting for reads
+VERIFY_WORKERS = 8
+# Incomplete files are renamed with this suffix when they are queued again
+INCOMPLETE_SUFFIX = ".incomplete"
+
+
+class IncompleteMediaError(Exception):
+    """Raised when a media file is truncated, corrupt or shorter than expected."""
+
+    pass
+
+
+class MediaInfo(BaseModel):
+    """The duration and tracks of an MP4 file."""
+
+    duration: dt.timedelta
+    # The kind of each track, e.g. video or audio
+    streams: list[str]
+
+
+class Box(BaseModel):
+    """The header of an MP4 box."""
+
+    kind: bytes
+    # Offsets in the file of the box content, and of the end of the box
+    start: int
+    end: int
+
+
+def iter_boxes(file: BinaryIO, start: int, end: int) -> Iterator[Box]:
+    """Iterate over the boxes between two offsets, without reading their content.
+
+    Raises:
+        IncompleteMediaError: If a box extends beyond the end.
+    """
+    offset = start
+    while offset + 8 <= end:
+        file.seek(offset)
+        size, kind = struct.unpack(">I4s", file.read(8))
+        header = 8
+        if size == 1:
+            if offset + 16 > end:
+                raise IncompleteMediaError(f"The box at offset {offset} is truncated")
+            (size,) = struct.unpack(">Q", file.read(8))
+            header = 16
+        elif size == 0:
+            size = end - offset
+        if size < header or offset + size > end:
+            raise IncompleteMediaError(
+                f"The {kind.decode(errors='replace')} box at offset {offset} is "
+                "truncated"
+            )
+        yield Box(kind=kind, start=offset + header, end=offset + size)
+        offset += size
+
+
+def read_duration(file: BinaryIO, box: Box) -> dt.timedelta:
+    """Read the duration from a movie header (mvhd) box.
+
+    Raises:
+        IncompleteMediaError: If the box is too short for a movie header.
+    """
+    file.seek(box.start)
+    content = file.read(min(box.end - box.start, 32))
+    # Version 1 headers have 64-bit times and durations
+    layout = ">QQIQ" if content[:1] == b"\x01" else ">IIII"
+    try:
+        _, _, timescale, duration = struct.unpack_from(layout, content, 4)
+    except struct.error as e:
+        raise IncompleteMediaError("The movie header is truncated") from e
+    return dt.timedelta(seconds=duration / timescale) if timescale else dt.timedelta(0)
+
+
+def probe_mp4(filename: Path) -> MediaInfo:
+    """Get the duration and tracks of an MP4 file, from its movie header.
+
+    Raises:
+        IncompleteMediaError: If the file is truncated, or has no movie header.
+    """
+    size = filename.stat().st_size
+    duration: dt.timedelta | None = None
+    streams: list[str] = []
+    with filename.open("rb") as file:
+        boxes = list(iter_boxes(file, 0, size))
+        moov = next((box for box in boxes if box.kind == b"moov"), None)
+        if moov is None:
+            raise IncompleteMediaError("The file has no movie header")
+
+        pending = [moov]
+        while pending:
+            container = pending.pop(0)
+            for box in iter_boxes(file, container.start, container.end):
+                if box.kind in CONTAINER_BOXES:
+                    pending.append(box)
+                elif box.kind == b"mvhd":
+                    duration = read_duration(file, box)
+                elif box.kind == b"hdlr":
+                    file.seek(box.start + 8)
+                    handler = file.read(4)
+                    streams.append(
+                        HANDLERS.get(handler, handler.decode(errors="replace"))
+                    )
+    if duration is None:
+        raise IncompleteMediaError("The movie header has no duration")
+    return MediaInfo(duration=duration, streams=streams)
+
+
+def verify_media(
+    filename: Path,
+    expected_duration: dt.timedelta | None = None,
+    expected_streams: Collection[str] | None = ("video", "audio"),
+) -> None:
+    """Check that a media file is complete.
+
+    Args:
+        filename (Path): The MP4 file.
+        expected_duration (timedelta, optional): The duration of the program at NRK.
+            If given, the file must be about as long. Defaults to None.
+        expected_streams (Collection[str], optional): The kinds of tracks the file
+            must have. If None, it must have a video or an audio track. Defaults to
+            video and audio.
+
+    Raises:
+        IncompleteMediaError: If the file is truncated, misses tracks, or is
+            shorter than expected.
+    """
+    info = probe_mp4(filename)
+    if expected_streams is None:
+        if not {"video", "audio"} & set(info.streams):
+            raise IncompleteMediaError("The file has no video or audio")
+    elif missing := set(expected_streams) - set(info.streams):
+        raise IncompleteMediaError(f"The file has no {' or '.join(sorted(missing))}")
+    if expected_duration is not None:
+        tolerance = max(expected_duration * DURATION_TOLERANCE, MIN_TOLERANCE)
+        if info.duration < expected_duration - tolerance:
+            raise IncompleteMediaError(
+                f"The file is {info.duration.total_seconds():.0f} seconds long, "
+                f"expected {expected_duration.total_seconds():.0f} seconds"
+            )
+
+
+def verify_library(
+    download_dir: Path, state: StateIndex | None = None, requeue: bool = False
+) -> tuple[int, dict[Path, str]]:
+    """Check all media files in a download directory.
+
+    Files in the index are compared with the duration of the program when it was
+    downloaded. Other files are only checked for truncation. Since some programs
+    have no video, or no audio, a file only needs one of them.
+
+    Args:
+        download_dir (Path): The download directory.
+        state (StateIndex, optional): The index of the download directory.
+            Defaults to None.
+        requeue (bool, optional): Whether incomplete files should be renamed, and
+            their programs downloaded again by the next run. Defaults to False.
+
+    Returns:
+        tuple[int, dict[Path, str]]: The number of files that were checked, and
+            the problem with each incomplete file.
+    """
+    files: dict[Path, tuple[str | None, dt.timedelta | None]] = {}
+    if state is not None:
+        for program_id, filename, duration in state.downloaded_programs():
+            if filename.exists():
+                files[filename.resolve()] = (program_id, duration)
+    for filename in sorted(download_dir.rglob("*.m4v")):
+        files.setdefault(filename.resolve(), (None, None))
+
+    def check(filename: Path) -> str | None:
+        logger.debug(f"Verifying {filename}")
+        try:
+            verify_media(filename, files[filename][1], expected_streams=None)
+        except IncompleteMediaError as e:
+            return str(e)
+        return None
+
+    with concurrent.futures.ThreadPoolExecutor(VERIFY_WORKERS) as executor:
+        errors = dict(zip(files, executor.map(check, files), strict=True))
+    problems = {filename: error for filename, error in errors.items() if error}
+
+    if requeue:
+        for filename in problems:
+            filename.replace(filename.with_name(filename.name + INCOMPLETE_SUFFIX))
+            indexed_id = files[filename][0]
+            if state is not None and indexed_id is not None:
+                state.requeue_program(indexed_id)
+    return len(files), problems
@@ -0,0 +1,220 @@
+"""Watch subscribed series, and download new episodes as they are published.
+
+Only the latest season of each series is polled. Series of type news are polled
+more often than sequential series, and series without new episodes are polled
+gradually less often. New episodes are added to the persistent download queue in
+the state index, and downloaded by a bounded pool of workers.
+"""
+
+from __future__ import annotations
+
+import concurrent.futures
+import datetime as dt
+import threading
+import time
+from pathlib import Path
+
+import requests
+import rich.progress
+import typer
+from loguru import logger
+from pydantic import BaseModel
+
+from nrkdownload.artwork import artwork
+from nrkdownload.download import process_item
+from nrkdownload.nrk_tv import DownloadOptions, Season, TVSeries, TVSeriesType
+from nrkdownload.plan import Shard, episode_pages, in_shard
+from nrkdownload.state import QueueItem, StateIndex
+
+DEFAULT_POLL_INTERVALS = {
+    TVSeriesType.news: dt.timedelta(minutes=10),
+    TVSeriesType.standard: dt.timedelta(hours=1),
+    TVSeriesType.sequential: dt.timedelta(hours=6),
+}
+# Polls without new episodes make the interval grow, up to this factor
+MAX_BACKOFF_FACTOR = 4.0
+BACKOFF_GROWTH = 1.5
+# How often the series itself is fetched, to discover new seasons
+SERIES_REFRESH = dt.timedelta(days=1)
+# Workers check the queue at least this often, in seconds
+QUEUE_CHECK_INTERVAL = 30.0
+
+
+class Subscription(BaseModel):
+    """A watched series, and when it should be polled."""
+
+    series_id: str
+    series: TVSeries | None = None
+    # Times are from time.monotonic()
+    refreshed_at: float = 0.0
+    next_poll: float = 0.0
+    backoff_factor: float = 1.0
+
+    def interval(self, intervals: dict[TVSeriesType, dt.timedelta]) -> float:
+        """Get the number of seconds until the next poll."""
+        series_type = self.series.type if self.series else TVSeriesType.standard
+        base = intervals.get(series_type, DEFAULT_POLL_INTERVALS[series_type])
+        return base.total_seconds() * self.backoff_factor
+
+    def latest_season_id(self) -> str | None:
+        """Get the ID of the latest season of the series."""
+        if self.series is None or not self.series.season_info:
+            return None
+        return self.series.season_info[-1].season_id
+
+
+def new_episodes(
+    download_dir: Path,
+    series: TVSeries,
+    season: Season,
+    state: StateIndex,
+    shard: Shard | None = None,
+) -> list[QueueItem]:
+    """Get the episodes of a season that are neither downloaded nor queued.
+
+    With a shard, only the episodes assigned to it are included.
+    """
+    new: list[QueueItem] = []
+    for page in episode_pages(download_dir, series, season):
+        page = [item for item in page if in_shard(shard, item.program_id)]
+        program_ids = [item.program_id for item in page]
+        known = state.completed_programs(program_ids) | state.queued_programs(
+            program_ids
+        )
+        new.extend(item for item in page if item.program_id not in known)
+    return new
+
+
+class Watcher:
+    """Poll subscribed series, and download new episodes.
+
+    Example:
+    >>> watcher = Watcher(download_dir, ["dagsrevyen"], state, jobs=2)
+    >>> watcher.run()
+    """
+
+    def __init__(
+        self,
+        download_dir: Path,
+        series_ids: list[str],
+        state: StateIndex,
+        jobs: int = 1,
+        options: DownloadOptions | None = None,
+        intervals: dict[TVSeriesType, dt.timedelta] | None = None,
+        shard: Shard | None = None,
+    ) -> None:
+        """Create a watcher for the given series."""
+        self.download_dir = download_dir
+        self.subscriptions = [
+            Subscription(series_id=series_id) for series_id in series_ids
+        ]
+        self.state = state
+        self.jobs = jobs
+        self.options = options or DownloadOptions()
+        self.intervals = DEFAULT_POLL_INTERVALS | (intervals or {})
+        self.shard = shard
+        self.stop = threading.Event()
+        self._work_available = threading.Event()
+
+    def poll(self, subscription: Subscription) -> int:
+        """Poll the latest season of a series, and queue new episodes.
+
+        Returns:
+            int: The number of episodes that were queued.
+        """
+        now = time.monotonic()
+        # The artwork of a series is downloaded by only one shard
+        images = in_shard(self.shard, subscription.series_id)
+        if (
+            subscription.series is None
+            or now - subscription.refreshed_at > SERIES_REFRESH.total_seconds()
+        ):
+            subscription.series = TVSeries.from_series_id(subscription.series_id)
+            subscription.refreshed_at = now
+            if images:
+                subscription.series.download_images(self.download_dir)
+        series = subscription.series
+
+        season_id = subscription.latest_season_id()
+        if season_id is None:
+            logger.warning(f"{series.title} has no seasons")
+            return 0
+        season = series.get_season(season_id)
+        if images:
+            season.download_images(self.download_dir / series.dirname)
+        self.state.record_series(series, [season])
+
+        queued = self.state.enqueue(
+            new_episodes(self.download_dir, series, season, self.state, self.shard)
+        )
+        if queued:
+            typer.echo(f"Found {queued} new episodes of {series.title}")
+            subscription.backoff_factor = 1.0
+            self._work_available.set()
+        else:
+            subscription.backoff_factor = min(
+                subscription.backoff_factor * BACKOFF_GROWTH, MAX_BACKOFF_FACTOR
+            )
+        return queued
+
+    def poll_due(self) -> float:
+        """Poll the series that are due.
+
+        A series that can not be polled is logged, and polled again at its next
+        interval, without stopping the watcher.
+
+        Returns:
+            float: Seconds until the next series is due.
+        """
+        for subscription in self.subscriptions:
+            if subscription.next_poll > time.monotonic():
+                continue
+            try:
+                self.poll(subscription)
+            except requests.RequestException as e:
+                logger.warning(f"Could not poll {subscription.series_id}: {e}")
+            except Exception as e:
+                logger.opt(exception=e).error(
+                    f"Unexpected error when polling {subscription.series_id}"
+                )
+            subscription.next_poll = time.monotonic() + subscription.interval(
+                self.intervals
+            )
+        # The watcher runs for a long time, so the images are not remembered
+        # between polls
+        artwork.forget()
+        next_poll = min(subscription.next_poll for subscription in self.subscriptions)
+        return max(0.0, next_poll - time.monotonic())
+
+    def work(self, progress: rich.progress.Progress) -> None:
+        """Download programs from the queue, until the watcher is stopped."""
+        while not self.stop.is_set():
+            self._work_available.clear()
+            item = self.state.claim_next()
+            if item is None:
+                self._work_available.wait(QUEUE_CHECK_INTERVAL)
+                continue
+            process_item(item, progress, self.state, self.options)
+
+    def run(self) -> None:
+        """Poll and download until stopped, e.g. by Ctrl-C."""
+        requeued = self.state.requeue_in_progress()
+        if requeued:
+            logger.info(f"Continuing {requeued} downloads from the last run")
+        with (
+            rich.progress.Progress() as progress,
+            concurrent.futures.ThreadPoolExecutor(self.jobs) as executor,
+        ):
+            workers = [executor.submit(self.work, progress) for _ in range(self.jobs)]
+            try:
+                while not self.stop.is_set():
+                    self.stop.wait(self.poll_due())
+            finally:
+                self.stop.set()
+                self._work_available.set()
+                for worker in workers:
+                    worker.cancel()
+        for worker in workers:
+            if not worker.cancelled() and (error := worker.exception()) is not None:
+                logger.opt(exception=error).error("A download worker stopped")
+        artwork.wait()
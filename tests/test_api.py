@@ -0,0 +1,122 @@
+"""Tests for the Python API."""
+
+import asyncio
+import dataclasses
+import datetime as dt
+import threading
+from pathlib import Path
+
+import pydantic
+import pytest
+import requests
+import rich.progress
+
+from nrkdownload import api
+from nrkdownload.api import DownloadResult, adownload, download, plan
+from nrkdownload.nrk_tv import ProgramRecord
+from nrkdownload.plan import ProgramJob
+
+
+def make_jobs(tmp_path: Path, episodes: int) -> list[ProgramJob]:
+    """Create resolved episodes of a series."""
+    return [
+        ProgramJob(
+            program=ProgramRecord(
+                program_id=f"SERI{episode:08d}",
+                title=f"Episode {episode}",
+                prod_year=2024,
+                duration=dt.timedelta(minutes=30),
+                image_url=None,
+                poster_url=None,
+                backdrop_url=None,
+                media_urls=(),
+            ),
+            directory=tmp_path,
+            series_title="Series",
+            sequence_string=f"s01e{episode:02d}",
+        )
+        for episode in range(1, episodes + 1)
+    ]
+
+
+def fake_download_job(
+    job: ProgramJob, progress: rich.progress.Progress, *_: object
+) -> None:
+    """Report the progress of a download, and fail the second episode."""
+    task = progress.add_task(job.program.title, total=1800)
+    progress.update(task, completed=900)
+    if job.program.program_id == "SERI00000002":
+        raise requests.ConnectionError("Connection reset")
+    progress.update(task, completed=1800)
+
+
+def test_plan_invalid_url(tmp_path: Path) -> None:  # noqa: D103
+    with pytest.raises(ValueError, match="Not a program or series URL"):
+        plan(["https://tv.nrk.no/direkte/nrk1"], tmp_path)
+
+
+def test_download(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:  # noqa: D103
+    monkeypatch.setattr(api, "download_job", fake_download_job)
+    reported: list[tuple[str, float, float]] = []
+
+    results = list(
+        download(
+            make_jobs(tmp_path, 3),
+            concurrency=2,
+            on_progress=lambda job, seconds, total: reported.append(
+                (job.program.program_id, seconds, total)
+            ),
+        )
+    )
+    assert {result.job.program.program_id: result.ok for result in results} == {
+        "SERI00000001": True,
+        "SERI00000002": False,
+        "SERI00000003": True,
+    }
+    assert next(result for result in results if result.ok).filename is not None
+    assert ("SERI00000003", 1800, 1800) in reported
+
+
+def test_download_invalid_program(tmp_path: Path) -> None:  # noqa: D103
+    job = make_jobs(tmp_path, 1)[0]
+    job.program = dataclasses.replace(job.program, media_urls=("not a URL",))
+    job.estimated_size = 0
+    # The program is validated when it is downloaded, and fails on its own
+    (result,) = download([job])
+    assert isinstance(result.error, pydantic.ValidationError)
+
+
+def test_download_cancel(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:  # noqa: D103
+    monkeypatch.setattr(api, "download_job", fake_download_job)
+    cancel = threading.Event()
+    results = []
+    for result in download(make_jobs(tmp_path, 10), cancel=cancel):
+        results.append(result)
+        cancel.set()
+    # The running download is finished, and no more are started
+    assert [result.job.program.program_id for result in results] == ["SERI00000001"]
+
+
+def test_adownload(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:  # noqa: D103
+    monkeypatch.setattr(api, "download_job", fake_download_job)
+    reported: list[float] = []
+
+    async def run() -> list[DownloadResult]:
+        loop = asyncio.get_running_loop()
+
+        def on_progress(job: ProgramJob, seconds: float, total: float) -> None:
+            # The callback is called in the event loop
+            assert asyncio.get_running_loop() is loop
+            assert job.program.duration.total_seconds() == total
+            reported.append(seconds)
+
+        return [
+            result
+            async for result in adownload(
+                make_jobs(tmp_path, 4), concurrency=2, on_progress=on_progress
+            )
+        ]
+
+    results = asyncio.run(run())
+    assert sorted(result.ok for result in results) == [False, True, True, True]
+    assert reported.count(1800) == 3
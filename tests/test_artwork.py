@@ -0,0 +1,93 @@
+"""Tests for downloading artwork."""
+
+import http.server
+import threading
+from collections.abc import Iterator
+from pathlib import Path
+from typing import ClassVar
+
+import pytest
+
+from nrkdownload.artwork import ArtworkDownloader
+
+IMAGE = b"\xff\xd8\xff" + bytes(100_000)
+
+
+class ImageHandler(http.server.BaseHTTPRequestHandler):
+    """Serve an image, and answer conditional requests with 304."""
+
+    requests: ClassVar[list[str]] = []
+
+    def do_GET(self) -> None:  # noqa: D102
+        self.requests.append(self.path)
+        if self.headers.get("If-None-Match") == '"v1"':
+            self.send_response(304)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("ETag", '"v1"')
+        self.send_header("Last-Modified", "Tue, 01 Mar 2022 12:00:00 GMT")
+        self.send_header("Content-Length", str(len(IMAGE)))
+        self.end_headers()
+        self.wfile.write(IMAGE)
+
+    def log_message(self, *args: object) -> None:  # noqa: D102
+        pass
+
+
+@pytest.fixture
+def server_url() -> Iterator[str]:
+    """Run an image server."""
+    ImageHandler.requests = []
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), ImageHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+
+
+def test_identical_urls_are_fetched_once(  # noqa: D103
+    tmp_path: Path, server_url: str
+) -> None:
+    downloader = ArtworkDownloader()
+    downloader.submit(f"{server_url}/poster", tmp_path / "poster.jpg")
+    downloader.submit(f"{server_url}/poster", tmp_path / "Season 1" / "Season01.jpg")
+    downloader.submit(f"{server_url}/poster", tmp_path / "poster.jpg")
+    downloader.wait()
+
+    assert ImageHandler.requests == ["/poster"]
+    assert (tmp_path / "poster.jpg").read_bytes() == IMAGE
+    assert (tmp_path / "Season 1" / "Season01.jpg").read_bytes() == IMAGE
+    # The file gets the modification time of the image on the server
+    assert (tmp_path / "poster.jpg").stat().st_mtime == 1646136000
+
+    # Forgotten images are revalidated when they are submitted again
+    downloader.forget()
+    downloader.submit(f"{server_url}/poster", tmp_path / "poster.jpg")
+    downloader.wait()
+    assert ImageHandler.requests == ["/poster", "/poster"]
+
+
+def test_existing_files_are_revalidated(  # noqa: D103
+    tmp_path: Path, server_url: str
+) -> None:
+    etag_file = tmp_path / "cache" / "artwork.json"
+    downloader = ArtworkDownloader()
+    downloader.use_etag_file(etag_file)
+    downloader.submit(f"{server_url}/banner", tmp_path / "banner.jpg")
+    downloader.wait()
+
+    # A new run sends the ETag, and keeps the file when it is not modified
+    downloader = ArtworkDownloader()
+    downloader.use_etag_file(etag_file)
+    future = downloader.submit(f"{server_url}/banner", tmp_path / "banner.jpg")
+    assert future.result() == tmp_path / "banner.jpg"
+    assert ImageHandler.requests == ["/banner", "/banner"]
+    assert (tmp_path / "banner.jpg").read_bytes() == IMAGE
+
+
+def test_failed_download(tmp_path: Path) -> None:  # noqa: D103
+    downloader = ArtworkDownloader()
+    future = downloader.submit("http://127.0.0.1:1/missing", tmp_path / "x.jpg")
+    assert future.result() is None
+    assert not (tmp_path / "x.jpg").exists()
@@ -0,0 +1,56 @@
+"""Tests for locating the FFmpeg binary."""
+
+import os
+import stat
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+from nrkdownload.binaries import FFmpegNotFoundError, ffmpeg_version
+
+
+@pytest.fixture
+def fake_ffmpeg(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> Path:
+    """Put an ffmpeg on $PATH that counts how many times it is started."""
+    bin_dir = tmp_path / "bin"
+    bin_dir.mkdir()
+    executable = bin_dir / "ffmpeg"
+    executable.write_text(
+        f"#!/bin/sh\necho started >> {tmp_path / 'starts'}\n"
+        "echo 'ffmpeg version 7.1 Copyright'\n"
+    )
+    executable.chmod(executable.stat().st_mode | stat.S_IEXEC)
+    monkeypatch.setenv("PATH", str(bin_dir))
+    return executable
+
+
+def test_version_is_cached(tmp_path: Path, fake_ffmpeg: Path) -> None:  # noqa: D103
+    cache_dir = tmp_path / "cache"
+    assert ffmpeg_version(cache_dir) == "ffmpeg version 7.1 Copyright"
+    assert ffmpeg_version(cache_dir) == "ffmpeg version 7.1 Copyright"
+    assert len((tmp_path / "starts").read_text().splitlines()) == 1
+
+    # A replaced binary is started again
+    mtime = fake_ffmpeg.stat().st_mtime_ns + 1_000_000_000
+    os.utime(fake_ffmpeg, ns=(mtime, mtime))
+    ffmpeg_version(cache_dir)
+    assert len((tmp_path / "starts").read_text().splitlines()) == 2
+
+
+def test_ffmpeg_not_found(monkeypatch: pytest.MonkeyPatch) -> None:  # noqa: D103
+    monkeypatch.setenv("PATH", "")
+    with pytest.raises(FFmpegNotFoundError):
+        ffmpeg_version()
+
+
+def test_cli_imports_are_lazy() -> None:  # noqa: D103
+    code = (
+        "import sys, nrkdownload.cli; "
+        "print(sorted({'requests', 'pydantic', 'ffmpeg'} & set(sys.modules)))"
+    )
+    result = subprocess.run(  # noqa: S603
+        [sys.executable, "-c", code], capture_output=True, check=True, text=True
+    )
+    assert result.stdout.strip() == "[]"
@@ -0,0 +1,68 @@
+"""Tests for the API response cache."""
+
+from __future__ import annotations
+
+import datetime as dt
+from pathlib import Path
+from typing import Any
+
+import requests
+
+from nrkdownload.cache import ResponseCache, endpoint
+
+SERIES_URL = "https://psapi.nrk.no//tv/catalog/series/kongen-av-gulset"
+MANIFEST_URL = "https://psapi.nrk.no//playback/manifest/program/MYNR46000018"
+
+
+class FakeSession(requests.Session):
+    """A session that returns canned responses, and records the requests."""
+
+    def __init__(self, status_code: int = 200) -> None:  # noqa: D107
+        super().__init__()
+        self.status_code = status_code
+        self.requests: list[dict[str, str]] = []
+
+    def get(  # noqa: D102
+        self,
+        url: str | bytes,
+        **kwargs: Any,  # noqa: ANN401
+    ) -> requests.Response:
+        self.requests.append(kwargs.get("headers") or {})
+        response = requests.Response()
+        response.url = str(url)
+        response.status_code = self.status_code
+        response.headers["ETag"] = '"v1"'
+        response._content = b'{"title": "Kongen av Gulset"}'
+        return response
+
+
+def test_endpoint() -> None:  # noqa: D103
+    assert endpoint(SERIES_URL) == "series"
+    assert endpoint(SERIES_URL + "/seasons/1") == "season"
+    assert endpoint(SERIES_URL + "/extramaterial") == "season"
+    assert endpoint(MANIFEST_URL) == "manifest"
+    assert endpoint("https://psapi.nrk.no/something/else") is None
+
+
+def test_cache_hit(tmp_path: Path) -> None:  # noqa: D103
+    cache = ResponseCache(tmp_path)
+    session = FakeSession()
+    assert cache.get_json(session, SERIES_URL) == {"title": "Kongen av Gulset"}
+    assert cache.get_json(session, SERIES_URL) == {"title": "Kongen av Gulset"}
+    assert len(session.requests) == 1
+
+
+def test_cache_revalidation(tmp_path: Path) -> None:  # noqa: D103
+    cache = ResponseCache(tmp_path, ttls={"series": dt.timedelta(seconds=-1)})
+    cache.get_json(FakeSession(), SERIES_URL)
+    session = FakeSession(status_code=304)
+    assert cache.get_json(session, SERIES_URL) == {"title": "Kongen av Gulset"}
+    assert session.requests == [{"If-None-Match": '"v1"'}]
+
+
+def test_cache_eviction(tmp_path: Path) -> None:  # noqa: D103
+    cache = ResponseCache(tmp_path, max_size=500)
+    session = FakeSession()
+    for season in range(10):
+        cache.get_json(session, f"{SERIES_URL}/seasons/{season}")
+    assert 0 < cache.size() <= 500
@@ -5,7 +5,7 @@ from pathlib import Path
 import pytest
 from typer.testing import CliRunner
 
-from nrkdownload.cli import app
+from nrkdownload.cli import app, parse_bitrate, parse_shard
 
 runner = CliRunner()
 
@@ -30,11 +30,44 @@ def test_verbose_level() -> None:  # noqa: D103
     assert "Setting loglevel to TRACE" in result.stderr
 
 
+def test_parse_bitrate() -> None:  # noqa: D103
+    assert parse_bitrate("3M") == 3_000_000
+    assert parse_bitrate("800k") == 800_000
+    assert parse_bitrate("1500000") == 1_500_000
+    result = runner.invoke(app, ["--max-bitrate", "fast", "https://tv.nrk.no/"])
+    assert result.exit_code == 2
+
+
+def test_parse_shard() -> None:  # noqa: D103
+    assert str(parse_shard("2/3")) == "2/3"
+    for value in ["0/3", "4/3", "1-3"]:
+        result = runner.invoke(app, ["--shard", value, "https://tv.nrk.no/serie/x"])
+        assert result.exit_code == 2
+
+
 def test_illegal_url() -> None:  # noqa: D103
     result = runner.invoke(app, "https://tv.nrk.no/")
     assert result.exit_code == 1
 
 
+def test_missing_input_file(  # noqa: D103
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    monkeypatch.chdir(tmp_path)
+    result = runner.invoke(app, ["--input-file", "urls.txt"])
+    assert result.exit_code == 2
+    assert "does not exist" in result.stderr
+
+
+def test_verify_empty_library(tmp_path: Path) -> None:  # noqa: D103
+    result = runner.invoke(app, ["--verify", "-d", str(tmp_path)])
+    assert result.exit_code == 0
+    assert "Verified 0 files, 0 incomplete" in result.stdout
+    (tmp_path / "video.m4v").write_bytes(b"not a video")
+    result = runner.invoke(app, ["--verify", "-d", str(tmp_path)])
+    assert result.exit_code == 1
+
+
 def test_not_available_program(tmp_path: Path) -> None:  # noqa: D103
     result = runner.invoke(
         app,
@@ -0,0 +1,72 @@
+"""Tests for the NRK TV API client."""
+
+import asyncio
+import http.server
+import json
+import threading
+from collections.abc import Iterator
+from typing import ClassVar
+
+import pytest
+import requests
+
+from nrkdownload.client import AsyncPsapiClient, PsapiClient, create_session
+from nrkdownload.metrics import metrics
+
+
+class FlakyHandler(http.server.BaseHTTPRequestHandler):
+    """Fail the first request for each path with 503, then return the path."""
+
+    seen: ClassVar[set[str]] = set()
+
+    def do_GET(self) -> None:  # noqa: D102
+        if self.path not in self.seen:
+            self.seen.add(self.path)
+            self.send_response(503)
+            self.send_header("Retry-After", "0")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        body = json.dumps({"path": self.path}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args: object) -> None:  # noqa: D102
+        pass
+
+
+@pytest.fixture
+def server_url() -> Iterator[str]:
+    """Run a flaky API server."""
+    FlakyHandler.seen = set()
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), FlakyHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+
+
+def test_retry_server_errors(server_url: str) -> None:  # noqa: D103
+    client = PsapiClient(base_url=server_url, session=create_session(retries=2))
+    retries = metrics.counter("http_retries_total", reason="503")
+    assert client.get_json("/tv/catalog/series/lykkeland") == {
+        "path": "/tv/catalog/series/lykkeland"
+    }
+    assert metrics.counter("http_retries_total", reason="503") == retries + 1
+
+
+def test_give_up_without_retries(server_url: str) -> None:  # noqa: D103
+    client = PsapiClient(base_url=server_url, session=create_session(retries=0))
+    with pytest.raises(requests.HTTPError):
+        client.get_json("/tv/catalog/series/lykkeland")
+
+
+def test_async_client(server_url: str) -> None:  # noqa: D103
+    client = PsapiClient(base_url=server_url, session=create_session(retries=2))
+    async_client = AsyncPsapiClient(client, max_concurrency=2)
+    paths = [f"/tv/catalog/programs/{n}" for n in range(5)]
+    data = asyncio.run(async_client.get_many(paths))
+    assert [item["path"] for item in data] == paths
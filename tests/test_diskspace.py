@@ -0,0 +1,112 @@
+"""Tests for the accounting of free disk space."""
+
+import datetime as dt
+import threading
+from pathlib import Path
+
+import pytest
+
+from nrkdownload import diskspace
+from nrkdownload.diskspace import DiskSpace, InsufficientSpaceError, format_size
+from nrkdownload.nrk_tv import TVProgram
+from nrkdownload.plan import ProgramJob
+from nrkdownload.settings import SpacePolicy
+
+GB = 1024**3
+
+
+@pytest.fixture
+def free(monkeypatch: pytest.MonkeyPatch) -> list[int]:
+    """Pretend that the volume has the given free space."""
+    free = [10 * GB]
+    monkeypatch.setattr(diskspace, "free_space", lambda _: free[0])
+    return free
+
+
+@pytest.mark.usefixtures("free")
+def test_check_plan(tmp_path: Path) -> None:  # noqa: D103
+    disk = DiskSpace(reserve=GB)
+    disk.check(tmp_path, 9 * GB)
+    with pytest.raises(InsufficientSpaceError, match=r"need about 9\.5 GB"):
+        disk.check(tmp_path, 9 * GB + GB // 2)
+
+    # With the wait policy, the plan is started anyway
+    disk.configure(GB, SpacePolicy.wait)
+    disk.check(tmp_path, 20 * GB)
+
+
+@pytest.mark.usefixtures("free")
+def test_claim_waits_for_other_downloads(tmp_path: Path) -> None:  # noqa: D103
+    disk = DiskSpace(reserve=GB, poll_seconds=0.01)
+    claimed = threading.Event()
+
+    def second_download() -> None:
+        with disk.claim(tmp_path, 6 * GB):
+            claimed.set()
+
+    with disk.claim(tmp_path, 6 * GB):
+        thread = threading.Thread(target=second_download)
+        thread.start()
+        # The second download does not fit next to the first one
+        assert not claimed.wait(0.1)
+    assert claimed.wait(1)
+    thread.join()
+
+
+def test_claim_refuses_what_never_fits(free: list[int], tmp_path: Path) -> None:  # noqa: D103
+    disk = DiskSpace(reserve=GB, poll_seconds=0.01)
+    # Nothing else holds space, so waiting would never help
+    with (
+        pytest.raises(InsufficientSpaceError, match=r"needs about 12\.0 GB"),
+        disk.claim(tmp_path, 12 * GB),
+    ):
+        pass
+
+    # With the wait policy, the claim waits until the volume has room
+    disk.configure(GB, SpacePolicy.wait)
+    claimed = threading.Event()
+
+    def claim() -> None:
+        with disk.claim(tmp_path, 12 * GB):
+            claimed.set()
+
+    thread = threading.Thread(target=claim)
+    thread.start()
+    assert not claimed.wait(0.1)
+    free[0] = 20 * GB
+    assert claimed.wait(1)
+    thread.join()
+
+
+def test_pause_while_low_on_space(free: list[int], tmp_path: Path) -> None:  # noqa: D103
+    disk = DiskSpace(reserve=GB, poll_seconds=0.01)
+    free[0] = GB // 2
+    thread = threading.Thread(target=disk.wait_for_space, args=(tmp_path,))
+    thread.start()
+    thread.join(0.1)
+    assert thread.is_alive()
+    free[0] = 2 * GB
+    thread.join(1)
+    assert not thread.is_alive()
+
+
+def test_existing_media_needs_no_space(tmp_path: Path) -> None:  # noqa: D103
+    program = TVProgram(
+        program_id="MYNT19000118",
+        title="Kongen av Gulset",
+        prod_year=2019,
+        duration=dt.timedelta(minutes=30),
+        image_url=None,
+        poster_url=None,
+        backdrop_url=None,
+        media_urls=[],
+    )
+    job = ProgramJob(program=program, directory=tmp_path)
+    job.media_filename.write_bytes(b"video")
+    assert job.media_filename == tmp_path / "Kongen av Gulset (2019).m4v"
+    assert job.estimate_size() == 0
+
+
+def test_format_size() -> None:  # noqa: D103
+    assert format_size(512) == "512.0 B"
+    assert format_size(1.5 * GB) == "1.5 GB"
@@ -0,0 +1,162 @@
+"""Tests for parsing HLS playlists."""
+
+from __future__ import annotations
+
+from typing import Any
+
+import requests
+
+from nrkdownload.hls import (
+    MasterPlaylists,
+    Quality,
+    VariantSelector,
+    expected_tracks,
+    get_variants,
+    is_master_playlist,
+    parse_master_playlist,
+    parse_media_playlist,
+    select_streams,
+)
+
+BASE_URL = "https://nrk-od.akamaized.net/world/23451/3/hls/prog/master.m3u8"
+
+MASTER_PLAYLIST = """#EXTM3U
+#EXT-X-VERSION:3
+#EXT-X-STREAM-INF:BANDWIDTH=1292000,RESOLUTION=640x360,CODECS="avc1.4d401e,mp4a.40.2"
+index_1_av.m3u8
+#EXT-X-STREAM-INF:BANDWIDTH=5129000,RESOLUTION=1280x720,CODECS="avc1.4d401f,mp4a.40.2"
+index_4_av.m3u8
+"""
+
+MEDIA_PLAYLIST = """#EXTM3U
+#EXT-X-TARGETDURATION:6
+#EXT-X-PLAYLIST-TYPE:VOD
+#EXTINF:6.000,
+segment1_4_av.ts
+#EXTINF:4.480,
+https://cdn.example.com/segment2_4_av.ts
+#EXT-X-ENDLIST
+"""
+
+
+def test_parse_master_playlist() -> None:  # noqa: D103
+    assert is_master_playlist(MASTER_PLAYLIST)
+    master = parse_master_playlist(MASTER_PLAYLIST, BASE_URL)
+    assert [variant.bandwidth for variant in master.variants] == [1292000, 5129000]
+    assert master.variants[1].height == 720
+    assert master.variants[1].url == BASE_URL.replace("master", "index_4_av")
+    assert master.separate_audio_groups == set()
+
+
+def test_parse_master_playlist_with_audio_group() -> None:  # noqa: D103
+    text = MASTER_PLAYLIST.replace(
+        "#EXT-X-VERSION:3",
+        '#EXT-X-MEDIA:TYPE=AUDIO,GROUP-ID="aac",LANGUAGE="nor",URI="audio.m3u8"',
+    )
+    assert parse_master_playlist(text, BASE_URL).separate_audio_groups == {"aac"}
+
+
+AUDIO_MASTER_PLAYLIST = "\n".join(
+    [
+        "#EXTM3U",
+        (
+            '#EXT-X-MEDIA:TYPE=AUDIO,GROUP-ID="aac",LANGUAGE="nor",NAME="Norsk",'
+            'URI="nor.m3u8"'
+        ),
+        (
+            '#EXT-X-MEDIA:TYPE=AUDIO,GROUP-ID="aac",LANGUAGE="nor",NAME="Synstolk",'
+            'DEFAULT=YES,URI="syn.m3u8"'
+        ),
+        '#EXT-X-STREAM-INF:BANDWIDTH=1292000,RESOLUTION=640x360,AUDIO="aac"',
+        "index_1_v.m3u8",
+        '#EXT-X-STREAM-INF:BANDWIDTH=5129000,RESOLUTION=1280x720,AUDIO="aac"',
+        "index_4_v.m3u8",
+    ]
+)
+
+
+class PlaylistSession(requests.Session):
+    """A session that returns a master playlist, and counts the requests."""
+
+    requests = 0
+    text = AUDIO_MASTER_PLAYLIST
+
+    def get(  # noqa: D102
+        self,
+        url: str | bytes,
+        **kwargs: Any,  # noqa: ANN401, ARG002
+    ) -> requests.Response:
+        self.requests += 1
+        response = requests.Response()
+        response.url = str(url)
+        response.status_code = 200
+        response._content = self.text.encode()
+        return response
+
+
+def test_select_streams() -> None:  # noqa: D103
+    session = PlaylistSession()
+    # Without any selection, FFmpeg gets the master playlist
+    assert select_streams(session, BASE_URL).url == BASE_URL
+
+    streams = select_streams(session, BASE_URL, VariantSelector(max_height=360))
+    assert streams.url.endswith("/index_1_v.m3u8")
+    assert [rendition.name for rendition in streams.audio] == ["Synstolk"]
+
+    streams = select_streams(session, BASE_URL, all_audio=True)
+    assert streams.url.endswith("/index_4_v.m3u8")
+    assert [rendition.name for rendition in streams.audio] == ["Norsk", "Synstolk"]
+
+
+def test_master_playlist_is_reused() -> None:  # noqa: D103
+    session = PlaylistSession()
+    url = BASE_URL.replace("23451", "reused")
+    # The master playlist fetched for the size estimate is used for the download
+    assert len(get_variants(session, url)) == 2
+    assert select_streams(session, url, all_audio=True).url.endswith("/index_4_v.m3u8")
+    assert session.requests == 1
+
+    playlists = MasterPlaylists(maxsize=1)
+    playlists.get(session, url)
+    playlists.get(session, BASE_URL)
+    playlists.get(session, url)
+    assert session.requests == 4
+
+
+def test_expected_tracks() -> None:  # noqa: D103
+    session = PlaylistSession()
+    session.text = MASTER_PLAYLIST.replace("avc1.4d401f,", "")
+    url = BASE_URL.replace("23451", "tracks")
+    # The highest variant has no video, and the lowest has both
+    assert expected_tracks(session, url) == {"audio"}
+    assert expected_tracks(session, url, VariantSelector(max_height=360)) == {
+        "video",
+        "audio",
+    }
+    # The codecs of the variants are not listed
+    session.text = AUDIO_MASTER_PLAYLIST
+    assert expected_tracks(session, BASE_URL.replace("23451", "no-codecs")) is None
+
+
+def test_parse_media_playlist() -> None:  # noqa: D103
+    assert not is_master_playlist(MEDIA_PLAYLIST)
+    playlist = parse_media_playlist(MEDIA_PLAYLIST, BASE_URL)
+    assert [segment.duration for segment in playlist.segments] == [6.0, 4.48]
+    assert playlist.segments[0].url.endswith("/hls/prog/segment1_4_av.ts")
+    assert playlist.segments[1].url == "https://cdn.example.com/segment2_4_av.ts"
+    assert not playlist.encrypted
+
+    encrypted = MEDIA_PLAYLIST.replace(
+        "#EXT-X-PLAYLIST-TYPE:VOD", '#EXT-X-KEY:METHOD=AES-128,URI="key"'
+    )
+    assert parse_media_playlist(encrypted, BASE_URL).encrypted
+
+
+def test_variant_selector() -> None:  # noqa: D103
+    variants = parse_master_playlist(MASTER_PLAYLIST, BASE_URL).variants
+    assert VariantSelector().select(variants).height == 720
+    assert VariantSelector(quality=Quality.lowest).select(variants).height == 360
+    assert VariantSelector(max_height=480).select(variants).height == 360
+    assert VariantSelector(max_bitrate=3_000_000).select(variants).height == 360
+    # If no variant is within the limits, the lowest bandwidth is selected
+    assert VariantSelector(max_bitrate=1_000).select(variants).height == 360
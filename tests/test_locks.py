@@ -0,0 +1,155 @@
+"""Tests for the locks on programs that are being downloaded."""
+
+import os
+import subprocess
+import sys
+import threading
+import time
+from pathlib import Path
+
+import pytest
+
+from nrkdownload.locks import ProgramLockedError, ProgramLocks, lock_filename
+from nrkdownload.settings import LockPolicy
+from nrkdownload.state import STATE_FILENAME, JobStatus, QueueItem, StateIndex
+
+# Holds the lock on a media file in another process, until it is killed
+HOLD_LOCK = """
+import sys, time
+from pathlib import Path
+from nrkdownload.locks import locks
+with locks.hold(Path(sys.argv[1])):
+    print("locked", flush=True)
+    time.sleep(30)
+"""
+
+# Claims a program from a shared index and downloads it, but its claim goes stale
+# while it holds the lock. It finishes the program when a line is written to it.
+SLOW_CLAIM = """
+import sys
+from pathlib import Path
+from nrkdownload.locks import locks
+from nrkdownload.state import JobStatus, StateIndex
+state = StateIndex(Path(sys.argv[1]), heartbeat_seconds=60)
+item = state.claim_next()
+with locks.hold(Path(sys.argv[2])):
+    print(item.program_id, flush=True)
+    sys.stdin.readline()
+state.finish(item.program_id, JobStatus.done)
+"""
+
+
+def test_lock_is_exclusive(tmp_path: Path) -> None:  # noqa: D103
+    media_filename = tmp_path / "Series" / "s01e01.m4v"
+    first, second = ProgramLocks(), ProgramLocks()
+    with first.hold(media_filename):
+        assert lock_filename(media_filename).exists()
+        with (
+            pytest.raises(ProgramLockedError, match=f"process {os.getpid()} on"),
+            second.hold(media_filename),
+        ):
+            pass
+    assert not lock_filename(media_filename).exists()
+    with second.hold(media_filename):
+        pass
+
+
+def test_lock_held_by_other_process(tmp_path: Path) -> None:  # noqa: D103
+    media_filename = tmp_path / "s01e01.m4v"
+    holder = subprocess.Popen(  # noqa: S603
+        [sys.executable, "-c", HOLD_LOCK, str(media_filename)],
+        stdout=subprocess.PIPE,
+        text=True,
+    )
+    try:
+        assert holder.stdout is not None
+        assert holder.stdout.readline() == "locked\n"
+        with (
+            pytest.raises(ProgramLockedError, match=f"process {holder.pid} on"),
+            ProgramLocks().hold(media_filename),
+        ):
+            pass
+    finally:
+        holder.kill()
+        holder.wait()
+
+
+def test_stale_lock_is_taken_over(tmp_path: Path) -> None:  # noqa: D103
+    media_filename = tmp_path / "s01e01.m4v"
+    path = lock_filename(media_filename)
+    path.write_text("otherhost 1234 token")
+    stale = time.time() - 600
+    os.utime(path, (stale, stale))
+
+    locks = ProgramLocks(stale_seconds=120)
+    with locks.hold(media_filename):
+        assert "otherhost" not in path.read_text()
+    assert not path.exists()
+
+
+def test_heartbeat_keeps_lock_alive(tmp_path: Path) -> None:  # noqa: D103
+    media_filename = tmp_path / "s01e01.m4v"
+    path = lock_filename(media_filename)
+    locks = ProgramLocks(heartbeat_seconds=0.01, stale_seconds=1)
+    with locks.hold(media_filename):
+        old = time.time() - 600
+        os.utime(path, (old, old))
+        time.sleep(0.2)
+        assert not locks.is_stale(path)
+        with pytest.raises(ProgramLockedError), ProgramLocks().hold(media_filename):
+            pass
+
+
+def test_wait_for_lock(tmp_path: Path) -> None:  # noqa: D103
+    media_filename = tmp_path / "s01e01.m4v"
+    events = []
+    locked = threading.Event()
+
+    def download() -> None:
+        with ProgramLocks().hold(media_filename):
+            locked.set()
+            time.sleep(0.2)
+            events.append("first")
+
+    thread = threading.Thread(target=download)
+    thread.start()
+    locked.wait()
+    with ProgramLocks(LockPolicy.wait, poll_seconds=0.01).hold(media_filename):
+        events.append("second")
+    thread.join()
+    assert events == ["first", "second"]
+
+
+def test_processes_sharing_an_index(tmp_path: Path) -> None:  # noqa: D103
+    path = tmp_path / STATE_FILENAME
+    media_filename = tmp_path / "s01e01.m4v"
+    state = StateIndex(path, stale_seconds=0.5)
+    state.enqueue([QueueItem(program_id="MYNT19000118", directory=tmp_path)])
+    holder = subprocess.Popen(  # noqa: S603
+        [sys.executable, "-c", SLOW_CLAIM, str(path), str(media_filename)],
+        stdin=subprocess.PIPE,
+        stdout=subprocess.PIPE,
+        text=True,
+    )
+    try:
+        assert holder.stdout is not None
+        assert holder.stdout.readline() == "MYNT19000118\n"
+        # The claim of the other process goes stale, and is taken over
+        time.sleep(0.6)
+        assert state.requeue_in_progress() == 1
+        item = state.claim_next()
+        assert item is not None
+        # The program is still locked by the other process, so it is deferred
+        with pytest.raises(ProgramLockedError), ProgramLocks().hold(media_filename):
+            pass
+        state.finish(item.program_id, JobStatus.deferred)
+        holder.communicate("\n", timeout=10)
+    finally:
+        holder.kill()
+        holder.wait()
+    # The other process does not overwrite the program it no longer owns
+    row = state._connection.execute(
+        "SELECT status, attempts, owner FROM queue WHERE program_id = ?",
+        (item.program_id,),
+    ).fetchone()
+    assert row == (JobStatus.deferred.value, 1, state.owner)
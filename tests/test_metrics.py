@@ -0,0 +1,60 @@
+"""Tests for the metrics and the run report."""
+
+import json
+import urllib.request
+from pathlib import Path
+
+from nrkdownload.metrics import Metrics
+
+
+def test_counters_and_histograms() -> None:  # noqa: D103
+    metrics = Metrics()
+    metrics.inc("skipped_total", reason="exists")
+    metrics.inc("skipped_total", 2, reason="exists")
+    assert metrics.counter("skipped_total", reason="exists") == 3
+    assert metrics.counter("skipped_total", reason="not_playable") == 0
+
+    metrics.observe("api_request_seconds", 0.2, endpoint="program")
+    metrics.observe("api_request_seconds", 3.0, endpoint="program")
+    with metrics.timer("api_request_seconds", endpoint="program"):
+        pass
+    histogram = metrics.histogram("api_request_seconds", endpoint="program")
+    assert histogram is not None
+    assert histogram.count == 3
+    assert dict(histogram.cumulative())["0.25"] == 2
+    assert dict(histogram.cumulative())["+Inf"] == 3
+
+
+def test_run_report(tmp_path: Path) -> None:  # noqa: D103
+    metrics = Metrics()
+    metrics.record_program("MYNT19000118", 4_000_000, 2.0)
+    report_file = tmp_path / "report.json"
+    metrics.write_report(report_file)
+
+    report = json.loads(report_file.read_text())
+    assert report["programs"][0]["throughput"] == 2_000_000
+    assert report["counters"]["downloaded_bytes_total"] == [
+        {"labels": {"kind": "media"}, "value": 4_000_000}
+    ]
+    assert report["histograms"]["program_download_seconds"][0]["count"] == 1
+
+
+def test_prometheus_endpoint() -> None:  # noqa: D103
+    metrics = Metrics()
+    metrics.inc("cache_requests_total", endpoint="series", result="hit")
+    metrics.observe("ffmpeg_seconds", 12.5, kind="media")
+
+    server = metrics.serve(0)
+    # Only served to the local machine by default
+    assert server.server_address[0] == "127.0.0.1"
+    try:
+        url = f"http://127.0.0.1:{server.server_address[1]}/metrics"
+        with urllib.request.urlopen(url) as response:
+            text = response.read().decode()
+    finally:
+        server.shutdown()
+
+    assert "# TYPE nrkdownload_cache_requests_total counter" in text
+    assert 'nrkdownload_cache_requests_total{endpoint="series",result="hit"} 1' in text
+    assert 'nrkdownload_ffmpeg_seconds_bucket{kind="media",le="30"} 1' in text
+    assert 'nrkdownload_ffmpeg_seconds_sum{kind="media"} 12.5' in text
@@ -1,8 +1,23 @@
 """Tests for the NRK TV API."""
 
+import dataclasses
+import time
 from pathlib import Path
+from typing import Any
 
-from nrkdownload.nrk_tv import TVProgram, TVSeries, TVSeriesType
+import pytest
+
+from nrkdownload import nrk_tv
+from nrkdownload.hls import AudioRendition, StreamSelection
+from nrkdownload.nrk_tv import (
+    NotPlayableError,
+    ProgramRecord,
+    Season,
+    TVProgram,
+    TVSeries,
+    TVSeriesType,
+    media_command,
+)
 
 
 def test_tv_series() -> None:  # noqa: D103
@@ -38,3 +53,102 @@ def test_news_series() -> None:  # noqa: D103
 def test_tv_program() -> None:  # noqa: D103
     program = TVProgram.from_program_id("MYNR46000018")
     assert program.title == "Arif og Unge Ferrari med Stavanger Symfoniorkester"
+
+
+def test_paged_season(monkeypatch: pytest.MonkeyPatch) -> None:  # noqa: D103
+    pages = {
+        "/tv/catalog/series/dagsrevyen/seasons/202401": {
+            "seriesType": "news",
+            "titles": {"title": "Januar 2024"},
+            "_links": {
+                "next": {"href": "/tv/catalog/series/dagsrevyen/seasons/202402"}
+            },
+            "_embedded": {
+                "instalments": {
+                    "_embedded": {"instalments": [{"prfId": "NNFA19010124"}]},
+                    "_links": {
+                        "next": {
+                            "href": "https://psapi.nrk.no/tv/catalog/series/dagsrevyen"
+                            "/seasons/202401/instalments?page=2"
+                        }
+                    },
+                }
+            },
+        },
+        "/tv/catalog/series/dagsrevyen/seasons/202401/instalments?page=2": {
+            "_embedded": {"instalments": [{"prfId": "NNFA19020124"}]},
+            "_links": {},
+        },
+    }
+    requested = []
+
+    def get_json(path: str) -> Any:  # noqa: ANN401
+        requested.append(path)
+        return pages[path]
+
+    monkeypatch.setattr(nrk_tv.client, "get_json", get_json)
+    season = Season.from_ids("dagsrevyen", "202401")
+    episodes = season.iter_episodes()
+    assert next(episodes) == "NNFA19010124"
+    assert list(episodes) == ["NNFA19020124"]
+    assert len(requested) == 2
+    assert season.episodes == ["NNFA19010124", "NNFA19020124"]
+
+
+def test_program_record(monkeypatch: pytest.MonkeyPatch) -> None:  # noqa: D103
+    data = {
+        "programInformation": {
+            "titles": {"title": "Kongen av Gulset"},
+            "image": [{"url": "https://gfx.nrk.no/image.jpg", "width": 960}],
+        },
+        "moreInformation": {"productionYear": 2019, "duration": {"seconds": 1800}},
+    }
+    manifest = {
+        "playability": "playable",
+        "playable": {
+            "assets": [{"url": "https://nrk-od.akamaized.net/master.m3u8"}],
+            "subtitles": [],
+        },
+    }
+    record = ProgramRecord.from_api("MYNT19000118", data, manifest)
+    program = record.to_program()
+    assert program.image_url is not None
+    assert program.image_url.host == "gfx.nrk.no"
+    assert program.duration == record.duration
+    assert program.program_filename(Path()) == record.program_filename(Path())
+
+    with pytest.raises(NotPlayableError):
+        ProgramRecord.from_api("MYNT19000118", data, {"playability": "nonPlayable"})
+
+    # A record is resolved again when its manifest may have expired
+    assert record.refresh() is record
+    monkeypatch.setattr(
+        nrk_tv.client,
+        "get_json",
+        lambda path: manifest if path.startswith("/playback/") else data,
+    )
+    stale = dataclasses.replace(record, resolved_at=time.monotonic() - 600)
+    refreshed = stale.refresh()
+    assert refreshed.resolved_at > stale.resolved_at
+    assert refreshed.media_urls == record.media_urls
+
+
+def test_media_command_leaves_out_subtitles() -> None:  # noqa: D103
+    ffmpeg = media_command(StreamSelection(url="master.m3u8"), Path("a.m4v.part"))
+    ffmpeg.input("sub.vtt")
+    ffmpeg.output("a.no.srt.part", map="1:0", f="srt")
+    # The subtitle input is only written to the SRT file, not the media file
+    arguments = ffmpeg.arguments
+    assert arguments.index("-sn") < arguments.index("a.m4v.part")
+
+    streams = StreamSelection(
+        url="video.m3u8",
+        audio=[AudioRendition(url="audio.m3u8", group="aac", language="nb")],
+    )
+    arguments = media_command(streams, Path("a.m4v.part")).arguments
+    assert arguments[arguments.index("-map") :][:4] == [
+        "-map",
+        "0:v:0",
+        "-map",
+        "1:a:0",
+    ]
@@ -0,0 +1,31 @@
+"""Tests for the bandwidth limiter."""
+
+import datetime as dt
+import time
+
+from nrkdownload.ratelimit import BandwidthWindow, RateLimiter
+
+
+def test_bandwidth_window() -> None:  # noqa: D103
+    night = BandwidthWindow(start=dt.time(23), end=dt.time(7), rate=None)
+    assert night.contains(dt.time(23, 30))
+    assert night.contains(dt.time(3))
+    assert not night.contains(dt.time(12))
+    day = BandwidthWindow(start=dt.time(7), end=dt.time(23), rate=1024)
+    assert day.contains(dt.time(12))
+    assert not day.contains(dt.time(23, 30))
+
+
+def test_rate_limiter() -> None:  # noqa: D103
+    assert not RateLimiter().enabled
+    limiter = RateLimiter(rate=1_000_000, burst_seconds=0)
+    start = time.monotonic()
+    for _ in range(10):
+        limiter.consume(20_000)
+    assert time.monotonic() - start >= 0.19
+
+
+def test_rate_limiter_window() -> None:  # noqa: D103
+    always = BandwidthWindow(start=dt.time(0), end=dt.time(0), rate=None)
+    limiter = RateLimiter(rate=1, windows=[always])
+    assert limiter.current_rate() is None
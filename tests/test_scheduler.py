@@ -0,0 +1,277 @@
+"""Tests for the scheduling of several series in one run."""
+
+import datetime as dt
+import json
+import threading
+import time
+from pathlib import Path
+from typing import Any
+
+import pytest
+import requests
+
+from nrkdownload import diskspace, scheduler
+from nrkdownload import download as download_module
+from nrkdownload import state as state_module
+from nrkdownload.diskspace import disk
+from nrkdownload.nrk_tv import TVProgram
+from nrkdownload.plan import DownloadPlan, ProgramJob, SeriesRequest, Shard
+from nrkdownload.scheduler import (
+    QueueOrder,
+    download_requests,
+    export_plans,
+    interleave,
+)
+from nrkdownload.settings import SpacePolicy
+from nrkdownload.state import JobStatus, QueueItem, StateIndex
+
+GB = 1024**3
+
+
+def test_interleave() -> None:  # noqa: D103
+    assert interleave([[1, 2, 3], [4], [], [5, 6]]) == [1, 4, 5, 2, 6, 3]
+    assert interleave([]) == []
+
+
+def test_queue_order(tmp_path: Path) -> None:  # noqa: D103
+    order = QueueOrder()
+    ranks = order.add(
+        [
+            QueueItem(program_id=program_id, directory=tmp_path, series_id="large")
+            for program_id in ["LARG00000001", "LARG00000002", "LARG00000003"]
+        ]
+    )
+    # A series that is queued later takes turns with the series before it
+    ranks |= order.add(
+        [QueueItem(program_id="SMAL00000001", directory=tmp_path, series_id="small")]
+    )
+    assert sorted(ranks, key=ranks.__getitem__) == [
+        "LARG00000001",
+        "SMAL00000001",
+        "LARG00000002",
+        "LARG00000003",
+    ]
+
+
+def make_plan(tmp_path: Path, series_id: str, episodes: int) -> DownloadPlan:
+    """Create a plan with resolved episodes of a series."""
+    jobs = [
+        ProgramJob(
+            program=TVProgram(
+                program_id=f"{series_id[:4].upper()}{episode:08d}",
+                title=f"Episode {episode}",
+                prod_year=2024,
+                duration=dt.timedelta(minutes=30),
+                image_url=None,
+                poster_url=None,
+                backdrop_url=None,
+                media_urls=[],
+            ),
+            directory=tmp_path / series_id,
+            series_id=series_id,
+            series_title=series_id,
+            estimated_size=0,
+        )
+        for episode in range(1, episodes + 1)
+    ]
+    return DownloadPlan(download_dir=tmp_path, jobs=jobs)
+
+
+def test_series_take_turns(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:  # noqa: D103
+    plans = {
+        "large": make_plan(tmp_path, "large", 4),
+        "small": make_plan(tmp_path, "small", 2),
+    }
+    monkeypatch.setattr(
+        scheduler, "plan_request", lambda request, *_: plans[request.series_id]
+    )
+    downloaded = []
+
+    def download_job(job: ProgramJob, *_: object) -> None:
+        if job.program.program_id == "SMAL00000002":
+            raise requests.ConnectionError("Connection reset")
+        downloaded.append(job.program.program_id)
+
+    monkeypatch.setattr(scheduler, "download_job", download_job)
+    download = [
+        SeriesRequest(url=f"https://tv.nrk.no/serie/{series_id}", series_id=series_id)
+        for series_id in plans
+    ]
+    # A failed episode fails its series, without stopping the other downloads
+    assert download_requests(download, tmp_path) == 1
+    assert downloaded == [
+        "LARG00000001",
+        "SMAL00000001",
+        "LARG00000002",
+        "LARG00000003",
+        "LARG00000004",
+    ]
+
+
+def test_unexpected_planning_errors_fail_one_url(  # noqa: D103
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    plan = make_plan(tmp_path, "good", 2)
+
+    def plan_request(request: SeriesRequest, *_: object) -> DownloadPlan:
+        if request.series_id == "broken":
+            raise KeyError("playable")
+        return plan
+
+    downloaded = []
+    monkeypatch.setattr(scheduler, "plan_request", plan_request)
+    monkeypatch.setattr(
+        scheduler,
+        "download_job",
+        lambda job, *_: downloaded.append(job.program.program_id),
+    )
+    download = [
+        SeriesRequest(url=f"https://tv.nrk.no/serie/{series_id}", series_id=series_id)
+        for series_id in ("broken", "good")
+    ]
+    # The URL that could not be planned fails, and the other is downloaded
+    assert download_requests(download, tmp_path) == 1
+    assert downloaded == ["GOOD00000001", "GOOD00000002"]
+
+
+def test_jobs_run_concurrently(  # noqa: D103
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    plan = make_plan(tmp_path, "series", 6)
+    monkeypatch.setattr(scheduler, "plan_request", lambda *_: plan)
+    monkeypatch.setattr(disk, "reserve", 0)
+    lock = threading.Lock()
+    running = [0]
+    most_running = [0]
+    downloaded = []
+
+    def download(job: ProgramJob, *_: object) -> Path:
+        with lock:
+            running[0] += 1
+            most_running[0] = max(most_running[0], running[0])
+        try:
+            time.sleep(0.05)
+            if job.program.program_id == "SERI00000002":
+                raise requests.ConnectionError("Connection reset")
+            downloaded.append(job.program.program_id)
+            return job.media_filename
+        finally:
+            with lock:
+                running[0] -= 1
+
+    monkeypatch.setattr(ProgramJob, "download", download)
+    request = SeriesRequest(url="https://tv.nrk.no/serie/series", series_id="series")
+    assert download_requests([request], tmp_path, jobs=2) == 1
+    assert most_running[0] == 2
+    # The failed episode does not stop the other episodes of the series
+    assert sorted(downloaded) == [f"SERI{episode:08d}" for episode in (1, 3, 4, 5, 6)]
+
+
+def test_failed_queue_items_are_counted(  # noqa: D103
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    items = [
+        QueueItem(program_id=f"SERI{episode:08d}", directory=tmp_path)
+        for episode in range(1, 4)
+    ]
+
+    def plan_request(*args: Any) -> DownloadPlan:  # noqa: ANN401
+        state, on_queued = args[3], args[4]
+        state.enqueue(items)
+        on_queued(items)
+        return DownloadPlan(
+            download_dir=tmp_path, queued=[item.program_id for item in items]
+        )
+
+    downloaded = []
+
+    def download_item(item: QueueItem, *_: object) -> tuple[JobStatus, str | None]:
+        if item.program_id == "SERI00000002":
+            return JobStatus.failed, "Connection reset"
+        if item.program_id == "SERI00000001":
+            raise KeyError("playable")
+        downloaded.append(item.program_id)
+        return JobStatus.done, None
+
+    monkeypatch.setattr(scheduler, "plan_request", plan_request)
+    monkeypatch.setattr(download_module, "download_item", download_item)
+    monkeypatch.setattr(state_module, "MAX_ATTEMPTS", 1)
+    state = StateIndex.for_download_dir(tmp_path)
+    request = SeriesRequest(url="https://tv.nrk.no/serie/series", series_id="series")
+    # Programs that are out of attempts fail the run, without stopping the others
+    assert download_requests([request], tmp_path, jobs=1, state=state) == 2
+    assert downloaded == ["SERI00000003"]
+
+
+def test_programs_that_do_not_fit_fail(  # noqa: D103
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    plan = make_plan(tmp_path, "series", 2)
+    # The plan fits when it is checked, but the volume fills up before the downloads
+    free = iter([100 * GB])
+    monkeypatch.setattr(diskspace, "free_space", lambda _: next(free, 2 * GB))
+    monkeypatch.setattr(disk, "reserve", GB)
+    monkeypatch.setattr(disk, "policy", SpacePolicy.refuse)
+    monkeypatch.setattr(ProgramJob, "estimate_size", lambda *_: 5 * GB)
+    monkeypatch.setattr(scheduler, "plan_request", lambda *_: plan)
+    downloaded = []
+    monkeypatch.setattr(ProgramJob, "download", lambda job, *_: downloaded.append(job))
+    request = SeriesRequest(url="https://tv.nrk.no/serie/series", series_id="series")
+    assert download_requests([request], tmp_path, jobs=2) == 1
+    assert downloaded == []
+
+
+def test_queue_items_that_do_not_fit_fail(  # noqa: D103
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    plan = make_plan(tmp_path, "series", 1)
+    (job,) = plan.jobs
+    item = QueueItem(program_id=job.program.program_id, directory=job.directory)
+
+    def plan_request(*args: Any) -> DownloadPlan:  # noqa: ANN401
+        state, on_queued = args[3], args[4]
+        state.enqueue([item])
+        on_queued([item])
+        return DownloadPlan(download_dir=tmp_path, queued=[item.program_id])
+
+    monkeypatch.setattr(diskspace, "free_space", lambda _: 2 * GB)
+    monkeypatch.setattr(disk, "reserve", GB)
+    monkeypatch.setattr(disk, "policy", SpacePolicy.refuse)
+    monkeypatch.setattr(ProgramJob, "estimate_size", lambda *_: 5 * GB)
+    monkeypatch.setattr(scheduler, "plan_request", plan_request)
+    monkeypatch.setattr(TVProgram, "from_program_id", lambda _: job.program)
+    downloaded = []
+    monkeypatch.setattr(ProgramJob, "download", lambda job, *_: downloaded.append(job))
+    monkeypatch.setattr(state_module, "MAX_ATTEMPTS", 1)
+    state = StateIndex.for_download_dir(tmp_path)
+    request = SeriesRequest(url="https://tv.nrk.no/serie/series", series_id="series")
+    # The program fails instead of waiting for space that never comes
+    assert download_requests([request], tmp_path, jobs=1, state=state) == 1
+    assert downloaded == []
+
+
+def test_shards_partition_programs() -> None:  # noqa: D103
+    shards = [Shard(index=index, count=3) for index in range(1, 4)]
+    program_ids = [f"MYNT{number:08d}" for number in range(900)]
+    sizes = [
+        sum(shard.contains(program_id) for program_id in program_ids)
+        for shard in shards
+    ]
+    # Every program is in exactly one shard, and the shards are about equally large
+    assert sum(sizes) == 900
+    assert min(sizes) > 250
+    # The assignment is the same on every machine
+    assert shards[0].assign("NNFA19010122") == 1
+    assert shards[0].assign("large") == 3
+
+
+def test_export_plans(tmp_path: Path) -> None:  # noqa: D103
+    plans = {"large": make_plan(tmp_path, "large", 4)}
+    filename = tmp_path / "plan.json"
+    assert export_plans(plans, filename, Shard(index=2, count=3)) == 4
+    exported = json.loads(filename.read_text())
+    assert exported["shard"] == "2/3"
+    assert [program["program_id"] for program in exported["programs"]] == [
+        f"LARG{episode:08d}" for episode in range(1, 5)
+    ]
+    assert exported["programs"][0]["duration"] == 1800
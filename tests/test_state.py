@@ -0,0 +1,188 @@
+"""Tests for the index of downloaded programs."""
+
+import sqlite3
+import subprocess
+import sys
+import threading
+import time
+from pathlib import Path
+
+from nrkdownload import state as state_module
+from nrkdownload.state import JobStatus, ProgramStatus, QueueItem, StateIndex
+
+# Claims programs from the queue in another process, until it is empty
+CLAIM_ALL = """
+import sys
+from pathlib import Path
+from nrkdownload.state import StateIndex
+state = StateIndex(Path(sys.argv[1]))
+while (item := state.claim_next()) is not None:
+    print(item.program_id, flush=True)
+"""
+
+
+def test_completed_programs(tmp_path: Path) -> None:  # noqa: D103
+    state = StateIndex.for_download_dir(tmp_path)
+    media_file = tmp_path / "Kongen av Gulset - s01e01 - 1. episode.m4v"
+    media_file.write_bytes(b"video")
+    state.record_program("MYNT19000118", ProgramStatus.done, media_file)
+    state.record_program("MYNT19000218", ProgramStatus.not_playable)
+
+    program_ids = ["MYNT19000118", "MYNT19000218", "MYNT19000318"]
+    assert state.completed_programs(program_ids) == {"MYNT19000118"}
+
+    # A truncated or deleted file is no longer considered downloaded
+    media_file.write_bytes(b"vid")
+    assert state.completed_programs(program_ids) == set()
+
+
+def test_download_queue(tmp_path: Path) -> None:  # noqa: D103
+    state = StateIndex.for_download_dir(tmp_path)
+    item = QueueItem(program_id="MYNT19000118", directory=tmp_path)
+    assert state.enqueue([item]) == 1
+    assert state.enqueue([item]) == 0
+    assert state.queued_programs(["MYNT19000118", "MYNT19000218"]) == {"MYNT19000118"}
+    assert state.claim_next() == item
+    assert state.claim_next() is None
+
+    # Another running process leaves the downloads in progress alone
+    other = StateIndex.for_download_dir(tmp_path)
+    assert other.requeue_in_progress() == 0
+
+    # A new process continues the downloads left by a stopped process
+    state.close()
+    with other._connection:
+        other._connection.execute("UPDATE queue SET heartbeat_at = '2000-01-01'")
+    assert other.requeue_in_progress() == 1
+    assert other.claim_next() == item
+
+
+def test_claims_across_processes(tmp_path: Path) -> None:  # noqa: D103
+    path = tmp_path / state_module.STATE_FILENAME
+    program_ids = [f"MYNT{number:08d}" for number in range(300)]
+    StateIndex(path).enqueue(
+        [
+            QueueItem(program_id=program_id, directory=tmp_path)
+            for program_id in program_ids
+        ]
+    )
+    processes = [
+        subprocess.Popen(  # noqa: S603
+            [sys.executable, "-c", CLAIM_ALL, str(path)],
+            stdout=subprocess.PIPE,
+            text=True,
+        )
+        for _ in range(4)
+    ]
+    claimed = [
+        line for process in processes for line in process.communicate()[0].split()
+    ]
+    # Each program is claimed by exactly one process
+    assert sorted(claimed) == program_ids
+
+
+def test_index_is_migrated_once(tmp_path: Path) -> None:  # noqa: D103
+    path = tmp_path / state_module.STATE_FILENAME
+    # Another process is adding the new columns to an index from an older release
+    other = sqlite3.connect(path)
+    other.executescript(state_module.SCHEMA)
+    other.execute("BEGIN IMMEDIATE")
+    opened = []
+    thread = threading.Thread(target=lambda: opened.append(StateIndex(path)))
+    thread.start()
+    time.sleep(0.2)
+    columns = {row[1] for row in other.execute("PRAGMA table_info(queue)")}
+    for name, definition in state_module.MIGRATIONS["queue"].items():
+        if name not in columns:
+            other.execute(f"ALTER TABLE queue ADD COLUMN {name} {definition}")
+    other.commit()
+    other.close()
+    thread.join()
+    # The index waits for the other migration, instead of adding the columns again
+    assert len(opened) == 1
+
+
+def test_heartbeat_keeps_claims_alive(tmp_path: Path) -> None:  # noqa: D103
+    path = tmp_path / state_module.STATE_FILENAME
+    state = StateIndex(path, heartbeat_seconds=0.01, stale_seconds=1)
+    state.enqueue([QueueItem(program_id="MYNT19000118", directory=tmp_path)])
+    assert state.claim_next() is not None
+    with state._connection:
+        state._connection.execute("UPDATE queue SET heartbeat_at = '2000-01-01'")
+    time.sleep(0.2)
+    assert StateIndex(path).requeue_in_progress() == 0
+
+
+def test_failed_downloads_are_retried(tmp_path: Path) -> None:  # noqa: D103
+    state = StateIndex.for_download_dir(tmp_path)
+    items = [
+        QueueItem(program_id="MYNT19000118", directory=tmp_path),
+        QueueItem(program_id="MYNT19000218", directory=tmp_path),
+    ]
+    state.enqueue(items)
+    state.add_to_run("run", {"MYNT19000118": (0, 0), "MYNT19000218": (1, 0)})
+    assert state.seconds_until_next("run") == 0
+
+    # A failed download waits for its backoff, while other programs are claimed
+    item = state.claim_next("run")
+    assert item == items[0]
+    state.finish(item.program_id, JobStatus.failed, "Connection reset")
+    assert state.claim_next("run") == items[1]
+    state.finish(items[1].program_id, JobStatus.done)
+    assert state.claim_next("run") is None
+    delay = state.seconds_until_next("run")
+    assert delay is not None
+    assert 0 < delay <= state_module.RETRY_BACKOFF.total_seconds()
+
+    # Out of attempts, the program is given up until it is queued again
+    with state._connection:
+        state._connection.execute("UPDATE queue SET next_attempt_at = ''")
+    for _ in range(state_module.MAX_ATTEMPTS - 1):
+        assert state.claim_next("run") == items[0]
+        state.finish(items[0].program_id, JobStatus.failed)
+        with state._connection:
+            state._connection.execute("UPDATE queue SET next_attempt_at = ''")
+    assert state.claim_next("run") is None
+    assert state.seconds_until_next("run") is None
+    assert state.enqueue(items, reset=True) == 2
+    state.add_to_run("retry", {"MYNT19000218": (0, 0)})
+    assert state.claim_next("retry") == items[1]
+
+
+def test_deferred_downloads_keep_their_attempts(tmp_path: Path) -> None:  # noqa: D103
+    state = StateIndex.for_download_dir(tmp_path)
+    item = QueueItem(program_id="MYNT19000118", directory=tmp_path)
+    state.enqueue([item])
+    for _ in range(state_module.MAX_ATTEMPTS + 1):
+        assert state.claim_next() == item
+        state.finish(item.program_id, JobStatus.deferred, "Locked")
+        assert state.claim_next() is None
+        delay = state.seconds_until_next()
+        assert delay is not None
+        assert 0 < delay <= state_module.RETRY_BACKOFF.total_seconds()
+        with state._connection:
+            state._connection.execute("UPDATE queue SET next_attempt_at = ''")
+    assert state.claim_next() == item
+
+
+def test_claim_in_given_order(tmp_path: Path) -> None:  # noqa: D103
+    state = StateIndex.for_download_dir(tmp_path)
+    program_ids = ["MYNT19000118", "MYNT19000218", "MYNT19000318"]
+    state.enqueue(
+        [
+            QueueItem(program_id=program_id, directory=tmp_path)
+            for program_id in program_ids
+        ]
+    )
+    state.add_to_run("run", {"MYNT19000318": (0, 1), "MYNT19000118": (1, 0)})
+    claimed = [item.program_id for item in iter(lambda: state.claim_next("run"), None)]
+    assert claimed == ["MYNT19000318", "MYNT19000118"]
+
+    # The programs left in a stopped run stay in the queue
+    state.enqueue([QueueItem(program_id="MYNT19000418", directory=tmp_path)])
+    state.add_to_run("stopped", {"MYNT19000418": (0, 0)})
+    state.end_run("stopped")
+    assert state.seconds_until_next("stopped") is None
+    assert state.claim_next() == QueueItem(
+        program_id="MYNT19000218", directory=tmp_path
+    )
@@ -0,0 +1,43 @@
+"""Tests for selecting subtitle tracks."""
+
+from pathlib import Path
+
+from nrkdownload.subtitles import SubtitleTrack, select_subtitles, subtitle_filenames
+
+TRACKS = [
+    SubtitleTrack.from_manifest(
+        {
+            "webVtt": "https://undertekst.nrk.no/nor.vtt",
+            "language": "nb",
+            "type": "nor",
+            "defaultOn": True,
+        }
+    ),
+    SubtitleTrack.from_manifest(
+        {
+            "webVtt": "https://undertekst.nrk.no/ttv.vtt",
+            "language": "nb",
+            "type": "ttv",
+            "defaultOn": False,
+        }
+    ),
+    SubtitleTrack.from_manifest(
+        {"webVtt": "https://undertekst.nrk.no/en.vtt", "language": "en"}
+    ),
+]
+
+
+def test_select_subtitles() -> None:  # noqa: D103
+    assert select_subtitles(TRACKS, []) == TRACKS[:1]
+    assert select_subtitles(TRACKS, ["all"]) == TRACKS
+    assert select_subtitles(TRACKS, ["ttv"]) == TRACKS[1:2]
+    assert select_subtitles(TRACKS, ["no"]) == TRACKS[:2]
+    assert select_subtitles(TRACKS, ["en", "nor"]) == [TRACKS[0], TRACKS[2]]
+
+
+def test_subtitle_filenames() -> None:  # noqa: D103
+    assert subtitle_filenames(Path("Title"), TRACKS) == [
+        Path("Title.no.srt"),
+        Path("Title.no.ttv.srt"),
+        Path("Title.en.srt"),
+    ]
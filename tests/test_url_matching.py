@@ -1,6 +1,13 @@
 """Tests for the URL matching functions in nrkdownload.cli."""
 
-from nrkdownload.cli import match_program_url, match_series_url
+import io
+import sys
+from pathlib import Path
+
+import pytest
+
+from nrkdownload.cli import iter_urls, match_program_url, match_series_url, parse_url
+from nrkdownload.plan import deduplicate
 
 
 def test_match_program_url() -> None:  # noqa: D103
@@ -47,3 +54,35 @@ def test_match_news_series_url() -> None:  # noqa: D103
         "https://tv.nrk.no/serie/dagsrevyen-21/202203/NNFA21030122/avspiller"
     )
     assert match == ("dagsrevyen-21", "202203", "NNFA21030122")
+
+
+def test_deduplicate_requests(tmp_path: Path) -> None:  # noqa: D103
+    input_file = tmp_path / "urls.txt"
+    input_file.write_text(
+        "# Generated list of URLs\n"
+        "https://tv.nrk.no/serie/kongen-av-gulset/sesong/1/episode/MYNT19000318\n"
+        "https://tv.nrk.no/serie/kongen-av-gulset\n"
+        "\n"
+        "https://tv.nrk.no/serie/dagsrevyen-21/202203/NNFA21030122/avspiller\n"
+        "https://tv.nrk.no/serie/dagsrevyen-21/202203\n"
+        "https://tv.nrk.no/program/KOID75000320\n"
+        "https://tv.nrk.no/program/KOID75000320\n"
+    )
+    urls = list(iter_urls(["https://tv.nrk.no/program/KOID75000320"], input_file))
+    assert len(urls) == 7
+
+    requests = [request for url in urls if (request := parse_url(url))]
+    unique = deduplicate(requests)
+    assert [request.url for request in unique] == [
+        "https://tv.nrk.no/program/KOID75000320",
+        "https://tv.nrk.no/serie/kongen-av-gulset",
+        "https://tv.nrk.no/serie/dagsrevyen-21/202203",
+    ]
+
+
+def test_urls_from_stdin(monkeypatch: pytest.MonkeyPatch) -> None:  # noqa: D103
+    stdin = io.StringIO("https://tv.nrk.no/program/KOID75000320\n")
+    monkeypatch.setattr(sys, "stdin", stdin)
+    urls = list(iter_urls([], Path("-")))
+    assert urls == ["https://tv.nrk.no/program/KOID75000320"]
+    assert not stdin.closed
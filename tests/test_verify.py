@@ -0,0 +1,103 @@
+"""Tests for the integrity checks of downloaded media files."""
+
+import datetime as dt
+import struct
+from pathlib import Path
+
+import pytest
+
+from nrkdownload.state import JobStatus, ProgramStatus, QueueItem, StateIndex
+from nrkdownload.verify import (
+    IncompleteMediaError,
+    probe_mp4,
+    verify_library,
+    verify_media,
+)
+
+
+def box(kind: bytes, *children: bytes) -> bytes:
+    """Create an MP4 box with the given content."""
+    content = b"".join(children)
+    return struct.pack(">I4s", 8 + len(content), kind) + content
+
+
+def track(handler: bytes) -> bytes:
+    """Create a track with a handler of the given type."""
+    return box(b"trak", box(b"mdia", box(b"hdlr", bytes(8), handler, bytes(12))))
+
+
+def mp4(seconds: int, handlers: tuple[bytes, ...] = (b"vide", b"soun")) -> bytes:
+    """Create a small MP4 file, with a timescale of 1000."""
+    mvhd = box(b"mvhd", bytes(12), struct.pack(">II", 1000, seconds * 1000), bytes(80))
+    return (
+        box(b"ftyp", b"isom", bytes(4))
+        + box(b"moov", mvhd, *(track(handler) for handler in handlers))
+        + box(b"mdat", bytes(1000))
+    )
+
+
+def test_probe_mp4(tmp_path: Path) -> None:  # noqa: D103
+    filename = tmp_path / "video.m4v"
+    filename.write_bytes(mp4(60, (b"vide", b"soun", b"sbtl")))
+    info = probe_mp4(filename)
+    assert info.duration == dt.timedelta(seconds=60)
+    assert info.streams == ["video", "audio", "subtitle"]
+
+
+def test_incomplete_media(tmp_path: Path) -> None:  # noqa: D103
+    filename = tmp_path / "video.m4v"
+    filename.write_bytes(mp4(60)[:-10])
+    with pytest.raises(IncompleteMediaError, match=r"mdat box .* is truncated"):
+        verify_media(filename)
+
+    filename.write_bytes(mp4(60, (b"vide",)))
+    with pytest.raises(IncompleteMediaError, match="no audio"):
+        verify_media(filename)
+
+    # Programs without audio, or video, only need the tracks they have
+    verify_media(filename, expected_streams={"video"})
+    verify_media(filename, expected_streams=None)
+    filename.write_bytes(mp4(60, (b"sbtl",)))
+    with pytest.raises(IncompleteMediaError, match="no video or audio"):
+        verify_media(filename, expected_streams=None)
+
+    filename.write_bytes(box(b"moov", box(b"mvhd", bytes(12))))
+    with pytest.raises(IncompleteMediaError, match="movie header is truncated"):
+        verify_media(filename)
+
+    filename.write_bytes(mp4(60))
+    verify_media(filename, dt.timedelta(seconds=65))
+    with pytest.raises(IncompleteMediaError, match="60 seconds long"):
+        verify_media(filename, dt.timedelta(minutes=30))
+
+
+def test_verify_library(tmp_path: Path) -> None:  # noqa: D103
+    state = StateIndex.for_download_dir(tmp_path)
+    complete = tmp_path / "Series" / "s01e01.m4v"
+    short = tmp_path / "Series" / "s01e02.m4v"
+    complete.parent.mkdir()
+    complete.write_bytes(mp4(60))
+    short.write_bytes(mp4(60))
+    state.record_program(
+        "MYNT19000118", ProgramStatus.done, complete, duration=dt.timedelta(minutes=1)
+    )
+    state.record_program(
+        "MYNT19000218", ProgramStatus.done, short, duration=dt.timedelta(minutes=30)
+    )
+    state.enqueue([QueueItem(program_id="MYNT19000218", directory=short.parent)])
+    assert state.claim_next() is not None
+    state.finish("MYNT19000218", JobStatus.done)
+    # Files that are not in the index are only checked for truncation
+    (tmp_path / "Other.m4v").write_bytes(mp4(60)[:-10])
+
+    checked, problems = verify_library(tmp_path, state)
+    assert checked == 3
+    assert set(problems) == {short.resolve(), (tmp_path / "Other.m4v").resolve()}
+
+    verify_library(tmp_path, state, requeue=True)
+    assert not short.exists()
+    assert short.with_name("s01e02.m4v.incomplete").exists()
+    assert state.claim_next() == QueueItem(
+        program_id="MYNT19000218", directory=short.parent
+    )
+    assert verify_library(tmp_path, state) == (1, {})
@@ -0,0 +1,112 @@
+"""Tests for watching series for new episodes."""
+
+from __future__ import annotations
+
+from pathlib import Path
+from typing import Any
+
+import pytest
+import rich.progress
+
+from nrkdownload import download as download_module
+from nrkdownload import nrk_tv
+from nrkdownload.state import JobStatus, QueueItem, StateIndex
+from nrkdownload.watch import DEFAULT_POLL_INTERVALS, Watcher
+
+
+class FakeAPI:
+    """A news series with two seasons. Only the latest season may be polled."""
+
+    def __init__(self) -> None:  # noqa: D107
+        self.episodes = ["DKOV98040122", "DKOV98040222"]
+
+    def get_json(self, path: str) -> Any:  # noqa: ANN401, D102
+        if path.endswith("/seasons/202204"):
+            return {
+                "seriesType": "news",
+                "titles": {"title": "April 2022"},
+                "_embedded": {
+                    "instalments": [{"prfId": prf_id} for prf_id in self.episodes]
+                },
+            }
+        if path.endswith("/distriktsnyheter"):
+            return {
+                "seriesType": "news",
+                "news": {"titles": {"title": "Distriktsnyheter"}},
+                "_links": {
+                    "seasons": [
+                        {"name": "202203", "title": "Mars 2022"},
+                        {"name": "202204", "title": "April 2022"},
+                    ]
+                },
+            }
+        raise AssertionError(f"Unexpected request for {path}")
+
+
+def test_poll_latest_season(  # noqa: D103
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    api = FakeAPI()
+    monkeypatch.setattr(nrk_tv.client, "get_json", api.get_json)
+    state = StateIndex.for_download_dir(tmp_path)
+    watcher = Watcher(tmp_path, ["distriktsnyheter"], state)
+    subscription = watcher.subscriptions[0]
+
+    assert watcher.poll(subscription) == 2
+    item = state.claim_next()
+    assert item is not None
+    assert item.program_id == "DKOV98040122"
+    assert item.directory == tmp_path / "Distriktsnyheter" / "Season 202204"
+    assert item.sequence_string == "202204"
+    state.finish(item.program_id, JobStatus.done)
+
+    # Episodes that are already queued are not queued again, and the series is
+    # polled less often when nothing new is found
+    news_interval = DEFAULT_POLL_INTERVALS[nrk_tv.TVSeriesType.news].total_seconds()
+    assert subscription.interval(watcher.intervals) == news_interval
+    assert watcher.poll(subscription) == 0
+    assert subscription.interval(watcher.intervals) > news_interval
+
+    api.episodes.append("DKOV98040322")
+    assert watcher.poll(subscription) == 1
+    assert subscription.interval(watcher.intervals) == news_interval
+
+
+def test_worker_survives_errors(  # noqa: D103
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    state = StateIndex.for_download_dir(tmp_path)
+    state.enqueue(
+        [
+            QueueItem(program_id=program_id, directory=tmp_path)
+            for program_id in ["DKOV98040122", "DKOV98040222"]
+        ]
+    )
+    watcher = Watcher(tmp_path, ["distriktsnyheter"], state)
+    downloaded = []
+
+    def download_item(item: QueueItem, *_: object) -> tuple[JobStatus, None]:
+        if item.program_id == "DKOV98040122":
+            raise OSError("Stale file handle")
+        downloaded.append(item.program_id)
+        watcher.stop.set()
+        return JobStatus.done, None
+
+    monkeypatch.setattr(download_module, "download_item", download_item)
+    watcher.work(rich.progress.Progress(disable=True))
+    # The failed program is retried later, instead of being left in progress
+    assert downloaded == ["DKOV98040222"]
+    assert state.seconds_until_next() > 0
+
+
+def test_poll_survives_errors(  # noqa: D103
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    def get_json(path: str) -> Any:  # noqa: ANN401
+        raise KeyError(f"_links in {path}")
+
+    monkeypatch.setattr(nrk_tv.client, "get_json", get_json)
+    state = StateIndex.for_download_dir(tmp_path)
+    watcher = Watcher(tmp_path, ["distriktsnyheter"], state)
+    # The series is polled again later, instead of stopping the watcher
+    assert watcher.poll_due() > 0